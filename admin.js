@@ -223,10 +223,8 @@ function initializeSecurityChart() {
         });
     }
 
-    // Simulate real-time updates with layout preservation
-    setInterval(() => {
-        updateChartData(securityChart);
-    }, 30000); // Update every 30 seconds
+    // Live counts pushed by the server (snapshot, then deltas) instead of refetching
+    connectLiveAnalytics(securityChart);
 
     // Return chart instance for potential external access
     return securityChart;
@@ -264,15 +262,70 @@ function updateChartTheme(chart) {
     chart.update();
 }
 
-// Simulate real-time data updates
-function updateChartData(chart) {
-    // Add small random variations to simulate real-time data
-    chart.data.datasets.forEach(dataset => {
-        dataset.data = dataset.data.map(value => {
-            const variation = Math.random() * 6 - 3; // -3 to +3
-            return Math.max(0, Math.round(value + variation));
-        });
+// Actions counted as security threats on the chart
+const THREAT_ACTIONS = ['multiple_failed_logins', 'activity_rate_anomaly', 'brute_force_attempt', 'unauthorized_access'];
+
+// Subscribe to the tenant's live analytics: an analytics_snapshot of the
+// hourly counts, then analytics_delta frames with only what changed
+function connectLiveAnalytics(chart) {
+    const token = localStorage.getItem('admin_token');
+    if (!token) return;
+    const state = { hours: 24, buckets: {}, suspicious: {}, countedAt: 0 };
+    const socket = new WebSocket(`ws://localhost:8000/ws/admin?topics=analytics,alerts&token=${encodeURIComponent(token)}`);
+
+    socket.addEventListener('message', function (event) {
+        const message = JSON.parse(event.data);
+        if (message.type === 'analytics_snapshot') {
+            state.hours = message.hours;
+            state.buckets = message.buckets;
+            state.suspicious = message.suspicious;
+            state.countedAt = message.counted_at;
+        } else if (message.type === 'analytics_delta') {
+            // Rows committed before the snapshot's count are already in it
+            if (message.last_commit < state.countedAt) return;
+            Object.entries(message.buckets).forEach(([bucket, counts]) => {
+                const current = state.buckets[bucket] = state.buckets[bucket] || {};
+                Object.entries(counts).forEach(([action, count]) => {
+                    current[action] = (current[action] || 0) + count;
+                });
+            });
+            Object.entries(message.suspicious).forEach(([bucket, count]) => {
+                state.suspicious[bucket] = (state.suspicious[bucket] || 0) + count;
+            });
+        } else {
+            return;
+        }
+        updateChartData(chart, state);
     });
-    
+
+    // Reconnecting gets a fresh snapshot
+    socket.addEventListener('close', function (event) {
+        if (event.code !== 1008) {
+            setTimeout(() => connectLiveAnalytics(chart), 3000);
+        }
+    });
+}
+
+// Redraw the chart from the live hourly buckets
+function updateChartData(chart, state) {
+    const hour = new Date();
+    hour.setUTCMinutes(0, 0, 0);
+    const labels = [], normal = [], suspicious = [], threats = [];
+    for (let i = state.hours - 1; i >= 0; i--) {
+        const start = new Date(hour.getTime() - i * 3600 * 1000);
+        const bucket = start.toISOString().replace('.000Z', '+00:00');
+        const counts = state.buckets[bucket] || {};
+        const total = Object.values(counts).reduce((sum, count) => sum + count, 0);
+        const flagged = state.suspicious[bucket] || 0;
+        labels.push(start.toTimeString().slice(0, 5));
+        normal.push(total - flagged);
+        suspicious.push(flagged);
+        threats.push(THREAT_ACTIONS.reduce((sum, action) => sum + (counts[action] || 0), 0));
+    }
+    chart.data.labels = labels;
+    chart.data.datasets[0].data = normal;
+    chart.data.datasets[1].data = suspicious;
+    chart.data.datasets[2].data = threats;
+
     chart.update('none'); // Update without animation for smoother real-time feel
 }
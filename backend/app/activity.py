@@ -1,69 +1,536 @@
+from sqlalchemy import Select, select, func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models
-from datetime import datetime, UTC
-from typing import List, Optional
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from . import models, schemas, activity_writer, anomaly, archive, pagination, counters, rollups, rules, live_analytics
+from datetime import datetime, date, UTC
+from typing import Any, Iterable, List, Dict, Optional, Set, Union
 
-def log_activity(db: Session, user_id: int, action: str, details: Optional[str] = None):
+# Largest number of events accepted by one batch ingest request
+MAX_BATCH_EVENTS = 1000
+
+# Keyword buckets used by the statistics endpoints. An action falls into a
+# bucket when its name contains any of the keywords (case-insensitive).
+ACTIVITY_BUCKETS = {
+    "login": ("login",),
+    "file": ("file",),
+    "system": ("system",),
+    "successful": ("success", "completed"),
+    "failed": ("failed", "error"),
+}
+
+class ActivityRow:
+    """
+    An activity as listed by the paginated endpoints: the columns of
+    schemas.ActivityLog only. Much cheaper to build than an ORM entity, and
+    pydantic reads a slotted object's attributes (from_attributes) several
+    times faster than a SQLAlchemy Row's.
+    """
+    __slots__ = ("id", "action", "details", "timestamp")
+
+    def __init__(self, id: int, action: str, details: Optional[str], timestamp: datetime):
+        self.id = id
+        self.action = action
+        self.details = details
+        self.timestamp = timestamp
+
+# Columns selected for ActivityRow, in its constructor's order
+ACTIVITY_ROW_COLUMNS = (
+    models.ActivityLog.id,
+    models.ActivityLog.action,
+    models.ActivityLog.details,
+    models.ActivityLog.timestamp,
+)
+# Every column, for the listings returned as plain dicts
+ACTIVITY_COLUMNS = tuple(models.ActivityLog.__table__.columns)
+
+def log_activity(
+    db: Session,
+    user_id: int,
+    action: str,
+    details: Optional[str] = None,
+    wait: bool = True,
+    ip: Optional[str] = None
+):
     """
-    Log user activity to the database
+    Log user activity to the database.
+    With wait=False the event is handed to the buffered writer (when it is
+    running) and None is returned; otherwise the row is written immediately
+    and returned with its generated id. The event is also fed to the anomaly
+    detector, with the client IP when known.
     """
+    anomaly.detector.observe(user_id, action, ip)
+    if not wait and activity_writer.writer.running:
+        if activity_writer.writer.submit(user_id, action, details):
+            return None
+
     activity_log = models.ActivityLog(
         user_id=user_id,
         action=action,
         details=details,
-        timestamp=datetime.now(UTC)
+        timestamp=datetime.now(UTC),
+        **rules.registry.fields(action)
     )
     db.add(activity_log)
     db.commit()
     db.refresh(activity_log)
     return activity_log
 
-def get_user_activities(db: Session, user_id: int, limit: int = 100) -> List[models.ActivityLog]:
+def insert_activities(db: Session, rows: List[Dict]) -> int:
     """
-    Get activity logs for a specific user
+    Write many activity rows with a single multi-row INSERT.
+    Each row is a dict with user_id, action, details and timestamp; rows are
+    classified here (see app.rules).
     """
-    return db.query(models.ActivityLog).filter(
-        models.ActivityLog.user_id == user_id
-    ).order_by(models.ActivityLog.timestamp.desc()).limit(limit).all()
+    if not rows:
+        return 0
+    rows = [{**row, **rules.registry.fields(row["action"])} for row in rows]
+    db.execute(insert(models.ActivityLog), rows)
+    # Core inserts skip the ORM flush hook, so the dashboard counters are updated here
+    counters.apply_deltas(
+        db.connection(), counters.activity_deltas((row["suspicious"], row.get("timestamp")) for row in rows)
+    )
+    # ... and the live dashboards once committed
+    live_analytics.record(db, rows)
+    db.commit()
+    return len(rows)
 
-def get_all_activities(db: Session, limit: int = 100) -> List[models.ActivityLog]:
+def can_log_for(principal: schemas.Principal, user_id: int) -> bool:
     """
-    Get all activity logs (for admin monitoring)
+    Users can only log their own activities; admins can log anyone's
     """
-    return db.query(models.ActivityLog).order_by(
-        models.ActivityLog.timestamp.desc()
-    ).limit(limit).all()
+    return principal.role == "admin" or principal.id == user_id
 
-def get_activities_by_time_range(db: Session, start_time: datetime, end_time: datetime) -> List[models.ActivityLog]:
+def existing_user_ids(db: Session, user_ids: Iterable[int]) -> Set[int]:
     """
-    Get activities within a specific time range
+    The ids among `user_ids` that belong to a user, in one query
     """
-    return db.query(models.ActivityLog).filter(
-        models.ActivityLog.timestamp >= start_time,
-        models.ActivityLog.timestamp <= end_time
-    ).order_by(models.ActivityLog.timestamp.desc()).all()
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    return set(db.scalars(select(models.User.id).where(models.User.id.in_(user_ids))))
+
+def validation_detail(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, error['loc'])) or 'event'}: {error['msg']}" for error in exc.errors())
+
+def log_activity_batch(db: Session, principal: schemas.Principal, events: List[Any], ip: Optional[str] = None) -> Dict:
+    """
+    Validate a batch of events and write the valid ones with a single
+    multi-row INSERT. Every event gets a status in `results`, in request
+    order; invalid events are rejected without failing the rest.
+    """
+    now = datetime.now(UTC)
+    results: List[Dict] = []
+    parsed: Dict[int, schemas.ActivityLogEvent] = {}
+    for index, event in enumerate(events):
+        try:
+            item = schemas.ActivityLogEvent.model_validate(event)
+        except ValidationError as exc:
+            results.append(_rejected(index, validation_detail(exc)))
+            continue
+        if not can_log_for(principal, item.user_id):
+            results.append(_rejected(index, "Can only log your own activities"))
+            continue
+        parsed[index] = item
+        results.append({"index": index, "status": "accepted"})
+
+    # Admins may log for other users; check they exist in one query
+    # instead of letting a foreign key error fail the whole INSERT
+    other_ids = {item.user_id for item in parsed.values()} - {principal.id}
+    if other_ids:
+        known = existing_user_ids(db, other_ids) | {principal.id}
+        for index in [index for index, item in parsed.items() if item.user_id not in known]:
+            results[index] = _rejected(index, "User not found")
+            del parsed[index]
+
+    insert_activities(db, [
+        {"user_id": item.user_id, "action": item.action, "details": item.details, "timestamp": now}
+        for item in parsed.values()
+    ])
+    for item in parsed.values():
+        anomaly.detector.observe(item.user_id, item.action, ip)
+    return {"accepted": len(parsed), "rejected": len(results) - len(parsed), "results": results}
+
+def _rejected(index: int, detail: str) -> Dict:
+    return {"index": index, "status": "rejected", "detail": detail}
+
+def get_user_activities(
+    db: Session,
+    user_id: int,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[ActivityRow]:
+    """
+    Get activity logs for a specific user, newest first.
+    Pass the cursor of the previous page to continue after it.
+    """
+    return _activity_rows(db.execute(_user_activities_stmt(user_id, limit, cursor)))
+
+def get_all_activities(db: Session, limit: int = 100, cursor: Optional[str] = None) -> List[ActivityRow]:
+    """
+    Get all activity logs (for admin monitoring), newest first.
+    Pass the cursor of the previous page to continue after it.
+    """
+    return _activity_rows(db.execute(_all_activities_stmt(limit, cursor)))
+
+def get_activities_by_time_range(db: Session, start_time: datetime, end_time: datetime) -> List[Dict]:
+    """
+    Get activities within a specific time range, as dicts of their columns
+    """
+    return _dicts(db.execute(_time_range_activities_stmt(start_time, end_time)))
+
+def get_activities_by_action(
+    db: Session,
+    action: str,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[Dict]:
+    """
+    Get activities filtered by action type, newest first, as dicts of their
+    columns. Pass the cursor of the previous page to continue after it.
+    """
+    return _dicts(db.execute(_activities_by_action_stmt(action, limit, cursor)))
+
+def get_suspicious_activities(db: Session, limit: int = 50) -> List[Dict]:
+    """
+    Get potentially suspicious activities, as dicts of their columns
+    """
+    return _dicts(db.execute(_suspicious_activities_stmt(limit)))
+
+def get_user_activities_by_time_range(
+    db: Session,
+    user_id: int,
+    start_time: datetime,
+    end_time: datetime,
+    limit: Optional[int] = None
+) -> List[Dict]:
+    """
+    Get a single user's activities within a time range, newest first, as
+    dicts of their columns
+    """
+    return _dicts(db.execute(_time_range_activities_stmt(start_time, end_time, user_id, limit)))
 
-def get_activities_by_action(db: Session, action: str, limit: int = 100) -> List[models.ActivityLog]:
+def get_users_activities_by_time_range(
+    db: Session,
+    user_ids: Union[List[int], Select],
+    start_time: datetime,
+    end_time: datetime
+) -> List[Dict]:
     """
-    Get activities filtered by action type
+    Get activities of a set of users (a list of ids, or a select of them)
+    within a time range, newest first, as dicts of their columns
     """
-    return db.query(models.ActivityLog).filter(
-        models.ActivityLog.action == action
-    ).order_by(models.ActivityLog.timestamp.desc()).limit(limit).all()
+    if not isinstance(user_ids, Select) and not user_ids:
+        return []
+    stmt = _time_range_activities_stmt(start_time, end_time).where(
+        models.ActivityLog.user_id.in_(user_ids)
+    )
+    return _dicts(db.execute(stmt))
+
+def count_activities(
+    db: Session,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> int:
+    """
+    Count activities within a time range
+    """
+    return db.execute(_count_stmt(start_time, end_time, user_id)).scalar_one()
+
+def count_activities_by_action(
+    db: Session,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Count activities per action within a time range. Whole hours and days
+    are read from the rollups (see app/rollups.py), the rest from
+    activity_logs, or from the archive for retired months (app/archive.py).
+    """
+    watermarks = rollups.get_watermarks(db)
+    archived_until = archive.archived_until()
+    counts = _archived_counts(
+        archive.count_by_action, _archive_pieces(start_time, end_time, watermarks, archived_until), user_id
+    )
+    stmt = rollups.counts_by_action_stmt(start_time, end_time, watermarks, user_id, archived_until)
+    rows = db.execute(stmt).all() if stmt is not None else []
+    return _merge_counts(counts, ((action, count) for action, count in rows))
+
+def count_activities_by_day(
+    db: Session,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Count activities per calendar day within a time range, from the rollups
+    where possible
+    """
+    watermarks = rollups.get_watermarks(db)
+    archived_until = archive.archived_until()
+    counts = _archived_counts(
+        archive.count_by_day, _archive_pieces(start_time, end_time, watermarks, archived_until), user_id
+    )
+    stmt = rollups.counts_by_day_stmt(start_time, end_time, watermarks, user_id, archived_until)
+    rows = db.execute(stmt).all() if stmt is not None else []
+    return _merge_counts(counts, ((_date_key(value), count) for value, count in rows))
 
-def get_suspicious_activities(db: Session, limit: int = 50) -> List[models.ActivityLog]:
+def get_activity_buckets(
+    db: Session,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict:
     """
-    Get potentially suspicious activities
+    Count activities per keyword bucket (see ACTIVITY_BUCKETS) from the
+    per-action counts. Also returns the total and the most recent login
+    timestamp in the window.
     """
-    suspicious_actions = [
-        "failed_login",
-        "file_access_denied",
-        "unauthorized_access_attempt",
-        "multiple_failed_logins",
-        "suspicious_file_access",
-        "admin_action_attempted"
+    action_counts = count_activities_by_action(db, start_time, end_time, user_id)
+    last_login = db.scalar(_last_login_stmt(start_time, end_time, user_id))
+    return _buckets_from_counts(action_counts, last_login)
+
+# Async variants, for use with an AsyncSession (see database.get_async_db)
+
+async def log_activity_async(
+    db: AsyncSession,
+    user_id: int,
+    action: str,
+    details: Optional[str] = None,
+    wait: bool = True,
+    ip: Optional[str] = None
+):
+    """
+    Async variant of log_activity. Never blocks on a full write buffer; the
+    row is written directly instead.
+    """
+    anomaly.detector.observe(user_id, action, ip)
+    if not wait and activity_writer.writer.running:
+        if activity_writer.writer.submit(user_id, action, details, block=False):
+            return None
+
+    activity_log = models.ActivityLog(
+        user_id=user_id,
+        action=action,
+        details=details,
+        timestamp=datetime.now(UTC),
+        **rules.registry.fields(action)
+    )
+    db.add(activity_log)
+    await db.commit()
+    await db.refresh(activity_log)
+    return activity_log
+
+async def get_user_activities_async(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[ActivityRow]:
+    return _activity_rows(await db.execute(_user_activities_stmt(user_id, limit, cursor)))
+
+async def get_all_activities_async(
+    db: AsyncSession,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[ActivityRow]:
+    return _activity_rows(await db.execute(_all_activities_stmt(limit, cursor)))
+
+async def get_activities_by_time_range_async(
+    db: AsyncSession,
+    start_time: datetime,
+    end_time: datetime
+) -> List[Dict]:
+    return _dicts(await db.execute(_time_range_activities_stmt(start_time, end_time)))
+
+async def get_activities_by_action_async(
+    db: AsyncSession,
+    action: str,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[Dict]:
+    return _dicts(await db.execute(_activities_by_action_stmt(action, limit, cursor)))
+
+async def get_suspicious_activities_async(db: AsyncSession, limit: int = 50) -> List[Dict]:
+    return _dicts(await db.execute(_suspicious_activities_stmt(limit)))
+
+async def get_user_activities_by_time_range_async(
+    db: AsyncSession,
+    user_id: int,
+    start_time: datetime,
+    end_time: datetime,
+    limit: Optional[int] = None
+) -> List[Dict]:
+    stmt = _time_range_activities_stmt(start_time, end_time, user_id, limit)
+    return _dicts(await db.execute(stmt))
+
+async def count_activities_async(
+    db: AsyncSession,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> int:
+    return (await db.execute(_count_stmt(start_time, end_time, user_id))).scalar_one()
+
+async def count_activities_by_action_async(
+    db: AsyncSession,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict[str, int]:
+    watermarks = await rollups.get_watermarks_async(db)
+    archived_until = archive.archived_until()
+    pieces = _archive_pieces(start_time, end_time, watermarks, archived_until)
+    # Reading Parquet blocks, so it runs in the thread pool
+    counts = await run_in_threadpool(_archived_counts, archive.count_by_action, pieces, user_id) if pieces else {}
+    stmt = rollups.counts_by_action_stmt(start_time, end_time, watermarks, user_id, archived_until)
+    rows = (await db.execute(stmt)).all() if stmt is not None else []
+    return _merge_counts(counts, ((action, count) for action, count in rows))
+
+async def count_activities_by_day_async(
+    db: AsyncSession,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict[str, int]:
+    watermarks = await rollups.get_watermarks_async(db)
+    archived_until = archive.archived_until()
+    pieces = _archive_pieces(start_time, end_time, watermarks, archived_until)
+    counts = await run_in_threadpool(_archived_counts, archive.count_by_day, pieces, user_id) if pieces else {}
+    stmt = rollups.counts_by_day_stmt(start_time, end_time, watermarks, user_id, archived_until)
+    rows = (await db.execute(stmt)).all() if stmt is not None else []
+    return _merge_counts(counts, ((_date_key(value), count) for value, count in rows))
+
+async def get_activity_buckets_async(
+    db: AsyncSession,
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None
+) -> Dict:
+    action_counts = await count_activities_by_action_async(db, start_time, end_time, user_id)
+    last_login = await db.scalar(_last_login_stmt(start_time, end_time, user_id))
+    return _buckets_from_counts(action_counts, last_login)
+
+# Statement builders shared by the sync and async functions
+
+# Listings are ordered by (timestamp, id) so that keyset pagination has a
+# total order even when several rows share a timestamp.
+NEWEST_FIRST = (models.ActivityLog.timestamp.desc(), models.ActivityLog.id.desc())
+
+def _user_activities_stmt(user_id: int, limit: int, cursor: Optional[str] = None):
+    stmt = select(*ACTIVITY_ROW_COLUMNS).where(models.ActivityLog.user_id == user_id)
+    return pagination.after_activity(stmt, cursor).order_by(*NEWEST_FIRST).limit(limit)
+
+def _all_activities_stmt(limit: int, cursor: Optional[str] = None):
+    stmt = select(*ACTIVITY_ROW_COLUMNS)
+    return pagination.after_activity(stmt, cursor).order_by(*NEWEST_FIRST).limit(limit)
+
+def _activities_by_action_stmt(action: str, limit: int, cursor: Optional[str] = None):
+    stmt = select(*ACTIVITY_COLUMNS).where(models.ActivityLog.action == action)
+    return pagination.after_activity(stmt, cursor).order_by(*NEWEST_FIRST).limit(limit)
+
+def _suspicious_activities_stmt(limit: int):
+    # Reads the newest end of the (suspicious, timestamp) index
+    return select(*ACTIVITY_COLUMNS).where(
+        models.ActivityLog.suspicious == True
+    ).order_by(models.ActivityLog.timestamp.desc()).limit(limit)
+
+def _time_range_activities_stmt(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    limit: Optional[int] = None
+):
+    stmt = _time_range_select(start_time, end_time, user_id, columns=ACTIVITY_COLUMNS).order_by(
+        models.ActivityLog.timestamp.desc()
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def _count_stmt(start_time: datetime, end_time: datetime, user_id: Optional[int] = None):
+    return _time_range_select(
+        start_time, end_time, user_id, columns=(func.count(models.ActivityLog.id),)
+    )
+
+def _last_login_stmt(start_time: datetime, end_time: datetime, user_id: Optional[int] = None):
+    # Newest-first walk of the (user_id, timestamp) / (timestamp) index that stops at the first login
+    return _time_range_select(
+        start_time, end_time, user_id, columns=(models.ActivityLog.timestamp,)
+    ).where(
+        func.lower(models.ActivityLog.action).like("%login%")
+    ).order_by(models.ActivityLog.timestamp.desc()).limit(1)
+
+def _archive_pieces(
+    start_time: datetime,
+    end_time: datetime,
+    watermarks: Dict[str, datetime],
+    archived_until: Optional[datetime]
+) -> List[rollups.Piece]:
+    # Only the raw edges of a window in retired months; whole hours and days come from the rollups
+    if archived_until is None or rollups.as_utc(start_time) >= archived_until:
+        return []
+    return [
+        piece for piece in rollups.plan_window(start_time, end_time, watermarks, archived_until)
+        if piece[0] == rollups.ARCHIVE
     ]
-    
-    return db.query(models.ActivityLog).filter(
-        models.ActivityLog.action.in_(suspicious_actions)
-    ).order_by(models.ActivityLog.timestamp.desc()).limit(limit).all()
+
+def _archived_counts(count, pieces: List[rollups.Piece], user_id: Optional[int]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for _, start, end, inclusive in pieces:
+        for key, value in count(start, end, user_id, end_inclusive=inclusive).items():
+            counts[key] = counts.get(key, 0) + value
+    return counts
+
+def _merge_counts(counts: Dict[str, int], rows) -> Dict[str, int]:
+    for key, count in rows:
+        counts[key] = counts.get(key, 0) + int(count)
+    return dict(sorted(counts.items()))
+
+def _buckets_from_counts(action_counts: Dict[str, int], last_login: Optional[datetime]) -> Dict:
+    buckets = {"total": sum(action_counts.values())}
+    for name, keywords in ACTIVITY_BUCKETS.items():
+        buckets[name] = sum(
+            count for action, count in action_counts.items()
+            if any(keyword in action.lower() for keyword in keywords)
+        )
+    buckets["last_login"] = last_login
+    return buckets
+
+def _time_range_select(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    columns=None
+):
+    """
+    Build a select over activity_logs restricted to a time window and,
+    optionally, a single user
+    """
+    stmt = select(*columns) if columns else select(models.ActivityLog)
+    stmt = stmt.where(
+        models.ActivityLog.timestamp >= start_time,
+        models.ActivityLog.timestamp <= end_time
+    )
+    if user_id is not None:
+        stmt = stmt.where(models.ActivityLog.user_id == user_id)
+    return stmt
+
+def _activity_rows(result) -> List[ActivityRow]:
+    return [ActivityRow(*row) for row in result]
+
+def _dicts(result) -> List[Dict]:
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+def _date_key(value) -> str:
+    """
+    Normalise a DATE() result to an ISO string (MySQL returns a date, SQLite
+    returns a string)
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
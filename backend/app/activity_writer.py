@@ -0,0 +1,153 @@
+"""
+Buffered activity-log writer.
+
+Activity events are put on a bounded in-process queue and written by a
+background thread with multi-row INSERTs, flushed when a batch fills up or
+when the flush interval elapses. Callers that need the generated id keep
+using the synchronous `activity.log_activity(..., wait=True)` path.
+
+Enable with ACTIVITY_BUFFERED_WRITES=1 (see app/config.py). The writer is started and stopped
+(with a final flush) by the application's startup/shutdown hooks.
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, UTC
+from typing import Dict, List, Optional
+
+from . import activity
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+class ActivityLogWriter:
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_batch: int = settings.activity_buffer_max_batch,
+        flush_interval: float = settings.activity_buffer_flush_interval,
+        max_queue: int = settings.activity_buffer_max_queue,
+        put_timeout: float = settings.activity_buffer_put_timeout,
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "rejected": 0,
+            "failed": 0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop the writer thread after flushing everything still queued
+        """
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        # Anything enqueued after the thread exited is written here
+        self._flush_remaining()
+
+    def submit(self, user_id: int, action: str, details: Optional[str] = None, block: bool = True) -> bool:
+        """
+        Queue an activity event. Blocks for up to put_timeout seconds when the
+        queue is full (backpressure) and returns False if it is still full,
+        in which case the caller should write the event synchronously.
+        Pass block=False from the event loop to fail immediately instead.
+        """
+        row = {
+            "user_id": user_id,
+            "action": action,
+            "details": details,
+            "timestamp": datetime.now(UTC),
+        }
+        try:
+            self._queue.put(row, block=block, timeout=self.put_timeout if block else None)
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("enqueued")
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+        self._flush_remaining()
+
+    def _collect_batch(self) -> List[Dict]:
+        """
+        Wait for the first event, then keep collecting until the batch is
+        full or the flush interval has elapsed
+        """
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush_remaining(self):
+        while True:
+            batch = []
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch: List[Dict]):
+        db = self.session_factory()
+        try:
+            activity.insert_activities(db, batch)
+            self._count("written", len(batch))
+            self._count("batches")
+        except Exception:
+            db.rollback()
+            self._count("failed", len(batch))
+            logger.exception("Failed to write %d buffered activity logs", len(batch))
+        finally:
+            db.close()
+
+writer = ActivityLogWriter()
@@ -1,14 +1,26 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, activity
+from . import models, activity, pagination, counters
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta, UTC
 from fastapi import HTTPException
+from .auth import invalidate_principal
+from .staff import invalidate_department_stats
 
-def get_all_users(db: Session, skip: int = 0, limit: int = 100) -> List[models.User]:
+def get_all_users(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    organisation_domain: Optional[str] = None
+) -> List[models.User]:
     """
-    Get all users with pagination
+    Get all users ordered by id, optionally only those of one organisation
+    domain. Prefer the cursor of the previous page over skip, which has to
+    scan every skipped row.
     """
-    return db.query(models.User).offset(skip).limit(limit).all()
+    return db.scalars(_all_users_stmt(skip, limit, cursor, organisation_domain)).all()
 
 def get_user_by_id(db: Session, user_id: int) -> Optional[models.User]:
     """
@@ -27,13 +39,16 @@ def update_user_status(db: Session, user_id: int, is_active: bool) -> models.Use
     user.is_active = is_active
     db.commit()
     db.refresh(user)
+    invalidate_principal(user_id)
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="user_status_changed",
-        details=f"User {'activated' if is_active else 'deactivated'}"
+        details=f"User {'activated' if is_active else 'deactivated'}",
+        wait=False
     )
     
     return user
@@ -48,49 +63,29 @@ def delete_user(db: Session, user_id: int) -> bool:
     
     user.is_active = False
     db.commit()
+    invalidate_principal(user_id)
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="user_deleted",
-        details="User account deleted"
+        details="User account deleted",
+        wait=False
     )
     
     return True
 
 def get_system_statistics(db: Session) -> Dict:
     """
-    Get system statistics for admin dashboard
+    Get system statistics for admin dashboard, read from the precomputed
+    dashboard counters (see app/counters.py) in a single query
     """
-    total_users = db.query(models.User).count()
-    active_users = db.query(models.User).filter(models.User.is_active == True).count()
-    admin_users = db.query(models.User).filter(models.User.role == "admin").count()
-    staff_users = db.query(models.User).filter(models.User.role == "staff").count()
-    
-    # Get recent activities
-    recent_activities = activity.get_all_activities(db, limit=10)
-    
-    # Get suspicious activities
-    suspicious_activities = activity.get_suspicious_activities(db, limit=5)
-    
-    # Get today's activities
-    today = datetime.now(UTC).date()
-    today_start = datetime.combine(today, datetime.min.time(), tzinfo=UTC)
-    today_end = datetime.combine(today, datetime.max.time(), tzinfo=UTC)
-    today_activities = activity.get_activities_by_time_range(db, today_start, today_end)
-    
-    return {
-        "total_users": total_users,
-        "active_users": active_users,
-        "admin_users": admin_users,
-        "staff_users": staff_users,
-        "recent_activities": len(recent_activities),
-        "suspicious_activities": len(suspicious_activities),
-        "today_activities": len(today_activities)
-    }
+    today = counters.today_counter()
+    return _system_statistics(counters.get_counters(db, _dashboard_counter_names(today)), today)
 
-def get_security_alerts(db: Session, limit: int = 20) -> List[models.ActivityLog]:
+def get_security_alerts(db: Session, limit: int = 20) -> List[Dict]:
     """
     Get security alerts and suspicious activities
     """
@@ -108,26 +103,13 @@ def get_user_activity_summary(db: Session, user_id: int, days: int = 7) -> Dict:
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    user_activities = [a for a in activities if a.user_id == user_id]
-    
     # Count activities by type
-    activity_counts = {}
-    for act in user_activities:
-        activity_counts[act.action] = activity_counts.get(act.action, 0) + 1
+    activity_counts = activity.count_activities_by_action(db, start_date, end_date, user_id=user_id)
+    recent_activities = activity.get_user_activities_by_time_range(
+        db, user_id, start_date, end_date, limit=10
+    )
     
-    return {
-        "user": {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "role": user.role,
-            "is_active": user.is_active
-        },
-        "total_activities": len(user_activities),
-        "activity_breakdown": activity_counts,
-        "recent_activities": user_activities[:10]
-    }
+    return _user_activity_summary(user, activity_counts, recent_activities)
 
 def create_staff_user(db: Session, username: str, email: str, password: str, department: str) -> models.User:
     """
@@ -162,13 +144,15 @@ def create_staff_user(db: Session, username: str, email: str, password: str, dep
     )
     db.add(staff_record)
     db.commit()
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user.id,
         action="staff_user_created",
-        details=f"Staff user created in department: {department}"
+        details=f"Staff user created in department: {department}",
+        wait=False
     )
     
     return user
@@ -180,26 +164,108 @@ def get_activity_analytics(db: Session, days: int = 30) -> Dict:
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
+    # Group activities by date and by type
+    daily_activities = activity.count_activities_by_day(db, start_date, end_date)
+    activity_types = activity.count_activities_by_action(db, start_date, end_date)
     
-    # Group activities by date
-    daily_activities = {}
-    for act in activities:
-        date_str = act.timestamp.date().isoformat()
-        if date_str not in daily_activities:
-            daily_activities[date_str] = 0
-        daily_activities[date_str] += 1
+    return {
+        "total_activities": sum(activity_types.values()),
+        "daily_activities": daily_activities,
+        "activity_types": activity_types,
+        "period_days": days
+    }
+
+# Async variants, for use with an AsyncSession (see database.get_async_db)
+
+async def get_all_users_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    organisation_domain: Optional[str] = None
+) -> List[models.User]:
+    return (await db.scalars(_all_users_stmt(skip, limit, cursor, organisation_domain))).all()
+
+async def get_user_by_id_async(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+async def get_system_statistics_async(db: AsyncSession) -> Dict:
+    today = counters.today_counter()
+    return _system_statistics(await counters.get_counters_async(db, _dashboard_counter_names(today)), today)
+
+async def get_security_alerts_async(db: AsyncSession, limit: int = 20) -> List[Dict]:
+    return await activity.get_suspicious_activities_async(db, limit)
+
+async def get_user_activity_summary_async(db: AsyncSession, user_id: int, days: int = 7) -> Dict:
+    user = await get_user_by_id_async(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Group activities by type
-    activity_types = {}
-    for act in activities:
-        if act.action not in activity_types:
-            activity_types[act.action] = 0
-        activity_types[act.action] += 1
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(days=days)
+    activity_counts = await activity.count_activities_by_action_async(db, start_date, end_date, user_id=user_id)
+    recent_activities = await activity.get_user_activities_by_time_range_async(
+        db, user_id, start_date, end_date, limit=10
+    )
+    return _user_activity_summary(user, activity_counts, recent_activities)
+
+async def get_activity_analytics_async(db: AsyncSession, days: int = 30) -> Dict:
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(days=days)
+    daily_activities = await activity.count_activities_by_day_async(db, start_date, end_date)
+    activity_types = await activity.count_activities_by_action_async(db, start_date, end_date)
     
     return {
-        "total_activities": len(activities),
+        "total_activities": sum(activity_types.values()),
         "daily_activities": daily_activities,
         "activity_types": activity_types,
         "period_days": days
     }
+
+def _all_users_stmt(skip: int, limit: int, cursor: Optional[str], organisation_domain: Optional[str]):
+    # (organisation_domain, id) is an index range, so a tenant page only reads that tenant's rows
+    stmt = select(models.User)
+    if organisation_domain is not None:
+        stmt = stmt.where(models.User.organisation_domain == organisation_domain)
+    stmt = pagination.after_user(stmt, cursor).order_by(models.User.id)
+    if skip:
+        stmt = stmt.offset(skip)
+    return stmt.limit(limit)
+
+def _dashboard_counter_names(today: str) -> List[str]:
+    return [
+        counters.USERS_TOTAL,
+        counters.USERS_ACTIVE,
+        counters.USERS_ADMIN,
+        counters.USERS_STAFF,
+        counters.ACTIVITIES_TOTAL,
+        counters.ACTIVITIES_SUSPICIOUS,
+        today,
+    ]
+
+def _system_statistics(values: Dict[str, int], today: str) -> Dict:
+    return {
+        "total_users": values[counters.USERS_TOTAL],
+        "active_users": values[counters.USERS_ACTIVE],
+        "admin_users": values[counters.USERS_ADMIN],
+        "staff_users": values[counters.USERS_STAFF],
+        # The dashboard has always shown the size of its recent (10) and
+        # suspicious (5) activity previews
+        "recent_activities": min(values[counters.ACTIVITIES_TOTAL], 10),
+        "suspicious_activities": min(values[counters.ACTIVITIES_SUSPICIOUS], 5),
+        "today_activities": values[today]
+    }
+
+def _user_activity_summary(user: models.User, activity_counts: Dict[str, int], recent_activities) -> Dict:
+    return {
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "role": user.role,
+            "is_active": user.is_active
+        },
+        "total_activities": sum(activity_counts.values()),
+        "activity_breakdown": activity_counts,
+        "recent_activities": recent_activities
+    }
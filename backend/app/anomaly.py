@@ -0,0 +1,209 @@
+"""
+Streaming anomaly detection over the activity stream.
+
+Every event logged through activity.log_activity (HTTP, WebSocket, batch
+ingest) is fed to `detector` together with the client IP. For each user and
+each IP the detector keeps a small fixed-size state:
+
+- a ring buffer of the last N failed-login times. When N failures fall
+  within M seconds a `multiple_failed_logins` alert is raised (per user:
+  ANOMALY_FAILED_LOGIN_THRESHOLD; per IP, which may front many users:
+  ANOMALY_IP_FAILED_LOGIN_THRESHOLD);
+- the event count of the current ANOMALY_RATE_BUCKET_SECONDS bucket and an
+  exponentially weighted mean/variance of past buckets (the baseline).
+  A bucket whose count is ANOMALY_RATE_ZSCORE standard deviations above the
+  baseline raises an `activity_rate_anomaly` alert.
+
+State is O(1) per key, and the number of tracked keys is capped at
+ANOMALY_MAX_TRACKED_KEYS, evicting the least recently seen. A key that has
+alerted stays quiet for ANOMALY_ALERT_COOLDOWN seconds.
+
+Alerts go to `on_alert`. app.websocket wires it to broadcast `security_alert`
+messages to admin sockets and to record the alert as a derived activity,
+which the classification rules flag as suspicious.
+"""
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, UTC
+from typing import Callable, Dict, List, Optional
+
+from .config import settings
+
+FAILED_LOGIN_ACTIONS = frozenset({"failed_login"})
+
+MULTIPLE_FAILED_LOGINS = "multiple_failed_logins"
+ACTIVITY_RATE_ANOMALY = "activity_rate_anomaly"
+
+USER = "user"
+IP = "ip"
+
+class _KeyState:
+    __slots__ = (
+        "failures", "failure_index", "failure_count",
+        "bucket", "count", "mean", "var", "buckets_seen", "rate_alerted_bucket",
+        "failures_alerted_at", "rate_alerted_at",
+    )
+
+    def __init__(self, failure_slots: int):
+        # Ring buffer of the last `failure_slots` failed-login times
+        self.failures = array("d", bytes(8 * failure_slots))
+        self.failure_index = 0
+        self.failure_count = 0
+        self.bucket = -1
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.buckets_seen = 0
+        self.rate_alerted_bucket = -1
+        self.failures_alerted_at = -math.inf
+        self.rate_alerted_at = -math.inf
+
+class AnomalyDetector:
+    def __init__(
+        self,
+        failed_login_threshold: int = settings.anomaly_failed_login_threshold,
+        ip_failed_login_threshold: int = settings.anomaly_ip_failed_login_threshold,
+        failed_login_window: float = settings.anomaly_failed_login_window,
+        rate_bucket_seconds: float = settings.anomaly_rate_bucket_seconds,
+        rate_zscore: float = settings.anomaly_rate_zscore,
+        rate_min_events: int = settings.anomaly_rate_min_events,
+        rate_warmup_buckets: int = settings.anomaly_rate_warmup_buckets,
+        rate_alpha: float = settings.anomaly_rate_alpha,
+        alert_cooldown: float = settings.anomaly_alert_cooldown,
+        max_tracked_keys: int = settings.anomaly_max_tracked_keys,
+        enabled: bool = settings.anomaly_detection_enabled,
+        on_alert: Optional[Callable[[Dict], None]] = None,
+    ):
+        self.thresholds = {USER: failed_login_threshold, IP: ip_failed_login_threshold}
+        self.failed_login_window = failed_login_window
+        self.rate_bucket_seconds = rate_bucket_seconds
+        self.rate_zscore = rate_zscore
+        self.rate_min_events = rate_min_events
+        self.rate_warmup_buckets = rate_warmup_buckets
+        self.rate_alpha = rate_alpha
+        self.alert_cooldown = alert_cooldown
+        self.max_tracked_keys = max_tracked_keys
+        self.enabled = enabled
+        self.on_alert = on_alert
+        self._states: "OrderedDict[tuple, _KeyState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"events": 0, "alerts": 0, "evictions": 0}
+
+    def observe(
+        self,
+        user_id: Optional[int],
+        action: Optional[str],
+        ip: Optional[str] = None,
+        timestamp: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Feed one event (timestamp in epoch seconds, default now) and return
+        the alerts it raised, which are also passed to on_alert
+        """
+        if not self.enabled:
+            return []
+        now = time.time() if timestamp is None else timestamp
+        failed = action in FAILED_LOGIN_ACTIONS
+        alerts = []
+        with self._lock:
+            self.stats["events"] += 1
+            if user_id is not None:
+                self._observe_key(USER, user_id, user_id, ip, action, failed, now, alerts)
+            if ip:
+                self._observe_key(IP, ip, user_id, ip, action, failed, now, alerts)
+            self.stats["alerts"] += len(alerts)
+        if alerts and self.on_alert is not None:
+            for alert in alerts:
+                self.on_alert(alert)
+        return alerts
+
+    def tracked_keys(self) -> int:
+        return len(self._states)
+
+    def reset(self):
+        with self._lock:
+            self._states.clear()
+
+    def _state(self, scope: str, key) -> _KeyState:
+        states = self._states
+        state = states.get((scope, key))
+        if state is None:
+            state = states[(scope, key)] = _KeyState(self.thresholds[scope])
+            if len(states) > self.max_tracked_keys:
+                states.popitem(last=False)
+                self.stats["evictions"] += 1
+        else:
+            states.move_to_end((scope, key))
+        return state
+
+    def _observe_key(self, scope, key, user_id, ip, action, failed, now, alerts):
+        state = self._state(scope, key)
+
+        if failed:
+            slots = len(state.failures)
+            state.failures[state.failure_index] = now
+            state.failure_index = (state.failure_index + 1) % slots
+            state.failure_count += 1
+            # Once the ring is full, the next slot holds the oldest of the last N failures
+            if state.failure_count >= slots and now - state.failures[state.failure_index] <= self.failed_login_window:
+                if now - state.failures_alerted_at >= self.alert_cooldown:
+                    state.failures_alerted_at = now
+                    alerts.append(self._alert(
+                        MULTIPLE_FAILED_LOGINS, scope, key, user_id, ip, action, now,
+                        count=slots, window_seconds=self.failed_login_window
+                    ))
+
+        # Late events count towards the current bucket
+        bucket = max(int(now // self.rate_bucket_seconds), state.bucket)
+        if bucket != state.bucket:
+            if state.bucket >= 0:
+                self._close_buckets(state, bucket - state.bucket)
+            state.bucket = bucket
+            state.count = 0
+        state.count += 1
+        if (
+            state.count >= self.rate_min_events
+            and state.buckets_seen >= self.rate_warmup_buckets
+            and state.rate_alerted_bucket != bucket
+        ):
+            # Variance floor of 1 so a perfectly regular user is not flagged for a couple of extra events
+            zscore = (state.count - state.mean) / math.sqrt(max(state.var, 1.0))
+            if zscore >= self.rate_zscore:
+                state.rate_alerted_bucket = bucket
+                if now - state.rate_alerted_at >= self.alert_cooldown:
+                    state.rate_alerted_at = now
+                    alerts.append(self._alert(
+                        ACTIVITY_RATE_ANOMALY, scope, key, user_id, ip, action, now,
+                        count=state.count, window_seconds=self.rate_bucket_seconds,
+                        baseline=round(state.mean, 2), zscore=round(zscore, 1)
+                    ))
+
+    def _close_buckets(self, state: _KeyState, elapsed: int):
+        # The finished bucket, then the empty ones in between; long gaps are
+        # capped since the weights of older buckets are negligible by then
+        alpha = self.rate_alpha
+        value = state.count
+        for _ in range(min(elapsed, int(5 / alpha) + 1)):
+            diff = value - state.mean
+            increment = alpha * diff
+            state.mean += increment
+            state.var = (1 - alpha) * (state.var + diff * increment)
+            state.buckets_seen += 1
+            value = 0
+
+    def _alert(self, kind, scope, key, user_id, ip, action, now, **fields) -> Dict:
+        return {
+            "kind": kind,
+            "scope": scope,
+            "key": key,
+            "user_id": user_id,
+            "ip": ip,
+            "action": action,
+            "detected_at": datetime.fromtimestamp(now, UTC).isoformat(),
+            **fields,
+        }
+
+detector = AnomalyDetector()
@@ -0,0 +1,280 @@
+"""
+Activity log archive.
+
+Months removed by the retention policy (see app/partitions.py) are
+exported here first, as zstd-compressed Parquet parts under
+ACTIVITY_ARCHIVE_DIR:
+
+    <archive_dir>/activity_logs/month=2025-01/activity_logs.parquet
+    <archive_dir>/activity_logs/month=2025-01/activity_logs-2.parquet
+    <archive_dir>/activity_logs/month=2025-01/_RETIRED
+
+A part is never replaced: it is written under a name unique to its writer
+and published under the next free part name. Further parts only hold rows
+written to the month after it was first archived. `_RETIRED` marks a month
+whose rows have left the database; from then on readers take it from here.
+
+Everything before `archived_until` (the end of the newest retired month)
+is therefore read from the archive: app/export.py streams archived rows for
+that part of an export window, and app/activity.py counts the edges of
+analytics windows there. Whole hours and days keep coming from the rollup
+tables, which are not subject to retention.
+
+The readers scan only the parts of the months a window overlaps and push
+the time/user filters down into Parquet. pyarrow is imported lazily so the
+API runs without it when archiving is disabled.
+"""
+import os
+import uuid
+from datetime import date, datetime, UTC
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .cache import TTLCache
+from .config import settings
+
+COLUMNS = ["id", "user_id", "action", "timestamp", "details"]
+PART_NAME = "activity_logs"
+RETIRED_MARKER = "_RETIRED"
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Activity archiving needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("action", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("details", pa.string()),
+    ])
+
+def month_dir(month: date, archive_dir: Optional[str] = None) -> str:
+    archive_dir = archive_dir or settings.activity_archive_dir
+    return os.path.join(archive_dir, "activity_logs", f"month={month:%Y-%m}")
+
+def _part_name(number: int) -> str:
+    return f"{PART_NAME}.parquet" if number == 1 else f"{PART_NAME}-{number}.parquet"
+
+def _part_number(name: str) -> Optional[int]:
+    if name == f"{PART_NAME}.parquet":
+        return 1
+    prefix, suffix = f"{PART_NAME}-", ".parquet"
+    if name.startswith(prefix) and name.endswith(suffix) and name[len(prefix):-len(suffix)].isdigit():
+        return int(name[len(prefix):-len(suffix)])
+    return None
+
+def month_parts(month: date, archive_dir: Optional[str] = None) -> List[str]:
+    """
+    Paths of the published parts of a month, in the order they were written
+    """
+    directory = month_dir(month, archive_dir)
+    if not os.path.isdir(directory):
+        return []
+    numbered = sorted((_part_number(name), name) for name in os.listdir(directory) if _part_number(name) is not None)
+    return [os.path.join(directory, name) for _, name in numbered]
+
+def write_month(batches: Iterable[List[Dict]], month: date, archive_dir: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """
+    Write activity rows of one month, given as batches of dicts in
+    (timestamp, id) order, as a new part of the month. Returns the row
+    count and the part's path (None when there were no rows).
+    """
+    pa = _pyarrow()
+    schema = _schema(pa)
+    directory = month_dir(month, archive_dir)
+    os.makedirs(directory, exist_ok=True)
+    # Unique per writer, so two writers never share a temporary file
+    partial = os.path.join(directory, f".{uuid.uuid4().hex}.partial")
+    written = 0
+    try:
+        with pa.parquet.ParquetWriter(partial, schema, compression="zstd") as parquet_writer:
+            for batch in batches:
+                if not batch:
+                    continue
+                parquet_writer.write_table(pa.Table.from_pylist(
+                    [{column: _naive_utc(row[column]) if column == "timestamp" else row[column] for column in COLUMNS}
+                     for row in batch],
+                    schema=schema,
+                ))
+                written += len(batch)
+        if not written:
+            return 0, None
+        return written, _publish(partial, directory)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def _publish(partial: str, directory: str) -> str:
+    number = len([name for name in os.listdir(directory) if _part_number(name) is not None]) + 1
+    while True:
+        path = os.path.join(directory, _part_name(number))
+        try:
+            # Unlike a rename, a hard link fails instead of replacing an existing part
+            os.link(partial, path)
+            return path
+        except FileExistsError:
+            number += 1
+
+def mark_retired(month: date, archive_dir: Optional[str] = None):
+    """
+    Record that the month's rows have left the database
+    """
+    with open(os.path.join(month_dir(month, archive_dir), RETIRED_MARKER), "a"):
+        pass
+    archived_until_cache.clear()
+
+def archived_months(archive_dir: Optional[str] = None) -> List[date]:
+    """
+    Retired months, oldest first
+    """
+    root = os.path.join(archive_dir or settings.activity_archive_dir, "activity_logs")
+    if not os.path.isdir(root):
+        return []
+    months = []
+    for name in sorted(os.listdir(root)):
+        if name.startswith("month=") and os.path.exists(os.path.join(root, name, RETIRED_MARKER)):
+            months.append(datetime.strptime(name[len("month="):], "%Y-%m").date())
+    return months
+
+# Months are only ever added, and retiring one clears this process's copy;
+# other workers may read a just-retired month from activity_logs until it expires
+archived_until_cache = TTLCache(maxsize=1, ttl=60.0)
+
+def archived_until(archive_dir: Optional[str] = None) -> Optional[datetime]:
+    """
+    End of the newest retired month (UTC): activity before it is read from
+    the archive. None when nothing has been archived.
+    """
+    archive_dir = archive_dir or settings.activity_archive_dir
+    if not archive_dir:
+        return None
+    cached = archived_until_cache.get(archive_dir)
+    if cached is None:
+        months = archived_months(archive_dir)
+        until = None
+        if months:
+            newest = months[-1]
+            until = datetime(newest.year + newest.month // 12, newest.month % 12 + 1, 1, tzinfo=UTC)
+        cached = (until,)
+        archived_until_cache.set(archive_dir, cached)
+    return cached[0]
+
+def read_ids(paths: List[str], batch_size: int = 10_000) -> Iterator[List[int]]:
+    """
+    Yield the ids stored in the given parts, in batches
+    """
+    if not paths:
+        return
+    pa = _pyarrow()
+    dataset = pa.dataset.dataset(paths, schema=_schema(pa), format="parquet")
+    for batch in dataset.to_batches(columns=["id"], batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.column(0).to_pylist()
+
+def read_activities(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    newest_first: bool = False,
+    end_inclusive: bool = True,
+    archive_dir: Optional[str] = None,
+    batch_size: int = 10_000
+) -> Iterator[List[Dict]]:
+    """
+    Yield batches of archived activity rows (as dicts) in the window,
+    ordered by (timestamp, id), oldest first unless newest_first
+    """
+    pa = _pyarrow()
+    condition = _condition(pa, start_time, end_time, user_id, end_inclusive)
+    order = "descending" if newest_first else "ascending"
+    months = [month for month in archived_months(archive_dir) if _month_overlaps(month, start_time, end_time)]
+    for month in reversed(months) if newest_first else months:
+        parts = month_parts(month, archive_dir)
+        if len(parts) == 1:
+            # A part is written in order, one row group per batch, so
+            # ordering each row group orders the part
+            fragment = next(pa.dataset.dataset(parts[0], schema=_schema(pa), format="parquet").get_fragments())
+            row_groups = fragment.split_by_row_group(condition)
+            tables = (
+                row_group.to_table(columns=COLUMNS, filter=condition)
+                for row_group in (reversed(row_groups) if newest_first else row_groups)
+            )
+        else:
+            # Later parts hold rows that arrived late: order the window of the month as a whole
+            tables = [pa.dataset.dataset(parts, schema=_schema(pa), format="parquet").to_table(
+                columns=COLUMNS, filter=condition
+            )]
+        for table in tables:
+            table = table.sort_by([("timestamp", order), ("id", order)])
+            for batch in table.to_batches(max_chunksize=batch_size):
+                if batch.num_rows:
+                    yield batch.to_pylist()
+
+def count_by_action(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    end_inclusive: bool = True,
+    archive_dir: Optional[str] = None
+) -> Dict[str, int]:
+    pa = _pyarrow()
+    counts: Dict[str, int] = {}
+    for batch in _scan(start_time, end_time, user_id, end_inclusive, archive_dir, ["action"]):
+        for row in pa.compute.value_counts(batch.column("action")).to_pylist():
+            counts[row["values"]] = counts.get(row["values"], 0) + row["counts"]
+    return counts
+
+def count_by_day(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    end_inclusive: bool = True,
+    archive_dir: Optional[str] = None
+) -> Dict[str, int]:
+    pa = _pyarrow()
+    counts: Dict[str, int] = {}
+    for batch in _scan(start_time, end_time, user_id, end_inclusive, archive_dir, ["timestamp"]):
+        days = pa.compute.strftime(batch.column("timestamp"), format="%Y-%m-%d")
+        for row in pa.compute.value_counts(days).to_pylist():
+            counts[row["values"]] = counts.get(row["values"], 0) + row["counts"]
+    return dict(sorted(counts.items()))
+
+def _scan(start_time, end_time, user_id, end_inclusive, archive_dir, columns, batch_size: int = 100_000):
+    pa = _pyarrow()
+    paths = [
+        path
+        for month in archived_months(archive_dir) if _month_overlaps(month, start_time, end_time)
+        for path in month_parts(month, archive_dir)
+    ]
+    if not paths:
+        return
+    condition = _condition(pa, start_time, end_time, user_id, end_inclusive)
+    dataset = pa.dataset.dataset(paths, schema=_schema(pa), format="parquet")
+    yield from dataset.to_batches(columns=columns, filter=condition, batch_size=batch_size)
+
+def _condition(pa, start_time: datetime, end_time: datetime, user_id: Optional[int], end_inclusive: bool):
+    timestamp = pa.dataset.field("timestamp")
+    start = pa.scalar(_naive_utc(start_time), pa.timestamp("us"))
+    end = pa.scalar(_naive_utc(end_time), pa.timestamp("us"))
+    condition = (timestamp >= start) & ((timestamp <= end) if end_inclusive else (timestamp < end))
+    if user_id is not None:
+        condition = condition & (pa.dataset.field("user_id") == user_id)
+    return condition
+
+def _month_overlaps(month: date, start_time: datetime, end_time: datetime) -> bool:
+    start_time, end_time = _naive_utc(start_time), _naive_utc(end_time)
+    next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return datetime(month.year, month.month, 1) <= end_time and datetime(next_month.year, next_month.month, 1) > start_time
+
+def _naive_utc(value: datetime) -> datetime:
+    # Parquet stores the same naive UTC timestamps as the database
+    if value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return value
@@ -1,28 +1,43 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, UTC
-from . import models, database
+from . import models, database, schemas
 from typing import Optional, Any
-from app.database import get_db
+from app.database import get_db, get_async_db
+from .config import settings
+from .cache import TTLCache
+from .hashing import hasher
 
-SECRET_KEY = "your-secret-key"  # Change this in production
+SECRET_KEY = settings.secret_key
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
+# Authenticated principals keyed by token subject (email), so authenticated
+# requests only pay for JWT verification. Entries are dropped explicitly when
+# a user's status, profile or role changes (see invalidate_principal).
+principal_cache = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl)
 
-# Password hashing
+def invalidate_principal(user_id: int):
+    """
+    Drop the cached principal of a user after their account changed
+    """
+    principal_cache.invalidate_where(lambda email, principal: principal.id == user_id)
+
+
+# Password hashing (runs in the hashing process pool, see app/hashing.py)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    verified, _ = hasher.verify_and_update(plain_password, hashed_password)
+    return verified
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return hasher.hash(password)
 
 # JWT token
 def create_access_token(data: dict[str, Any], expires_delta: Optional[timedelta] = None):
@@ -41,24 +56,73 @@ def authenticate_user(db: Session, email: str, password: str):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         return False
-    if not user or not verify_password(password, str(user.hashed_password)):
+    verified, new_hash = hasher.verify_and_update(password, str(user.hashed_password))
+    if not verified:
         return False
+    if new_hash:
+        # Stored hash uses outdated parameters; upgrade it transparently
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _token_subject(token: str) -> str:
+    """
+    Verify a JWT and return its subject (the user's email)
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            raise _credentials_exception()
     except JWTError:
-        raise credentials_exception
-    user = get_user(db, email=email)
-    if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    return email
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.Principal:
+    email = _token_subject(token)
+    principal = principal_cache.get(email)
+    if principal is None:
+        user = get_user(db, email=email)
+        if user is None:
+            raise _credentials_exception()
+        principal = schemas.Principal.model_validate(user, from_attributes=True)
+        principal_cache.set(email, principal)
+    return principal
+
+# Async variants, for routes using database.get_async_db
+
+async def get_user_async(db: AsyncSession, email: str):
+    return (await db.scalars(select(models.User).where(models.User.email == email))).first()
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str):
+    user = await get_user_async(db, email)
+    if not user:
+        return False
+    verified, new_hash = await hasher.verify_and_update_async(password, str(user.hashed_password))
+    if not verified:
+        return False
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> schemas.Principal:
+    email = _token_subject(token)
+    principal = principal_cache.get(email)
+    if principal is None:
+        user = await get_user_async(db, email=email)
+        if user is None:
+            raise _credentials_exception()
+        principal = schemas.Principal.model_validate(user, from_attributes=True)
+        principal_cache.set(email, principal)
+    return principal
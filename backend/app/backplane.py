@@ -0,0 +1,232 @@
+"""
+Pub/sub backplane for WebSocket broadcasts.
+
+With several uvicorn workers (or hosts) each process only holds its own
+sockets. ConnectionManager therefore publishes every broadcast to the
+backplane and delivers what it receives from it to its local sockets, so a
+broadcast reaches every subscriber in the cluster. Channels:
+
+    <prefix>:all                   broadcasts to every tenant
+    <prefix>:tenant:<domain>       broadcasts to one organisation domain
+
+A process subscribes to a tenant channel only while it holds a socket of
+that tenant.
+
+Implementations (WS_BACKPLANE):
+
+- `memory`: in-process, for a single worker (the default);
+- `redis`: Redis PUBLISH/SUBSCRIBE at WS_BACKPLANE_URL
+  (redis://[:password@]host:port). It speaks the RESP protocol directly
+  over asyncio streams, so it needs no client library and works with any
+  Redis-compatible server; it reconnects and resubscribes on its own.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import urlparse
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+class Backplane:
+    """
+    Interface of a backplane: subscribed channels' messages are passed to
+    the handler given to start(), including those this process published
+    """
+    async def start(self, on_message: MessageHandler):
+        raise NotImplementedError
+
+    async def stop(self):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, data: str):
+        raise NotImplementedError
+
+class InMemoryBackplane(Backplane):
+    """
+    Delivers within the process. Instances sharing a `hub` see each
+    other's messages, which stands in for several workers in one process.
+    """
+    def __init__(self, hub: Optional[Dict[str, Set["InMemoryBackplane"]]] = None):
+        self.hub = {} if hub is None else hub
+        self._on_message: Optional[MessageHandler] = None
+        self._channels: Set[str] = set()
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+
+    async def stop(self):
+        for channel in list(self._channels):
+            await self.unsubscribe(channel)
+        self._on_message = None
+
+    async def subscribe(self, channel: str):
+        self._channels.add(channel)
+        self.hub.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, channel: str):
+        self._channels.discard(channel)
+        subscribers = self.hub.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.hub[channel]
+
+    async def publish(self, channel: str, data: str):
+        for subscriber in list(self.hub.get(channel, ())):
+            if subscriber._on_message is not None:
+                await subscriber._on_message(channel, data)
+
+class RedisBackplane(Backplane):
+    """
+    Redis pub/sub over two connections: one for PUBLISH (request/reply),
+    one in subscriber mode read by a background task
+    """
+    def __init__(self, url: str = settings.ws_backplane_url, reconnect_delay: float = 1.0):
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported backplane URL {url!r}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.reconnect_delay = reconnect_delay
+        self._on_message: Optional[MessageHandler] = None
+        self._channels: Set[str] = set()
+        self._publisher: Optional[tuple] = None
+        self._publish_lock = asyncio.Lock()
+        self._subscriber: Optional[tuple] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, on_message: MessageHandler):
+        self._on_message = on_message
+        self._publisher = await self._connect()
+        self._subscriber = await self._connect()
+        self._reader = asyncio.create_task(self._read_messages())
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        connections = [connection for connection in (self._publisher, self._subscriber) if connection is not None]
+        self._publisher = self._subscriber = None
+        for _, writer in connections:
+            writer.close()
+        for _, writer in connections:
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def subscribe(self, channel: str):
+        if channel in self._channels:
+            return
+        self._channels.add(channel)
+        await self._send_subscription("SUBSCRIBE", channel)
+
+    async def unsubscribe(self, channel: str):
+        if channel not in self._channels:
+            return
+        self._channels.discard(channel)
+        await self._send_subscription("UNSUBSCRIBE", channel)
+
+    async def publish(self, channel: str, data: str):
+        async with self._publish_lock:
+            for attempt in (1, 2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = await self._connect()
+                    reader, writer = self._publisher
+                    writer.write(_command("PUBLISH", channel, data))
+                    await writer.drain()
+                    await _read_reply(reader)
+                    return
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    self._publisher = None
+                    if attempt == 2:
+                        raise
+
+    async def _connect(self) -> tuple:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(_command("AUTH", self.password))
+            await writer.drain()
+            await _read_reply(reader)
+        return reader, writer
+
+    async def _send_subscription(self, command: str, channel: str):
+        # Replies are consumed by _read_messages; after a reconnect it
+        # subscribes to every channel in self._channels again
+        if self._subscriber is None:
+            return
+        try:
+            writer = self._subscriber[1]
+            writer.write(_command(command, channel))
+            await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _read_messages(self):
+        while True:
+            try:
+                if self._subscriber is None:
+                    self._subscriber = await self._connect()
+                    if self._channels:
+                        self._subscriber[1].write(_command("SUBSCRIBE", *self._channels))
+                        await self._subscriber[1].drain()
+                reader = self._subscriber[0]
+                while True:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        await self._on_message(reply[1].decode(), reply[2].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Backplane connection lost (%r), reconnecting in %ss", exc, self.reconnect_delay)
+                if self._subscriber is not None:
+                    self._subscriber[1].close()
+                    self._subscriber = None
+                await asyncio.sleep(self.reconnect_delay)
+
+def _command(*args: str) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode() if isinstance(arg, str) else arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readuntil(b"\r\n")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload
+    if kind == b"-":
+        raise RuntimeError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(payload)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected RESP reply {line!r}")
+
+def create_backplane(kind: str = settings.ws_backplane) -> Backplane:
+    if kind == "memory":
+        return InMemoryBackplane()
+    if kind == "redis":
+        return RedisBackplane(settings.ws_backplane_url)
+    raise ValueError(f"Unknown WS_BACKPLANE {kind!r}")
@@ -0,0 +1,103 @@
+"""
+Application settings, read from environment variables or a `.env` file in
+the backend directory. Variable names are the upper-cased field names,
+e.g. DATABASE_URL or DB_POOL_SIZE.
+"""
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Database
+    database_url: str = "mysql+pymysql://root:@localhost:3306/digital_twin"
+    db_echo: bool = False
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_connect_timeout: int = 10
+
+    # gzip HTTP responses of at least this many bytes to clients that accept
+    # it (0 disables; leave it to the reverse proxy when there is one)
+    response_gzip_min_size: int = 0
+
+    # Authentication
+    secret_key: str = "your-secret-key"  # Change this in production
+    access_token_expire_minutes: int = 60
+    principal_cache_ttl: float = 60.0
+    principal_cache_size: int = 10000
+
+    # Dashboards
+    department_stats_cache_ttl: float = 30.0
+    dashboard_reconcile_interval: float = 3600.0
+    dashboard_counter_shards: int = 16
+
+    # Activity classification rules (see app/rules.py)
+    activity_rules_reload_interval: float = 30.0
+
+    # WebSocket fan-out (see app/websocket.py)
+    ws_send_queue_size: int = 256
+    ws_slow_consumer_policy: str = "drop_oldest"  # drop_oldest, drop_newest or disconnect
+    ws_send_timeout: float = 10.0
+    # Cross-worker broadcasts (see app/backplane.py)
+    ws_backplane: str = "memory"  # memory or redis
+    ws_backplane_url: str = "redis://localhost:6379"
+    ws_backplane_channel_prefix: str = "digital_twin:ws"
+    ws_backplane_dedup_size: int = 10000
+    # WebSocket ingest (see app/ws_ingest.py): writer tasks/threads, queued
+    # frames, rows per INSERT and the per-connection rate limit (events/s, 0
+    # disables; burst must cover the largest batch frame)
+    ws_ingest_workers: int = 4
+    ws_ingest_queue_size: int = 10000
+    ws_ingest_batch_size: int = 500
+    ws_ingest_rate: float = 100.0
+    ws_ingest_burst: int = 1000
+
+    # Live dashboard analytics (see app/live_analytics.py): hour buckets
+    # kept per tenant, how often deltas are pushed and how often the
+    # buckets are recounted from activity_logs
+    live_analytics_hours: int = 24
+    live_analytics_flush_interval: float = 1.0
+    live_analytics_resync_interval: float = 300.0
+
+    # Event loop lag sampling (see app/loop_lag.py)
+    event_loop_lag_interval: float = 0.5
+    event_loop_lag_window: int = 120
+
+    # Streaming anomaly detection (see app/anomaly.py)
+    anomaly_detection_enabled: bool = True
+    anomaly_failed_login_threshold: int = 5
+    anomaly_ip_failed_login_threshold: int = 20
+    anomaly_failed_login_window: float = 60.0
+    anomaly_rate_bucket_seconds: float = 60.0
+    anomaly_rate_zscore: float = 4.0
+    anomaly_rate_min_events: int = 30
+    anomaly_rate_warmup_buckets: int = 10
+    anomaly_rate_alpha: float = 0.1
+    anomaly_alert_cooldown: float = 300.0
+    anomaly_max_tracked_keys: int = 100000
+
+    # Activity rollups (see app/rollups.py)
+    activity_rollup_interval: float = 60.0
+    activity_rollup_grace: float = 120.0
+
+    # activity_logs partitioning and retention (see app/partitions.py)
+    activity_partition_months_ahead: int = 3
+    activity_partition_maintenance_interval: float = 86400.0
+    activity_retention_months: int = 0  # 0 keeps everything
+    activity_archive_dir: str = ""  # empty drops expired months without archiving
+
+    # Password hashing (see app/hashing.py)
+    password_hash_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32
+
+    # Buffered activity logging (see app/activity_writer.py)
+    activity_buffered_writes: bool = False
+    activity_buffer_max_batch: int = 500
+    activity_buffer_flush_interval: float = 0.5
+    activity_buffer_max_queue: int = 10000
+    activity_buffer_put_timeout: float = 1.0
+
+settings = Settings()
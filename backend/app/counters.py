@@ -0,0 +1,313 @@
+"""
+Dashboard counters.
+
+The admin dashboard shows user and activity totals. Counting them from the
+source tables gets slower as the tables grow, so they are kept in the
+`dashboard_counters` summary table and adjusted in the same transaction as
+the writes that change them:
+
+- ORM inserts/updates/deletes of users and activity logs are picked up by a
+  before_flush hook on every Session;
+- bulk activity inserts (`activity.insert_activities`) apply their deltas
+  explicitly.
+
+Every activity write adds to the same few counters, and an upserted row
+stays locked until the writer commits. Each counter is therefore split over
+DASHBOARD_COUNTER_SHARDS rows (`name`, `name#1`, `name#2`, ...) that reads
+sum up. Each pooled connection adds to its own shard, so concurrent writers
+rarely wait for each other, and one transaction always locks its rows in
+the same order.
+
+Writes that bypass both (raw SQL, bulk loads, manual fixes) make the
+counters drift. `reconcile` corrects them from the source tables; it runs
+on startup when the table is still empty and periodically from the
+`reconciler` thread (DASHBOARD_RECONCILE_INTERVAL), in one process at a time.
+"""
+import itertools
+import random
+from collections import Counter
+from datetime import date, datetime, time, timedelta, UTC
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, delete, event, func, inspect, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models, activity
+from .config import settings
+from .database import SessionLocal
+from .periodic import Lease, PeriodicTask
+
+USERS_TOTAL = "users_total"
+USERS_ACTIVE = "users_active"
+USERS_ADMIN = "users_admin"
+USERS_STAFF = "users_staff"
+ACTIVITIES_TOTAL = "activities_total"
+ACTIVITIES_SUSPICIOUS = "activities_suspicious"
+ACTIVITIES_DAY_PREFIX = "activities_day:"
+
+# Per-day activity counters are only read for today; reconcile keeps this
+# many days and deletes older ones so the table stays a handful of rows.
+DAY_COUNTERS_KEPT = 2
+
+SHARD_SEPARATOR = "#"
+# Longest a reconciliation may take before another process may start one
+RECONCILE_LEASE_TTL = 900.0
+
+def day_counter(day: date) -> str:
+    return f"{ACTIVITIES_DAY_PREFIX}{day.isoformat()}"
+
+def today_counter() -> str:
+    return day_counter(datetime.now(UTC).date())
+
+
+def shard_name(name: str, shard: int) -> str:
+    # Shard 0 is the bare name, which is also where reconcile writes
+    return name if shard == 0 else f"{name}{SHARD_SEPARATOR}{shard}"
+
+def counter_name(row_name: str) -> str:
+    return row_name.split(SHARD_SEPARATOR, 1)[0]
+
+def get_counters(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Read counters (summing their shards) in one query. Counters that do not
+    exist yet read as 0.
+    """
+    names = list(names)
+    return _sum_shards(names, db.execute(_read_stmt(names)).all())
+
+async def get_counters_async(db: AsyncSession, names: Iterable[str]) -> Dict[str, int]:
+    names = list(names)
+    return _sum_shards(names, (await db.execute(_read_stmt(names))).all())
+
+def _read_stmt(names):
+    table = models.DashboardCounter
+    shards = range(max(settings.dashboard_counter_shards, 1))
+    return select(table.name, table.value).where(table.name.in_(
+        [shard_name(name, shard) for name in names for shard in shards]
+    ))
+
+def _sum_shards(names, rows) -> Dict[str, int]:
+    totals = Counter()
+    for row_name, value in rows:
+        totals[counter_name(row_name)] += int(value)
+    return {name: totals[name] for name in names}
+
+
+def user_deltas(is_active: Optional[bool], role: Optional[str], sign: int = 1) -> Counter:
+    deltas = Counter({USERS_TOTAL: sign})
+    # Column defaults (is_active=True, role="user") are applied at INSERT time
+    if is_active is None or is_active:
+        deltas[USERS_ACTIVE] += sign
+    if role == "admin":
+        deltas[USERS_ADMIN] += sign
+    elif role == "staff":
+        deltas[USERS_STAFF] += sign
+    return deltas
+
+def activity_deltas(rows: Iterable[Tuple[bool, Optional[datetime]]]) -> Counter:
+    """
+    Counter deltas for newly written activities, given (suspicious, timestamp) pairs
+    """
+    deltas = Counter()
+    today = None
+    for suspicious, timestamp in rows:
+        deltas[ACTIVITIES_TOTAL] += 1
+        if suspicious:
+            deltas[ACTIVITIES_SUSPICIOUS] += 1
+        if timestamp is None:
+            today = today or datetime.now(UTC).date()
+            deltas[day_counter(today)] += 1
+        else:
+            deltas[day_counter(timestamp.date())] += 1
+    return deltas
+
+# Shards handed to new pooled connections in turn, from a random start so
+# that worker processes do not all begin with the same one
+_next_shard = itertools.count(random.randrange(1 << 16))
+
+def _connection_shard(conn: Connection) -> int:
+    # Connection.info lives as long as the pooled DBAPI connection
+    shard = conn.info.get("dashboard_counter_shard")
+    if shard is None:
+        shard = conn.info["dashboard_counter_shard"] = next(_next_shard)
+    return shard % max(settings.dashboard_counter_shards, 1)
+
+def apply_deltas(conn: Connection, deltas: Dict[str, int]):
+    """
+    Add deltas to the counters on the given connection (inside the caller's
+    transaction), in the connection's shard. Counters are upserted in name
+    order so concurrent writers lock the rows in the same order.
+    """
+    now = datetime.now(UTC)
+    shard = _connection_shard(conn)
+    for name in sorted(deltas):
+        delta = deltas[name]
+        if delta:
+            _upsert(conn, shard_name(name, shard), delta, now)
+
+def _upsert(conn: Connection, name: str, delta: int, now: datetime):
+    table = models.DashboardCounter.__table__
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(name=name, value=delta, updated_at=now)
+        conn.execute(stmt.on_duplicate_key_update(
+            value=table.c.value + stmt.inserted.value, updated_at=stmt.inserted.updated_at
+        ))
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(table).values(name=name, value=delta, updated_at=now)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={"value": table.c.value + stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+        ))
+    else:
+        updated = conn.execute(
+            update(table).where(table.c.name == name).values(value=table.c.value + delta, updated_at=now)
+        )
+        if updated.rowcount == 0:
+            conn.execute(table.insert().values(name=name, value=delta, updated_at=now))
+
+@event.listens_for(Session, "before_flush")
+def _track_flush(session: Session, flush_context, instances):
+    deltas = Counter()
+    new_activities = []
+    for obj in session.new:
+        if isinstance(obj, models.User):
+            deltas.update(user_deltas(obj.is_active, obj.role))
+        elif isinstance(obj, models.ActivityLog):
+            new_activities.append((obj.suspicious, obj.timestamp))
+    for obj in session.dirty:
+        if isinstance(obj, models.User):
+            deltas.update(_user_change_deltas(obj))
+    for obj in session.deleted:
+        if isinstance(obj, models.User):
+            deltas.update(user_deltas(obj.is_active, obj.role, sign=-1))
+    if new_activities:
+        deltas.update(activity_deltas(new_activities))
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+def _user_change_deltas(user: models.User) -> Counter:
+    state = inspect(user)
+    active_history = state.attrs.is_active.history
+    role_history = state.attrs.role.history
+    if not active_history.has_changes() and not role_history.has_changes():
+        return Counter()
+    old_active = active_history.deleted[0] if active_history.deleted else user.is_active
+    old_role = role_history.deleted[0] if role_history.deleted else user.role
+    deltas = user_deltas(user.is_active, user.role)
+    deltas.subtract(user_deltas(old_active, old_role))
+    return deltas
+
+
+def compute_counters(db: Session) -> Dict[str, int]:
+    """
+    Count everything from the source tables (the slow path the counters replace)
+    """
+    total, active, admins, staff = db.execute(_user_counts_stmt()).one()
+    activities_total, suspicious = db.execute(_activity_counts_stmt()).one()
+    counters = {
+        USERS_TOTAL: total,
+        USERS_ACTIVE: active,
+        USERS_ADMIN: admins,
+        USERS_STAFF: staff,
+        ACTIVITIES_TOTAL: activities_total,
+        ACTIVITIES_SUSPICIOUS: suspicious,
+    }
+    today = datetime.now(UTC).date()
+    for offset in range(DAY_COUNTERS_KEPT):
+        day = today - timedelta(days=offset)
+        counters[day_counter(day)] = activity.count_activities(
+            db, datetime.combine(day, time.min, tzinfo=UTC), datetime.combine(day, time.max, tzinfo=UTC)
+        )
+    return {name: int(value or 0) for name, value in counters.items()}
+
+def reconcile(session_factory=SessionLocal) -> Optional[Dict[str, int]]:
+    """
+    Correct every counter from the source tables and drop stale day
+    counters. Returns the recounted values, or None when another process
+    is already reconciling.
+
+    Writers keep adding deltas meanwhile, so the counters are not
+    overwritten: the source tables and the counters are read in one
+    snapshot, and the difference is added like any other delta, which
+    keeps the deltas committed after the snapshot.
+    """
+    with Lease("dashboard-counter-reconcile", RECONCILE_LEASE_TTL, session_factory) as lease:
+        if not lease.held:
+            return None
+        db = session_factory()
+        try:
+            conn = _snapshot_connection(db)
+            counters = compute_counters(db)
+            table = models.DashboardCounter.__table__
+            stored = Counter()
+            stale = []
+            for row_name, value in conn.execute(select(table.c.name, table.c.value)):
+                name = counter_name(row_name)
+                stored[name] += int(value)
+                if name.startswith(ACTIVITIES_DAY_PREFIX) and name not in counters:
+                    stale.append(row_name)
+            now = datetime.now(UTC)
+            for name in sorted(counters):
+                # Even a zero correction creates shard 0, which ensure_counters looks for
+                _upsert(conn, name, counters[name] - stored[name], now)
+            if stale:
+                conn.execute(delete(table).where(table.c.name.in_(stale)))
+            db.commit()
+            return counters
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+def _snapshot_connection(db: Session) -> Connection:
+    """
+    The session's connection, in a transaction whose reads all see the same
+    committed state
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        conn = db.connection()
+        # pysqlite only opens a transaction before a write; take the write
+        # lock now, so no writer commits between the reads
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        return conn
+    return db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+
+def ensure_counters(session_factory=SessionLocal) -> bool:
+    """
+    Build the counters if they have never been built. Returns True when it did.
+    """
+    db = session_factory()
+    try:
+        seeded = db.get(models.DashboardCounter, USERS_TOTAL) is not None
+    finally:
+        db.close()
+    if seeded:
+        return False
+    reconcile(session_factory)
+    return True
+
+def _user_counts_stmt():
+    """
+    Total, active, admin and staff user counts in a single query
+    """
+    return select(
+        func.count(models.User.id),
+        func.sum(case((models.User.is_active == True, 1), else_=0)),
+        func.sum(case((models.User.role == "admin", 1), else_=0)),
+        func.sum(case((models.User.role == "staff", 1), else_=0)),
+    )
+
+def _activity_counts_stmt():
+    return select(
+        func.count(models.ActivityLog.id),
+        func.sum(case((models.ActivityLog.suspicious == True, 1), else_=0)),
+    )
+
+# Rebuilds the counters every DASHBOARD_RECONCILE_INTERVAL seconds; started by app.main
+reconciler = PeriodicTask("dashboard-counter-reconciler", reconcile, settings.dashboard_reconcile_interval)
@@ -1,6 +1,14 @@
+import threading
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from typing import Dict
+from .config import Settings, settings
 
 # Dependency for DB session
 def get_db():
@@ -11,20 +19,169 @@ def get_db():
         db.close()
 
 
-# Update these with your XAMPP MySQL credentials
-MYSQL_USER = "root"
-MYSQL_PASSWORD = ""
-MYSQL_HOST = "localhost"
-MYSQL_PORT = "3306"
-MYSQL_DB = "digital_twin"
+class PoolMetrics:
+    """
+    Counters for connection checkouts from a pool: how many, how long
+    callers waited for a connection, how often the pool had to go into
+    overflow and how often a checkout timed out.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
 
+    def record_checkout(self, wait: float, in_overflow: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if in_overflow:
+                self.overflow_events += 1
 
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
 
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+    def snapshot(self, pool) -> Dict:
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+            }
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+class _InstrumentedPoolMixin:
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.record_timeout()
+            raise
+        if self.metrics is not None:
+            self.metrics.record_checkout(time.perf_counter() - started, self.overflow() > 0)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def _engine_options(url: str, config: Settings, async_: bool = False) -> Dict:
+    """
+    Engine keyword arguments for the configured pool. SQLite keeps
+    SQLAlchemy's default pool, which does not take sizing options.
+    """
+    options = {"echo": config.db_echo}
+    if make_url(url).get_backend_name() == "sqlite":
+        return options
+
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if async_ else InstrumentedQueuePool,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle,
+        pool_pre_ping=config.db_pool_pre_ping,
+        connect_args={"connect_timeout": config.db_connect_timeout},
+    )
+    return options
+
+def create_db_engine(config: Settings = settings):
+    """
+    Create the synchronous engine from settings
+    """
+    engine = create_engine(config.database_url, **_engine_options(config.database_url, config))
+    if isinstance(engine.pool, _InstrumentedPoolMixin):
+        engine.pool.metrics = PoolMetrics()
+    return engine
+
+def pool_status(engine) -> Dict:
+    """
+    Pool metrics for an engine (sync or async)
+    """
+    pool = engine.pool
+    metrics = getattr(pool, "metrics", None)
+    if metrics is None:
+        return {"status": pool.status()}
+    return metrics.snapshot(pool)
+
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+engine = create_db_engine(settings)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+# Async drivers for each sync driver we support
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    """
+    Swap the sync DBAPI driver of a database URL for its async counterpart
+    """
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS[parsed.get_backend_name()]).render_as_string(hide_password=False)
+
+def create_async_db_engine(config: Settings = settings):
+    """
+    Create the async engine from settings
+    """
+    url = to_async_url(config.database_url)
+    async_engine = create_async_engine(url, **_engine_options(url, config, async_=True))
+    if isinstance(async_engine.pool, _InstrumentedPoolMixin):
+        async_engine.pool.metrics = PoolMetrics()
+    return async_engine
+
+# The async engine is created on first use so that sync-only scripts
+# (init_db, benchmarks) do not need the async driver installed.
+_async_engine = None
+_AsyncSessionLocal = None
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        _async_engine = create_async_db_engine(settings)
+        _AsyncSessionLocal = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession
+        )
+    return _async_engine
 
+def get_async_sessionmaker():
+    get_async_engine()
+    return _AsyncSessionLocal
 
+# Dependency for async DB session
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+def get_pool_metrics() -> Dict:
+    """
+    Pool metrics for the sync engine and, once created, the async engine
+    """
+    return {
+        "sync": pool_status(engine),
+        "async": pool_status(_async_engine) if _async_engine is not None else None,
+    }
+
+Base = declarative_base()
@@ -0,0 +1,162 @@
+"""
+Streaming export of activity logs.
+
+Rows are read through a server-side cursor (stream_results/yield_per) on a
+connection owned by the response generator and written out batch by batch
+as a JSON array, NDJSON or CSV (JSON rendered by responses.dumps, i.e.
+orjson when installed), optionally gzip-compressed on the fly.
+Memory stays bounded by the batch size whatever the size of the window,
+and the first bytes go out as soon as the first batch is read. The part of
+a window in months retired by the retention policy is read from the Parquet
+archive instead (see app/archive.py).
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from . import archive, models
+from .rollups import as_utc
+from .responses import dumps
+from .database import engine as default_engine
+
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+FORMAT_PATTERN = "^(" + "|".join(FORMATS) + ")$"
+COLUMNS = ("id", "user_id", "action", "timestamp", "details")
+BATCH_SIZE = 1000
+
+def parse_datetime(value: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+def iter_activity_rows(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int] = None,
+    newest_first: bool = False,
+    batch_size: int = BATCH_SIZE,
+    engine=None
+) -> Iterator[list]:
+    """
+    Yield batches of activity rows (as dicts) in the window, oldest first
+    unless newest_first. Rows before archive.archived_until come from the
+    archive, the rest from activity_logs.
+    The connection is held only while the generator is being consumed and
+    is released when it finishes or is closed (e.g. client disconnect).
+    """
+    archived_until = archive.archived_until()
+    if archived_until is None or as_utc(start_time) >= archived_until:
+        yield from _database_rows(start_time, end_time, user_id, newest_first, batch_size, engine)
+        return
+    # Both are generators, so neither is read before its turn
+    parts = [archive.read_activities(
+        start_time, min(as_utc(end_time), archived_until), user_id, newest_first,
+        end_inclusive=as_utc(end_time) < archived_until, batch_size=batch_size
+    )]
+    if as_utc(end_time) >= archived_until:
+        parts.append(_database_rows(archived_until, end_time, user_id, newest_first, batch_size, engine))
+    for part in reversed(parts) if newest_first else parts:
+        yield from part
+
+def _database_rows(
+    start_time: datetime,
+    end_time: datetime,
+    user_id: Optional[int],
+    newest_first: bool,
+    batch_size: int,
+    engine
+) -> Iterator[list]:
+    stmt = select(*[getattr(models.ActivityLog, column) for column in COLUMNS]).where(
+        models.ActivityLog.timestamp >= start_time,
+        models.ActivityLog.timestamp <= end_time,
+    )
+    if user_id is not None:
+        stmt = stmt.where(models.ActivityLog.user_id == user_id)
+    if newest_first:
+        stmt = stmt.order_by(models.ActivityLog.timestamp.desc(), models.ActivityLog.id.desc())
+    else:
+        stmt = stmt.order_by(models.ActivityLog.timestamp, models.ActivityLog.id)
+
+    with (engine or default_engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+        for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+
+def encode(batches: Iterator[list], fmt: str) -> Iterator[bytes]:
+    """
+    Encode batches of rows in the given format, one chunk per batch
+    """
+    if fmt == "json":
+        separator = b"["
+        for batch in batches:
+            if not batch:
+                continue
+            yield separator + b",".join(dumps(row) for row in batch)
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+    elif fmt == "ndjson":
+        for batch in batches:
+            if batch:
+                yield b"".join(dumps(row) + b"\n" for row in batch)
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        for batch in batches:
+            for row in batch:
+                writer.writerow([_csv_value(row[column]) for column in COLUMNS])
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}")
+
+def gzip_chunks(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        # Flush per batch so the client keeps receiving data
+        compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def activity_export_response(
+    start_time: datetime,
+    end_time: datetime,
+    fmt: str = "json",
+    gzip: bool = False,
+    user_id: Optional[int] = None,
+    newest_first: bool = False,
+    filename: Optional[str] = None
+) -> StreamingResponse:
+    """
+    StreamingResponse for the activity logs of a window
+    """
+    chunks = encode(iter_activity_rows(start_time, end_time, user_id, newest_first), fmt)
+    headers: Dict[str, str] = {}
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return StreamingResponse(chunks, media_type=FORMATS[fmt], headers=headers)
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
@@ -0,0 +1,146 @@
+"""
+Password hashing service.
+
+bcrypt is deliberately slow, so hashing and verification run in a small
+process pool instead of the API process. The number of in-flight jobs
+(running plus queued) is capped; when the pool is saturated new requests
+are rejected immediately with HashingPoolSaturated, which the API turns into
+a 503, instead of piling up behind a login burst and starving other
+endpoints.
+
+Workers are started with forkserver (spawn where it is not available, e.g.
+on Windows), never forked from the API process: by the first login it runs
+several threads (activity writer, periodic tasks, loop lag sampler), and a
+child forked from a threaded process can deadlock on a lock that another
+thread held at the fork. As with spawn, a script that hashes passwords
+needs the `if __name__ == "__main__":` guard, since workers import it.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from .config import settings
+
+# Never fork: see the module docstring
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool already has max_pending jobs in flight"""
+
+@lru_cache(maxsize=None)
+def _context(rounds: int) -> CryptContext:
+    # Hashes below the configured cost (or using an old bcrypt ident) are
+    # reported by verify_and_update so they can be upgraded on login.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=rounds,
+        bcrypt__min_rounds=rounds,
+    )
+
+def _hash_password(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+def _verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    return _context(rounds).verify_and_update(password, hashed_password)
+
+class PasswordHasher:
+    def __init__(
+        self,
+        rounds: int = settings.password_hash_rounds,
+        workers: int = settings.password_hash_workers,
+        max_pending: int = settings.password_hash_max_pending,
+    ):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._stats_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash_password, password, self.rounds).result()
+
+    def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password. The second element is a replacement hash when the
+        stored one uses outdated parameters, otherwise None.
+        """
+        return self._run(_verify_and_update, password, hashed_password, self.rounds).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._run(_hash_password, password, self.rounds))
+
+    async def verify_and_update_async(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await asyncio.wrap_future(
+            self._run(_verify_and_update, password, hashed_password, self.rounds)
+        )
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "rounds": self.rounds,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def _run(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self.rejected += 1
+            raise HashingPoolSaturated("Password hashing is saturated, retry shortly")
+
+        if self.workers <= 0:
+            # Inline mode, e.g. for scripts and benchmarks
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            self._release(future)
+            return future
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Future):
+        self._slots.release()
+        failed = future.cancelled() or future.exception() is not None
+        with self._stats_lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(_START_METHOD)
+                )
+            return self._executor
+
+hasher = PasswordHasher()
@@ -2,11 +2,19 @@ from .database import engine, Base
 from . import models
 from .models import User, Staff, Admin, ActivityLog
 from .auth import get_password_hash
+from .migrations import run_migrations
+from .counters import ensure_counters
+from .rules import ensure_rules
 from sqlalchemy.orm import sessionmaker
 
 def init():
     Base.metadata.create_all(bind=engine)
     print("Database tables created.")
+    run_migrations(engine)
+    if ensure_rules():
+        print("Activity rules seeded.")
+    if ensure_counters():
+        print("Dashboard counters built.")
     
     # Create sample data
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -31,7 +39,8 @@ def init():
             # Create admin record
             admin_record = Admin(
                 user_id=admin_user.id,
-                privileges="full_access"
+                privileges="full_access",
+                organisation_domain=admin_user.organisation_domain
             )
             db.add(admin_record)
             
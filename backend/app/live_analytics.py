@@ -0,0 +1,371 @@
+"""
+Live dashboard analytics.
+
+Dashboards used to refetch /admin/dashboard/stats,
+/admin/analytics/activities and /staff/activity/summary every 30 seconds,
+each refetch counting activity rows again. Instead, admin and staff sockets
+subscribe to the `analytics` WebSocket topic (see app/websocket.py):
+
+- on subscribing they get an `analytics_snapshot` of their tenant: activity
+  counts per hour bucket and action over the last LIVE_ANALYTICS_HOURS
+  hours, and the suspicious count per bucket;
+- after that, `analytics_delta` frames carry only what changed, e.g.
+  {"buckets": {"2026-01-05T14:00:00+00:00": {"failed_login": 1}}, ...}.
+
+Committed activity rows are picked up from every write path (the ORM flush
+of log_activity, and insert_activities used by batch ingest, the WebSocket
+ingest pipeline and the buffered writer) and handed to `analytics`, which
+every LIVE_ANALYTICS_FLUSH_INTERVAL seconds sums them per tenant into one
+delta frame per tenant and broadcasts it. Deltas go through the backplane,
+so every worker applies them to the tenants it holds and sends them to its
+sockets.
+
+A worker only holds the buckets of tenants with a local subscriber. They
+are counted from activity_logs when the first dashboard of a tenant
+subscribes and recounted every LIVE_ANALYTICS_RESYNC_INTERVAL seconds,
+and dropped once no local socket subscribes. A count includes rows
+committed before it started that may still be on their way as a delta, so
+deltas carry the commit time of their last row and snapshots the time
+their count started (`counted_at`, epoch seconds); a delta whose
+`last_commit` is older than `counted_at` is already in the snapshot and is
+skipped, here and by dashboards. A delta whose rows straddle `counted_at`
+is applied whole; the resync corrects that, as well as rows the deltas
+never see (written by raw SQL). So the database load from dashboards is one grouped
+query per tenant and worker per resync interval, whatever the number of
+open dashboards.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .cache import TTLCache
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_SNAPSHOT = "analytics_snapshot"
+ANALYTICS_DELTA = "analytics_delta"
+
+# Committed rows not yet flushed are dropped beyond this many (the next
+# resync recounts them)
+MAX_PENDING = 100000
+
+# (user_id, action, suspicious, timestamp)
+Row = Tuple[Optional[int], Optional[str], bool, Optional[datetime]]
+
+def hour_bucket(timestamp: Optional[datetime]) -> str:
+    """
+    ISO start of the UTC hour a timestamp (naive UTC, or now when None)
+    falls in; strings of this form sort chronologically
+    """
+    timestamp = datetime.now(UTC) if timestamp is None else timestamp
+    timestamp = timestamp.replace(tzinfo=UTC) if timestamp.tzinfo is None else timestamp.astimezone(UTC)
+    return timestamp.replace(minute=0, second=0, microsecond=0).isoformat()
+
+class _TenantBuckets:
+    __slots__ = ("counts", "suspicious", "counted_at")
+
+    def __init__(self, counts: Dict[str, Counter], suspicious: Counter, counted_at: float):
+        # hour bucket -> action -> count, and hour bucket -> suspicious count
+        self.counts = counts
+        self.suspicious = suspicious
+        # Epoch seconds the count started at
+        self.counted_at = counted_at
+
+class LiveAnalytics:
+    def __init__(
+        self,
+        hours: int = settings.live_analytics_hours,
+        flush_interval: float = settings.live_analytics_flush_interval,
+        resync_interval: float = settings.live_analytics_resync_interval,
+        session_factory=SessionLocal,
+    ):
+        self.hours = hours
+        self.flush_interval = flush_interval
+        self.resync_interval = resync_interval
+        self.session_factory = session_factory
+        # Set by app.websocket.publish_analytics: broadcast a frame to a
+        # tenant's subscribers, and whether this worker has any
+        self.publish: Optional[Callable[[str, str], Awaitable[None]]] = None
+        self.watched: Callable[[str], bool] = lambda tenant: True
+        # (commit time, row)
+        self._pending: List[Tuple[float, Row]] = []
+        self._lock = threading.Lock()
+        self._tenants: Dict[str, _TenantBuckets] = {}
+        self._counting: Dict[str, asyncio.Future] = {}
+        # Users do not change organisation, so their tenant is cached for long
+        self._user_tenants = TTLCache(maxsize=100000, ttl=3600)
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"observed": 0, "deltas": 0, "applied": 0, "counts": 0, "dropped": 0, "malformed": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Start flushing deltas; call from the event loop
+        """
+        if self.flush_interval > 0 and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop, after publishing what is pending
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        await self.flush()
+
+    def observe(self, rows: Iterable[Row]):
+        """
+        Feed committed activity rows; safe to call from any thread
+        """
+        if not self.running:
+            return
+        committed = time.time()
+        rows = [(committed, row) for row in rows]
+        with self._lock:
+            if len(self._pending) + len(rows) > MAX_PENDING:
+                self.stats["dropped"] += len(rows)
+                return
+            self._pending.extend(rows)
+            self.stats["observed"] += len(rows)
+
+    async def flush(self):
+        """
+        Publish one delta frame per tenant for the rows observed since the
+        last flush
+        """
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows or self.publish is None:
+            return
+        tenants = await self._tenants_of({row[0] for _, row in rows if row[0] is not None})
+        deltas: Dict[str, Dict] = {}
+        for committed, (user_id, action, suspicious, timestamp) in rows:
+            tenant = tenants.get(user_id)
+            if tenant is None:
+                continue
+            delta = deltas.get(tenant)
+            if delta is None:
+                delta = deltas[tenant] = {
+                    "buckets": {}, "suspicious": Counter(), "users": {}, "total": 0, "last_commit": committed,
+                }
+            delta["last_commit"] = max(delta["last_commit"], committed)
+            bucket = hour_bucket(timestamp)
+            action = action or ""
+            delta["buckets"].setdefault(bucket, Counter())[action] += 1
+            delta["users"].setdefault(str(user_id), Counter())[action] += 1
+            if suspicious:
+                delta["suspicious"][bucket] += 1
+            delta["total"] += 1
+        for tenant, delta in deltas.items():
+            frame = json.dumps({"type": ANALYTICS_DELTA, "tenant": tenant, **delta})
+            try:
+                await self.publish(tenant, frame)
+                self.stats["deltas"] += 1
+            except Exception:
+                logger.exception("Failed to publish analytics delta for %s", tenant)
+
+    def apply(self, text: str, tenant: Optional[str]):
+        """
+        Add a delta frame delivered to this worker (published by any
+        worker) to the tenant's buckets, if this worker holds them
+        """
+        buckets = self._tenants.get(tenant)
+        if buckets is None:
+            return
+        try:
+            frame = json.loads(text)
+            if not isinstance(frame, dict) or frame.get("type") != ANALYTICS_DELTA:
+                return
+            last_commit = float(frame["last_commit"])
+            # Checked as a whole first, so a malformed frame changes nothing
+            updates = [(str(bucket), Counter(dict(counts))) for bucket, counts in frame["buckets"].items()]
+            suspicious = Counter(dict(frame["suspicious"]))
+            if not all(isinstance(count, int) for _, counts in updates for count in counts.values()) \
+                    or not all(isinstance(count, int) for count in suspicious.values()):
+                raise ValueError("non-integer count")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.stats["malformed"] += 1
+            logger.warning("Dropping malformed analytics delta for %s", tenant, exc_info=True)
+            return
+        if last_commit < buckets.counted_at:
+            return
+        for bucket, counts in updates:
+            buckets.counts.setdefault(bucket, Counter()).update(counts)
+        buckets.suspicious.update(suspicious)
+        self.stats["applied"] += 1
+
+    async def snapshot(self, tenant: str) -> str:
+        """
+        The `analytics_snapshot` frame of a tenant. Its buckets are counted
+        from activity_logs if this worker does not hold them yet; once this
+        returns, deltas applied later are exactly what the frame lacks.
+        """
+        if tenant not in self._tenants:
+            await self._count(tenant)
+        buckets = self._tenants[tenant]
+        self._trim(buckets)
+        return json.dumps({
+            "type": ANALYTICS_SNAPSHOT,
+            "tenant": tenant,
+            "hours": self.hours,
+            "buckets": buckets.counts,
+            "suspicious": buckets.suspicious,
+            "counted_at": buckets.counted_at,
+            "timestamp": datetime.now(UTC).isoformat(),
+        })
+
+    def tenant_count(self) -> int:
+        return len(self._tenants)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _count(self, tenant: str):
+        # Concurrent subscribers of one tenant share a single query
+        future = self._counting.get(tenant)
+        if future is None:
+            future = self._counting[tenant] = asyncio.ensure_future(run_in_threadpool(self._load, tenant))
+            future.add_done_callback(lambda _: self._counting.pop(tenant, None))
+        self._tenants[tenant] = await asyncio.shield(future)
+        self.stats["counts"] += 1
+
+    def _load(self, tenant: str) -> _TenantBuckets:
+        since = datetime.now(UTC).replace(minute=0, second=0, microsecond=0) - timedelta(hours=self.hours - 1)
+        counted_at = time.time()
+        db = self.session_factory()
+        try:
+            rows = db.execute(_counts_stmt(db.get_bind().dialect.name, tenant, since)).all()
+        finally:
+            db.close()
+        counts: Dict[str, Counter] = {}
+        suspicious = Counter()
+        for hour, action, flagged, count in rows:
+            bucket = hour_bucket(hour if isinstance(hour, datetime) else datetime.fromisoformat(hour))
+            counts.setdefault(bucket, Counter())[action or ""] += count
+            if flagged:
+                suspicious[bucket] += count
+        return _TenantBuckets(counts, suspicious, counted_at)
+
+    def _trim(self, buckets: _TenantBuckets):
+        oldest = hour_bucket(datetime.now(UTC) - timedelta(hours=self.hours - 1))
+        for bucket in [bucket for bucket in buckets.counts if bucket < oldest]:
+            del buckets.counts[bucket]
+        for bucket in [bucket for bucket in buckets.suspicious if bucket < oldest]:
+            del buckets.suspicious[bucket]
+
+    async def _tenants_of(self, user_ids) -> Dict[int, str]:
+        tenants = {}
+        missing = []
+        for user_id in user_ids:
+            tenant = self._user_tenants.get(user_id)
+            if tenant is None:
+                missing.append(user_id)
+            else:
+                tenants[user_id] = tenant
+        if missing:
+            for user_id, tenant in (await run_in_threadpool(self._load_tenants, missing)).items():
+                self._user_tenants.set(user_id, tenant)
+                tenants[user_id] = tenant
+        return tenants
+
+    def _load_tenants(self, user_ids: List[int]) -> Dict[int, str]:
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                select(models.User.id, models.User.organisation_domain, models.User.email)
+                .where(models.User.id.in_(user_ids))
+            ).all()
+        finally:
+            db.close()
+        return {user_id: domain or models.extract_domain(email) for user_id, domain, email in rows}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_resync = loop.time() + self.resync_interval
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush analytics deltas")
+            if self.resync_interval > 0 and loop.time() >= next_resync:
+                next_resync = loop.time() + self.resync_interval
+                await self._resync()
+
+    async def _resync(self):
+        for tenant in list(self._tenants):
+            if not self.watched(tenant):
+                del self._tenants[tenant]
+                continue
+            try:
+                await self._count(tenant)
+            except Exception:
+                logger.exception("Failed to recount analytics of %s", tenant)
+
+def _counts_stmt(dialect: str, tenant: str, since: datetime):
+    """
+    (hour, action, suspicious, count) of a tenant's activities since `since`
+    """
+    timestamp = models.ActivityLog.timestamp
+    if dialect == "sqlite":
+        hour = func.strftime("%Y-%m-%d %H:00:00", timestamp)
+    elif dialect == "mysql":
+        hour = func.date_format(timestamp, "%Y-%m-%d %H:00:00")
+    else:
+        hour = func.date_trunc("hour", timestamp)
+    return (
+        select(hour, models.ActivityLog.action, models.ActivityLog.suspicious, func.count(models.ActivityLog.id))
+        .join(models.User, models.User.id == models.ActivityLog.user_id)
+        .where(models.User.organisation_domain == tenant, timestamp >= since)
+        .group_by(hour, models.ActivityLog.action, models.ActivityLog.suspicious)
+    )
+
+# Started by app.main; wired to the WebSocket manager by app.websocket.publish_analytics
+analytics = LiveAnalytics()
+
+_PENDING_KEY = "live_analytics_rows"
+
+def record(session: Session, rows: Iterable[Dict]):
+    """
+    Hand rows written with a Core insert (activity.insert_activities) to
+    `analytics` once the session commits
+    """
+    session.info.setdefault(_PENDING_KEY, []).extend(
+        (row["user_id"], row["action"], row["suspicious"], row.get("timestamp")) for row in rows
+    )
+
+@event.listens_for(Session, "before_flush")
+def _track_flush(session: Session, flush_context, instances):
+    rows = [
+        (obj.user_id, obj.action, bool(obj.suspicious), obj.timestamp)
+        for obj in session.new if isinstance(obj, models.ActivityLog)
+    ]
+    if rows:
+        session.info.setdefault(_PENDING_KEY, []).extend(rows)
+
+@event.listens_for(Session, "after_commit")
+def _committed(session: Session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        analytics.observe(rows)
+
+@event.listens_for(Session, "after_rollback")
+def _rolled_back(session: Session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,64 @@
+"""
+Event loop lag of this worker.
+
+A task sleeps EVENT_LOOP_LAG_INTERVAL seconds at a time and records how
+much later than scheduled it woke up. Anything holding the loop (a
+synchronous database call, CPU-heavy work in an async route) shows up as
+lag, and delays every socket and async request of the worker by as much.
+The last EVENT_LOOP_LAG_WINDOW samples are kept for
+/admin/system/event-loop.
+"""
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+from .config import settings
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = settings.event_loop_lag_interval, window: int = settings.event_loop_lag_window):
+        self.interval = interval
+        self.samples: "deque[float]" = deque(maxlen=window)
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """
+        Start sampling; call from the event loop
+        """
+        if self.interval > 0 and not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        samples = sorted(self.samples)
+        def pick(q):
+            return round(samples[min(int(q * len(samples)), len(samples) - 1)] * 1000, 2) if samples else None
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": len(samples),
+            "last_ms": round(self.samples[-1] * 1000, 2) if samples else None,
+            "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99),
+            "window_max_ms": round(samples[-1] * 1000, 2) if samples else None,
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.samples.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+monitor = LoopLagMonitor()
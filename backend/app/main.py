@@ -1,8 +1,14 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from . import database, init_db
+from fastapi.middleware.gzip import GZipMiddleware
+from . import database, init_db, pagination, activity_writer, counters, rollups, partitions, rules, loop_lag, ws_ingest, live_analytics
+from .hashing import hasher, HashingPoolSaturated
 from .routes import user_route, admin_route, staff_route, activity_route
-from .websocket import websocket_endpoint, manager
+from .websocket import websocket_endpoint, manager, publish_anomalies, publish_analytics
+from .config import settings
+import asyncio
+import gc
 import json
 
 app = FastAPI(title="Digital Twin System API", version="1.0.0")
@@ -13,9 +19,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cross-origin clients can only read listed response headers; they need the cursor to page
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
+if settings.response_gzip_min_size:
+    # Responses that already carry a Content-Encoding (exports with
+    # gzip=true) are passed through as they are
+    app.add_middleware(GZipMiddleware, minimum_size=settings.response_gzip_min_size)
 
 
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    # Shed load quickly instead of queueing behind a login burst
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # Include all routers
 app.include_router(user_route.router)
 app.include_router(admin_route.router)
@@ -52,6 +69,37 @@ async def startup_event():
     except Exception as e:
         print(f"Database initialization error: {e}")
 
+    if settings.activity_buffered_writes:
+        activity_writer.writer.start()
+    await manager.start()
+    ws_ingest.pipeline.start()
+    loop_lag.monitor.start()
+    publish_anomalies(asyncio.get_running_loop())
+    publish_analytics()
+    live_analytics.analytics.start()
+    counters.reconciler.start()
+    rules.reloader.start()
+    rollups.compactor.start()
+    partitions.maintainer.start()
+    # Keep the objects created at import and startup out of full garbage
+    # collections, which otherwise pause the event loop for tens of ms
+    gc.collect()
+    gc.freeze()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered activity logs and stop the background workers before exiting"""
+    await ws_ingest.pipeline.stop()
+    await live_analytics.analytics.stop()
+    loop_lag.monitor.stop()
+    await manager.stop()
+    activity_writer.writer.stop()
+    counters.reconciler.stop()
+    rules.reloader.stop()
+    rollups.compactor.stop()
+    partitions.maintainer.stop()
+    hasher.shutdown()
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
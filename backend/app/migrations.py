@@ -0,0 +1,168 @@
+"""
+Schema migrations for existing deployments.
+
+`Base.metadata.create_all` only creates missing tables, it never alters
+tables that already exist. Each migration below is an idempotent step that
+brings an older schema up to date; applied migrations are recorded in the
+`schema_migrations` table so they only run once.
+
+A migration runs in a transaction that is committed with its
+schema_migrations row, but it may commit partway (large backfills commit
+each batch). Being idempotent, a migration interrupted after such a commit
+simply carries on from there when it is run again.
+"""
+from sqlalchemy import Table, Column, Boolean, SmallInteger, String, DateTime, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from datetime import datetime, UTC
+from typing import Callable, List, Tuple
+from .database import Base
+
+schema_migrations = Table(
+    "schema_migrations",
+    Base.metadata,
+    Column("version", String(100), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+def add_index(conn: Connection, table: str, name: str, columns: List[str], unique: bool = False) -> bool:
+    """
+    Add an index to an existing table unless it is already there.
+    On MySQL the index is built online (in place, without locking writes).
+    Returns True when the index was created.
+    """
+    existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+    if name in existing:
+        return False
+
+    column_list = ", ".join(columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    if conn.dialect.name == "mysql":
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD {kind} {name} ({column_list}), "
+            f"ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+    else:
+        conn.execute(text(f"CREATE {kind} {name} ON {table} ({column_list})"))
+    return True
+
+def add_column(conn: Connection, table: str, column: Column) -> bool:
+    """
+    Add a nullable column to an existing table unless it is already there.
+    Returns True when the column was added.
+    """
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column.name in existing:
+        return False
+
+    column_type = column.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column.name} {column_type} NULL"))
+    return True
+
+def drop_index(conn: Connection, table: str, name: str) -> bool:
+    """
+    Drop an index if it exists. Returns True when the index was dropped.
+    """
+    existing = {index["name"] for index in inspect(conn).get_indexes(table)}
+    if name not in existing:
+        return False
+
+    if conn.dialect.name == "mysql":
+        conn.execute(text(f"ALTER TABLE {table} DROP INDEX {name}"))
+    else:
+        conn.execute(text(f"DROP INDEX {name}"))
+    return True
+
+def _add_activity_log_indexes(conn: Connection):
+    add_index(conn, "activity_logs", "ix_activity_logs_user_id_timestamp", ["user_id", "timestamp"])
+    add_index(conn, "activity_logs", "ix_activity_logs_action_timestamp", ["action", "timestamp"])
+    add_index(conn, "activity_logs", "ix_activity_logs_timestamp", ["timestamp"])
+
+def _email_domain_sql(conn: Connection) -> str:
+    if conn.dialect.name == "mysql":
+        return "LOWER(SUBSTRING_INDEX(email, '@', -1))"
+    return "LOWER(SUBSTR(email, INSTR(email, '@') + 1))"
+
+def _add_organisation_domain(conn: Connection, batch_size: int = 5000):
+    add_column(conn, "users", Column("organisation_domain", String(100)))
+
+    # Backfill in primary-key ranges, committing each one, so an UPDATE only
+    # holds the row locks of its slice of the table
+    conn.commit()
+    max_id = conn.execute(text("SELECT MAX(id) FROM users")).scalar() or 0
+    domain_sql = _email_domain_sql(conn)
+    for start in range(0, max_id + 1, batch_size):
+        conn.execute(
+            text(
+                f"UPDATE users SET organisation_domain = {domain_sql} "
+                f"WHERE id >= :start AND id < :end AND organisation_domain IS NULL"
+            ),
+            {"start": start, "end": start + batch_size},
+        )
+        conn.commit()
+    add_index(conn, "users", "ix_users_organisation_domain", ["organisation_domain"])
+
+    # Admins keep their domain on the admin row under a unique index, which
+    # enforces one admin per organisation. Existing duplicates keep the
+    # domain only on the oldest admin row.
+    add_column(conn, "admins", Column("organisation_domain", String(100)))
+    rows = conn.execute(text(
+        "SELECT admins.id, users.organisation_domain FROM admins "
+        "JOIN users ON users.id = admins.user_id "
+        "WHERE admins.organisation_domain IS NULL ORDER BY admins.id"
+    )).all()
+    claimed = set(conn.execute(text(
+        "SELECT organisation_domain FROM admins WHERE organisation_domain IS NOT NULL"
+    )).scalars())
+    for admin_id, domain in rows:
+        if domain is None or domain in claimed:
+            continue
+        claimed.add(domain)
+        conn.execute(
+            text("UPDATE admins SET organisation_domain = :domain WHERE id = :id"),
+            {"domain": domain, "id": admin_id},
+        )
+    add_index(conn, "admins", "ix_admins_organisation_domain", ["organisation_domain"], unique=True)
+
+def _add_staff_department_index(conn: Connection):
+    add_index(conn, "staff", "ix_staff_department", ["department"])
+
+def _add_activity_classification(conn: Connection):
+    from . import rules
+
+    add_column(conn, "activity_logs", Column("suspicious", Boolean))
+    add_column(conn, "activity_logs", Column("severity", SmallInteger))
+    add_column(conn, "activity_logs", Column("category", String(32)))
+    # activity_rules is seeded with the defaults right after the migrations
+    rules.reclassify(conn, rules.DEFAULT_RULES)
+    add_index(conn, "activity_logs", "ix_activity_logs_suspicious_timestamp", ["suspicious", "timestamp"])
+
+# Ordered list of (version, migration). Append new migrations at the end.
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None]]] = [
+    ("0001_activity_logs_indexes", _add_activity_log_indexes),
+    ("0002_organisation_domain", _add_organisation_domain),
+    ("0003_staff_department_index", _add_staff_department_index),
+    ("0004_activity_classification", _add_activity_classification),
+]
+
+def run_migrations(engine: Engine) -> List[str]:
+    """
+    Apply all pending migrations in order. Returns the versions applied.
+    """
+    schema_migrations.create(bind=engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+    newly_applied = []
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        # Not engine.begin(): migrations may commit as they go (see above)
+        with engine.connect() as conn:
+            migration(conn)
+            conn.execute(schema_migrations.insert().values(
+                version=version, applied_at=datetime.now(UTC)
+            ))
+            conn.commit()
+        newly_applied.append(version)
+        print(f"Applied migration {version}")
+    return newly_applied
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship, validates
 from pydantic import BaseModel, EmailStr
 from .database import Base
 import datetime
 from datetime import UTC
 
+def extract_domain(email: str) -> str:
+    """Extract domain from email address."""
+    return email.split('@')[-1].lower()
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -14,7 +18,17 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     role = Column(String(20), default="user")  # user, staff, admin
     created_at = Column(DateTime, default=lambda: datetime.datetime.now(UTC))
-    activity_logs = relationship("ActivityLog", back_populates="user")
+    # Tenant key, derived from the email domain; all tenant scoping filters on it
+    organisation_domain = Column(String(100), index=True)
+    # Relationships never load lazily (lazy="raise"): a query that needs one
+    # loads it explicitly (joinedload/selectinload), so serializing a list
+    # cannot turn into one query per row
+    activity_logs = relationship("ActivityLog", back_populates="user", lazy="raise")
+
+    @validates("email")
+    def _set_organisation_domain(self, key, email):
+        self.organisation_domain = extract_domain(email)
+        return email
 
 
 class UserCreate(BaseModel):
@@ -27,21 +41,79 @@ class Staff(Base):
     __tablename__ = "staff"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
-    department = Column(String(100))
-    user = relationship("User")
+    department = Column(String(100), index=True)
+    user = relationship("User", lazy="raise")
 
 class Admin(Base):
     __tablename__ = "admins"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     privileges = Column(String(255), default="full_access")
-    user = relationship("User")
+    # One admin per organisation domain
+    organisation_domain = Column(String(100), unique=True, index=True)
+    user = relationship("User", lazy="raise")
 
 class ActivityLog(Base):
     __tablename__ = "activity_logs"
+    # Every activity query filters on user_id, action or a timestamp window
+    # and sorts by timestamp. Existing databases get these through
+    # app.migrations.
+    __table_args__ = (
+        Index("ix_activity_logs_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_activity_logs_action_timestamp", "action", "timestamp"),
+        Index("ix_activity_logs_timestamp", "timestamp"),
+        Index("ix_activity_logs_suspicious_timestamp", "suspicious", "timestamp"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     action = Column(String(255))
     timestamp = Column(DateTime, default=lambda: datetime.datetime.now(UTC))
     details = Column(String(255))
-    user = relationship("User", back_populates="activity_logs")
+    # Set at write time from the matching rule in app.rules
+    suspicious = Column(Boolean, default=False)
+    severity = Column(SmallInteger)
+    category = Column(String(32))
+    user = relationship("User", back_populates="activity_logs", lazy="raise")
+
+class ActivityRollup(Base):
+    # Activity counts per (hour or day) bucket, user and action, built from
+    # activity_logs by app.rollups. user_id 0 holds the totals of all users.
+    __tablename__ = "activity_rollups"
+    # Compaction replaces whole buckets across all users
+    __table_args__ = (
+        Index("ix_activity_rollups_granularity_bucket_start", "granularity", "bucket_start"),
+    )
+    granularity = Column(String(8), primary_key=True)  # hour, day
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    bucket_start = Column(DateTime, primary_key=True)
+    action = Column(String(255), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class ActivityRollupState(Base):
+    # activity_rollups of a granularity are complete up to compacted_until
+    __tablename__ = "activity_rollup_state"
+    granularity = Column(String(8), primary_key=True)
+    compacted_until = Column(DateTime, nullable=False)
+
+class ActivityRule(Base):
+    # Classification rules, loaded into app.rules.registry
+    __tablename__ = "activity_rules"
+    action = Column(String(255), primary_key=True)
+    category = Column(String(32), nullable=False)
+    severity = Column(SmallInteger, nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime, default=lambda: datetime.datetime.now(UTC))
+
+class DashboardCounter(Base):
+    # Precomputed dashboard totals, maintained by app.counters
+    __tablename__ = "dashboard_counters"
+    name = Column(String(64), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.datetime.now(UTC))
+
+class MaintenanceLease(Base):
+    # Held by the one process running a maintenance job, see app.periodic.Lease
+    __tablename__ = "maintenance_leases"
+    name = Column(String(64), primary_key=True)
+    holder = Column(String(32), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
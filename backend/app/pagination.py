@@ -0,0 +1,93 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Cursors are opaque, URL-safe strings encoding the sort key of the last row
+of a page: (timestamp, id) for activity logs and id for users. The next
+page is fetched with a range predicate on that key instead of OFFSET, so
+every page costs the same as the first one. Listing endpoints return the
+cursor for the next page in the X-Next-Cursor response header (absent on
+the last page) and accept it back through the `cursor` query parameter.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+from . import models
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, dict):
+            raise ValueError
+        return payload
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def activity_cursor(activity_log) -> str:
+    return encode_cursor({"ts": activity_log.timestamp.isoformat(), "id": activity_log.id})
+
+def activity_dict_cursor(activity_log: dict) -> str:
+    return encode_cursor({"ts": activity_log["timestamp"].isoformat(), "id": activity_log["id"]})
+
+def user_cursor(user) -> str:
+    return encode_cursor({"id": user.id})
+
+def decode_activity_cursor(cursor: str) -> Tuple[datetime, int]:
+    payload = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(payload["ts"]), int(payload["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def decode_user_cursor(cursor: str) -> int:
+    payload = decode_cursor(cursor)
+    try:
+        return int(payload["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_activity(stmt, cursor: Optional[str]):
+    """
+    Restrict a newest-first activity query to rows after the cursor.
+    Written as `timestamp <= t AND (timestamp < t OR id < i)` so the
+    timestamp part stays an index range.
+    """
+    if not cursor:
+        return stmt
+    timestamp, last_id = decode_activity_cursor(cursor)
+    return stmt.where(
+        models.ActivityLog.timestamp <= timestamp,
+        or_(
+            models.ActivityLog.timestamp < timestamp,
+            and_(models.ActivityLog.timestamp == timestamp, models.ActivityLog.id < last_id),
+        ),
+    )
+
+def after_user(stmt, cursor: Optional[str]):
+    """
+    Restrict an id-ordered user query to rows after the cursor
+    """
+    if not cursor:
+        return stmt
+    return stmt.where(models.User.id > decode_user_cursor(cursor))
+
+def set_next_cursor(response: Response, rows: Sequence, limit: int, make_cursor) -> Optional[str]:
+    """
+    Set the X-Next-Cursor header when the page is full. Returns the cursor.
+    """
+    if len(rows) < limit or not rows:
+        return None
+    cursor = make_cursor(rows[-1])
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cursor
@@ -0,0 +1,310 @@
+"""
+Monthly range partitioning and retention for activity_logs.
+
+On MySQL, activity_logs can be converted to
+
+    PARTITION BY RANGE COLUMNS(timestamp) (
+        PARTITION p202501 VALUES LESS THAN ('2025-02-01'),
+        ...
+        PARTITION pmax VALUES LESS THAN (MAXVALUE)
+    )
+
+with `python -m app.partitions enable`. MySQL requires the partitioning
+column in every unique key and does not allow foreign keys on partitioned
+tables, so the conversion drops the user_id foreign key (the ORM
+relationship is unaffected) and makes the primary key (id, timestamp). It
+rebuilds the table: run it in a maintenance window or through an online
+schema change tool.
+
+Once partitioned, the `maintainer` thread (ACTIVITY_PARTITION_MAINTENANCE_INTERVAL)
+keeps ACTIVITY_PARTITION_MONTHS_AHEAD future months created by splitting
+pmax, and applies ACTIVITY_RETENTION_MONTHS: whole expired months are
+exported to the Parquet archive (app/archive.py, when ACTIVITY_ARCHIVE_DIR
+is set) and then removed with DROP PARTITION, a metadata operation instead
+of a row-by-row DELETE. A month is only removed after the day rollups cover
+it, so analytics over it keep working. Unpartitioned tables (and SQLite)
+get the same retention with DELETEs in id batches.
+
+Rows never leave the database before they are in a published archive part:
+unpartitioned tables delete exactly the archived ids, so a run that stops
+halfway is resumed by the next one, and a partition is only dropped when
+the archive holds all of its rows. Every worker runs the maintainer thread;
+the `activity-partition-maintenance` lease lets one of them work at a time.
+
+Queries prune partitions when they restrict the bare timestamp column
+(`timestamp >= :start AND timestamp <= :end`), as every time-range helper
+in app/activity.py and app/rollups.py does; wrapping the column in a
+function (DATE(timestamp) = ...) scans every partition. `explain_partitions`
+shows which partitions a statement reads.
+"""
+import argparse
+import json
+import logging
+from datetime import date, datetime, timedelta, UTC
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, inspect, select, text
+from sqlalchemy.engine import Connection
+
+from . import archive, counters, models, rollups
+from .config import settings
+from .database import engine, SessionLocal
+from .periodic import Lease, PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+TABLE = "activity_logs"
+MAXVALUE_PARTITION = "pmax"
+# Longest a maintenance run may go without renewing its lease (it renews
+# after each month) before another process may take over
+MAINTENANCE_LEASE_TTL = 6 * 3600.0
+
+ActivityLog = models.ActivityLog
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+def _partition_clause(month: date) -> str:
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1).isoformat()}')"
+
+def list_partitions(conn: Connection) -> List[Dict]:
+    """
+    Partitions of activity_logs in order, with their row estimates. Empty
+    when the table is not partitioned (or not on MySQL).
+    """
+    if conn.dialect.name != "mysql":
+        return []
+    rows = conn.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS "
+        "FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": TABLE}).all()
+    return [{"name": name, "less_than": bound.strip("'"), "rows": table_rows} for name, bound, table_rows in rows]
+
+def is_partitioned(conn: Connection) -> bool:
+    return bool(list_partitions(conn))
+
+def enable_partitioning(conn: Connection, months_ahead: int = settings.activity_partition_months_ahead) -> bool:
+    """
+    Convert activity_logs to monthly RANGE COLUMNS partitions, from the month
+    of the oldest row to `months_ahead` months from now. Returns False if it
+    already is partitioned.
+    """
+    if conn.dialect.name != "mysql":
+        raise RuntimeError("Partitioning activity_logs is only supported on MySQL")
+    if is_partitioned(conn):
+        return False
+
+    for foreign_key in inspect(conn).get_foreign_keys(TABLE):
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP FOREIGN KEY {foreign_key['name']}"))
+    conn.execute(text(
+        f"ALTER TABLE {TABLE} MODIFY `timestamp` DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, `timestamp`)"
+    ))
+
+    current = month_start(datetime.now(UTC))
+    oldest = conn.execute(select(func.min(ActivityLog.timestamp))).scalar()
+    month = month_start(oldest) if oldest is not None else current
+    clauses = []
+    while month <= add_months(current, months_ahead):
+        clauses.append(_partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append(f"PARTITION {MAXVALUE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    conn.execute(text(f"ALTER TABLE {TABLE} PARTITION BY RANGE COLUMNS(`timestamp`) ({', '.join(clauses)})"))
+    return True
+
+def ensure_future_partitions(conn: Connection, months_ahead: int = settings.activity_partition_months_ahead) -> List[str]:
+    """
+    Split pmax so that every month up to `months_ahead` months from now has
+    its own partition. Returns the partitions created.
+    """
+    partitions = [p for p in list_partitions(conn) if p["name"] != MAXVALUE_PARTITION]
+    if not partitions:
+        return []
+    month = datetime.strptime(partitions[-1]["less_than"][:10], "%Y-%m-%d").date()
+    last = add_months(month_start(datetime.now(UTC)), months_ahead)
+    clauses = []
+    created = []
+    while month <= last:
+        clauses.append(_partition_clause(month))
+        created.append(partition_name(month))
+        month = add_months(month, 1)
+    if clauses:
+        # pmax is normally empty, so reorganising it does not copy rows
+        clauses.append(f"PARTITION {MAXVALUE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} REORGANIZE PARTITION {MAXVALUE_PARTITION} INTO ({', '.join(clauses)})"
+        ))
+    return created
+
+def expired_months(conn: Connection, retention_months: int, now: Optional[datetime] = None) -> List[date]:
+    """
+    Months that are entirely older than the retention period and already
+    covered by the day rollups, oldest first
+    """
+    if retention_months <= 0:
+        return []
+    day_watermark = conn.execute(
+        select(models.ActivityRollupState.compacted_until).where(models.ActivityRollupState.granularity == rollups.DAY)
+    ).scalar()
+    if day_watermark is None:
+        # Without rollups the months would vanish from analytics too
+        return []
+    cutoff = min(add_months(month_start(now or datetime.now(UTC)), -retention_months), month_start(day_watermark))
+
+    if is_partitioned(conn):
+        months = [
+            datetime.strptime(p["name"][1:], "%Y%m").date()
+            for p in list_partitions(conn) if p["name"] != MAXVALUE_PARTITION
+        ]
+        return [month for month in months if add_months(month, 1) <= cutoff]
+
+    oldest = conn.execute(select(func.min(ActivityLog.timestamp))).scalar()
+    months = []
+    month = month_start(oldest) if oldest is not None else cutoff
+    while add_months(month, 1) <= cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def retire_month(
+    conn: Connection,
+    month: date,
+    archive_dir: Optional[str] = settings.activity_archive_dir,
+    batch_size: int = 10_000
+) -> Optional[Dict]:
+    """
+    Archive (when archive_dir is set) and remove one month of activity logs.
+    Returns None when a partitioned month received rows while it was being
+    archived; it is left in place for the next run.
+    """
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    partitioned = is_partitioned(conn)
+    if not archive_dir:
+        if partitioned:
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {partition_name(month)}"))
+        else:
+            _delete_range(conn, start, end, batch_size)
+        return {"month": month.isoformat(), "archived_rows": None}
+
+    # Rows archived by an earlier run that stopped before removing them all
+    deleted = _delete_archived(conn, start, end, archive.month_parts(month, archive_dir), batch_size)
+    # What is left has not been archived yet; it goes to a new part
+    archived, part = archive.write_month(_month_batches(conn, start, end, batch_size), month, archive_dir)
+    if partitioned:
+        remaining = conn.execute(
+            select(func.count()).select_from(ActivityLog)
+            .where(ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+        ).scalar_one()
+        if remaining != archived:
+            # Rows arrived after the export; the next run archives them first
+            return None
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {partition_name(month)}"))
+        deleted += remaining
+    elif part is not None:
+        deleted += _delete_archived(conn, start, end, [part], batch_size)
+    archive.mark_retired(month, archive_dir)
+    return {"month": month.isoformat(), "archived_rows": archived, "deleted_rows": deleted}
+
+def _month_batches(conn: Connection, start: datetime, end: datetime, batch_size: int):
+    # Server-side cursor, so a month is never held in memory at once
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+        select(*[getattr(ActivityLog, column) for column in archive.COLUMNS])
+        .where(ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+        .order_by(ActivityLog.timestamp, ActivityLog.id)
+    )
+    for partition in result.mappings().partitions(batch_size):
+        yield [dict(row) for row in partition]
+
+def _delete_archived(conn: Connection, start: datetime, end: datetime, parts: List[str], batch_size: int) -> int:
+    # Deletes only ids that are in the archive, committing each batch
+    deleted = 0
+    for ids in archive.read_ids(parts, batch_size):
+        deleted += conn.execute(delete(ActivityLog).where(
+            ActivityLog.id.in_(ids), ActivityLog.timestamp >= start, ActivityLog.timestamp < end
+        )).rowcount
+        conn.commit()
+    return deleted
+
+def _delete_range(conn: Connection, start: datetime, end: datetime, batch_size: int):
+    # Without an archive: delete by id range so each statement stays short
+    while True:
+        ids = conn.execute(
+            select(ActivityLog.id).where(ActivityLog.timestamp >= start, ActivityLog.timestamp < end).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return
+        conn.execute(delete(ActivityLog).where(ActivityLog.id.in_(ids)))
+        conn.commit()
+
+def maintain() -> Optional[Dict]:
+    """
+    Create upcoming partitions and apply the retention policy. Returns None
+    when another process is already running the maintenance.
+    """
+    with Lease("activity-partition-maintenance", MAINTENANCE_LEASE_TTL) as lease:
+        if not lease.held:
+            return None
+        report = {"created": [], "retired": [], "postponed": []}
+        with engine.connect() as conn:
+            if is_partitioned(conn):
+                report["created"] = ensure_future_partitions(conn)
+            for month in expired_months(conn, settings.activity_retention_months):
+                retired = retire_month(conn, month)
+                conn.commit()
+                if retired is None:
+                    report["postponed"].append(month.isoformat())
+                    logger.warning("Activity logs of %s changed while being archived; retrying next run", month)
+                else:
+                    report["retired"].append(retired)
+                    logger.info("Retired activity logs of %s", month)
+                if not lease.renew():
+                    logger.warning("Lost the partition maintenance lease; stopping")
+                    break
+        if report["retired"]:
+            # Totals no longer include the removed rows
+            counters.reconcile(SessionLocal)
+        return report
+
+def explain_partitions(conn: Connection, statement) -> List[str]:
+    """
+    Partitions MySQL reads for a statement, from EXPLAIN
+    """
+    sql = str(statement.compile(conn, compile_kwargs={"literal_binds": True}))
+    rows = conn.execute(text(f"EXPLAIN {sql}")).mappings().all()
+    return [row.get("partitions") for row in rows]
+
+# Runs every ACTIVITY_PARTITION_MAINTENANCE_INTERVAL seconds; started by app.main
+maintainer = PeriodicTask(
+    "activity-partition-maintenance", maintain, settings.activity_partition_maintenance_interval, initial_delay=60
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="activity_logs partition maintenance")
+    parser.add_argument("command", choices=["status", "enable", "maintain"])
+    args = parser.parse_args()
+
+    if args.command == "enable":
+        with engine.begin() as conn:
+            print("Partitioning enabled" if enable_partitioning(conn) else "Already partitioned")
+    elif args.command == "maintain":
+        report = maintain()
+        print("Maintenance is running in another process" if report is None else json.dumps(report, indent=2, default=str))
+    with engine.connect() as conn:
+        print(json.dumps({
+            "partitions": list_partitions(conn),
+            "archived_months": [month.isoformat() for month in archive.archived_months()]
+            if settings.activity_archive_dir else [],
+        }, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
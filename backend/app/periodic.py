@@ -0,0 +1,144 @@
+"""
+Background thread that runs a maintenance function at a fixed interval,
+used by the dashboard counter reconciliation, the rollup compaction and
+the partition maintenance.
+
+Each API worker process runs its own thread. The rollup compaction is safe
+to run concurrently (it claims buckets by advancing a watermark); jobs that
+are not take a `Lease` first, so that only one process runs them at a time
+and the others skip that round.
+"""
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    def __init__(self, name: str, fn: Callable[[], object], interval: float, initial_delay: Optional[float] = None):
+        """
+        Call `fn` every `interval` seconds (disabled when interval <= 0). The
+        first call happens after `initial_delay` seconds, by default one interval.
+        """
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.initial_delay = interval if initial_delay is None else initial_delay
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[datetime] = None
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        delay = self.initial_delay
+        while not self._stop.wait(delay):
+            try:
+                self.fn()
+                self.last_run = datetime.now(UTC)
+            except Exception:
+                self.failures += 1
+                logger.exception("Periodic task %s failed", self.name)
+            delay = self.interval
+
+class Lease:
+    """
+    A named lease in the maintenance_leases table, held by at most one
+    process (across workers and hosts sharing the database) at a time:
+
+        with Lease("job", ttl=600) as lease:
+            if not lease.held:
+                return  # another process is running it
+
+    It is released on exit. A lease left behind by a process that died
+    expires after `ttl` seconds and can then be taken over, so `ttl` must
+    exceed the longest run; long jobs call renew() as they make progress.
+    """
+    def __init__(self, name: str, ttl: float, session_factory=SessionLocal):
+        self.name = name
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self.holder = uuid.uuid4().hex
+        self.held = False
+
+    def acquire(self) -> bool:
+        now = datetime.now(UTC)
+        db = self.session_factory()
+        try:
+            # Take the lease over if it expired, or create it; either way a
+            # concurrent taker loses (no row left to update, or a duplicate key)
+            taken = db.execute(
+                update(models.MaintenanceLease)
+                .where(models.MaintenanceLease.name == self.name, models.MaintenanceLease.expires_at <= now)
+                .values(holder=self.holder, expires_at=now + timedelta(seconds=self.ttl))
+            ).rowcount
+            if not taken:
+                db.add(models.MaintenanceLease(
+                    name=self.name, holder=self.holder, expires_at=now + timedelta(seconds=self.ttl)
+                ))
+            db.commit()
+            self.held = True
+        except IntegrityError:
+            db.rollback()
+            self.held = False
+        finally:
+            db.close()
+        return self.held
+
+    def renew(self) -> bool:
+        """
+        Push the expiry `ttl` seconds ahead. Returns False if the lease was
+        lost (it expired and another process took it over).
+        """
+        self.held = self._update(datetime.now(UTC) + timedelta(seconds=self.ttl))
+        return self.held
+
+    def release(self):
+        if self.held:
+            self._update(datetime.now(UTC))
+            self.held = False
+
+    def _update(self, expires_at: datetime) -> bool:
+        db = self.session_factory()
+        try:
+            updated = db.execute(
+                update(models.MaintenanceLease)
+                .where(models.MaintenanceLease.name == self.name, models.MaintenanceLease.holder == self.holder)
+                .values(expires_at=expires_at)
+            ).rowcount
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    def __enter__(self) -> "Lease":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
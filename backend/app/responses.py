@@ -0,0 +1,45 @@
+"""
+Lean JSON responses for large lists.
+
+Routes without a response_model hand their result to FastAPI's
+jsonable_encoder, which walks every value in Python before json.dumps
+renders it again; for a few hundred activity rows that is most of the
+request. Routes listing plain rows (dicts of ints, strings and datetimes)
+instead return a FastJSONResponse, rendered in one pass by orjson when it
+is installed (stdlib json otherwise).
+
+Routes with a response_model need none of this: FastAPI validates the
+result with a TypeAdapter and dumps it with pydantic's serializer. What
+they should avoid is feeding it ORM entities; see activity.ActivityRow.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used without it
+    orjson = None
+
+def dumps(content: Any) -> bytes:
+    """
+    Compact JSON of `content`; datetimes and dates as ISO 8601
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with `dumps`; return it from the route so that
+    FastAPI does not run jsonable_encoder over the content first
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
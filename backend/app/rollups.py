@@ -0,0 +1,318 @@
+"""
+Hourly and daily activity rollups.
+
+Analytics over long windows (up to a year) used to count raw activity_logs
+rows. The activity_rollups table keeps
+(granularity, user_id, bucket_start, action) -> count at hour and day
+granularity, with user_id 0 (ALL_USERS) holding the totals over all users.
+It is filled by the `compactor` thread:
+
+- an hour bucket is counted from activity_logs once it ended more than
+  ACTIVITY_ROLLUP_GRACE seconds ago, so buffered writes have landed;
+- a day bucket is summed from its hour rollups once all its hours are in.
+
+activity_rollup_state records up to where each granularity is complete (the
+watermark). Readers split a time window into whole days and hours below the
+watermarks, answered from the rollups, and the edges around them (the
+partial first hour and everything after the hour watermark), counted from
+activity_logs; see counts_by_action_stmt and counts_by_day_stmt. Rows
+written with a timestamp already behind the watermark are only visible
+through the raw path, not through the rollups. Raw edges in months that the
+retention policy moved to the archive (before archive.archived_until) are
+planned as ARCHIVE pieces, which app/activity.py counts from the archive.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import TTLCache
+from .config import settings
+from .database import SessionLocal
+from .periodic import PeriodicTask
+
+HOUR = "hour"
+DAY = "day"
+RAW = "raw"
+ARCHIVE = "archive"
+BUCKET_SIZES = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+# user_id of the rollup rows that hold the totals over all users
+ALL_USERS = 0
+
+Rollup = models.ActivityRollup
+RollupState = models.ActivityRollupState
+ActivityLog = models.ActivityLog
+
+# (source, start, end, end_inclusive); source is HOUR, DAY, RAW or ARCHIVE
+Piece = Tuple[str, datetime, datetime, bool]
+
+def as_utc(value: datetime) -> datetime:
+    # Timestamps are stored as naive UTC
+    return value.replace(tzinfo=UTC) if value.tzinfo is None else value.astimezone(UTC)
+
+def floor_bucket(value: datetime, granularity: str) -> datetime:
+    value = as_utc(value).replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0) if granularity == DAY else value
+
+def ceil_bucket(value: datetime, granularity: str) -> datetime:
+    floored = floor_bucket(value, granularity)
+    return floored if floored == as_utc(value) else floored + BUCKET_SIZES[granularity]
+
+# Watermarks only move forward, so a slightly stale copy is still correct
+# (the reader just counts a few more raw rows).
+watermark_cache = TTLCache(maxsize=1, ttl=max(settings.activity_rollup_interval, 1.0))
+
+def get_watermarks(db: Session) -> Dict[str, datetime]:
+    watermarks = watermark_cache.get("watermarks")
+    if watermarks is None:
+        watermarks = {granularity: as_utc(until) for granularity, until in db.execute(_watermarks_stmt())}
+        watermark_cache.set("watermarks", watermarks)
+    return watermarks
+
+async def get_watermarks_async(db: AsyncSession) -> Dict[str, datetime]:
+    watermarks = watermark_cache.get("watermarks")
+    if watermarks is None:
+        rows = (await db.execute(_watermarks_stmt())).all()
+        watermarks = {granularity: as_utc(until) for granularity, until in rows}
+        watermark_cache.set("watermarks", watermarks)
+    return watermarks
+
+def _watermarks_stmt():
+    return select(RollupState.granularity, RollupState.compacted_until)
+
+def plan_window(
+    start_time: datetime,
+    end_time: datetime,
+    watermarks: Dict[str, datetime],
+    archived_until: Optional[datetime] = None
+) -> List[Piece]:
+    """
+    Split [start_time, end_time] into whole days and hours that the rollups
+    cover and raw edges that have to be counted from activity_logs, or from
+    the archive before `archived_until`
+    """
+    start_time, end_time = as_utc(start_time), as_utc(end_time)
+    day_start = ceil_bucket(start_time, DAY)
+    day_end = min(floor_bucket(end_time, DAY), watermarks.get(DAY, day_start))
+    if day_end > day_start:
+        pieces = (
+            _plan_hours(start_time, day_start, False, watermarks)
+            + [(DAY, day_start, day_end, False)]
+            + _plan_hours(day_end, end_time, True, watermarks)
+        )
+    else:
+        pieces = _plan_hours(start_time, end_time, True, watermarks)
+    return _split_archived(pieces, archived_until) if archived_until is not None else pieces
+
+def _plan_hours(start: datetime, end: datetime, inclusive: bool, watermarks: Dict[str, datetime]) -> List[Piece]:
+    hour_start = ceil_bucket(start, HOUR)
+    hour_end = min(floor_bucket(end, HOUR), watermarks.get(HOUR, hour_start))
+    if hour_end <= hour_start:
+        return _raw(start, end, inclusive)
+    return _raw(start, hour_start, False) + [(HOUR, hour_start, hour_end, False)] + _raw(hour_end, end, inclusive)
+
+def _raw(start: datetime, end: datetime, inclusive: bool) -> List[Piece]:
+    if start < end or (inclusive and start == end):
+        return [(RAW, start, end, inclusive)]
+    return []
+
+def _split_archived(pieces: List[Piece], archived_until: datetime) -> List[Piece]:
+    split = []
+    for source, start, end, inclusive in pieces:
+        if source != RAW or start >= archived_until:
+            split.append((source, start, end, inclusive))
+        elif end < archived_until or (end == archived_until and not inclusive):
+            split.append((ARCHIVE, start, end, inclusive))
+        else:
+            split.append((ARCHIVE, start, archived_until, False))
+            split.append((RAW, archived_until, end, inclusive))
+    return split
+
+def counts_by_action_stmt(
+    start_time: datetime,
+    end_time: datetime,
+    watermarks: Dict[str, datetime],
+    user_id: Optional[int] = None,
+    archived_until: Optional[datetime] = None
+):
+    """
+    (action, count) rows for a time window, from rollups where possible.
+    ARCHIVE pieces are left out; None when nothing is left to query.
+    """
+    return _counts_stmt(
+        plan_window(start_time, end_time, watermarks, archived_until), user_id, Rollup.action, ActivityLog.action
+    )
+
+def counts_by_day_stmt(
+    start_time: datetime,
+    end_time: datetime,
+    watermarks: Dict[str, datetime],
+    user_id: Optional[int] = None,
+    archived_until: Optional[datetime] = None
+):
+    """
+    (date, count) rows for a time window, from rollups where possible.
+    ARCHIVE pieces are left out; None when nothing is left to query.
+    """
+    return _counts_stmt(
+        plan_window(start_time, end_time, watermarks, archived_until), user_id,
+        func.date(Rollup.bucket_start), func.date(ActivityLog.timestamp)
+    )
+
+def _counts_stmt(pieces: List[Piece], user_id: Optional[int], rollup_key, raw_key):
+    # One UNION ALL over the pieces so the whole window is a single round trip
+    parts = []
+    for source, start, end, inclusive in pieces:
+        if source == ARCHIVE:
+            continue
+        if source == RAW:
+            timestamp = ActivityLog.timestamp
+            part = select(raw_key.label("grp"), func.count(ActivityLog.id).label("cnt")).where(
+                timestamp >= start, timestamp <= end if inclusive else timestamp < end
+            )
+            if user_id is not None:
+                part = part.where(ActivityLog.user_id == user_id)
+            parts.append(part.group_by(raw_key))
+        else:
+            parts.append(
+                select(rollup_key.label("grp"), func.sum(Rollup.count).label("cnt"))
+                .where(
+                    Rollup.granularity == source,
+                    Rollup.user_id == (ALL_USERS if user_id is None else user_id),
+                    Rollup.bucket_start >= start,
+                    Rollup.bucket_start < end,
+                )
+                .group_by(rollup_key)
+            )
+    if not parts:
+        return None
+    combined = (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+    return (
+        select(combined.c.grp, func.sum(combined.c.cnt))
+        .group_by(combined.c.grp)
+        .order_by(combined.c.grp)
+    )
+
+def compact(session_factory=SessionLocal, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Roll up every hour and day bucket that is complete. Returns the number
+    of buckets compacted per granularity.
+    """
+    now = as_utc(now or datetime.now(UTC))
+    db = session_factory()
+    try:
+        hours = _compact(
+            db, HOUR, floor_bucket(now - timedelta(seconds=settings.activity_rollup_grace), HOUR),
+            _first_activity_stmt, _build_hour
+        )
+        hour_watermark = _watermark(db, HOUR)
+        days = 0
+        if hour_watermark is not None:
+            days = _compact(db, DAY, floor_bucket(hour_watermark, DAY), _first_hour_rollup_stmt, _build_day)
+    finally:
+        db.close()
+    watermark_cache.clear()
+    return {HOUR: hours, DAY: days}
+
+def _compact(db: Session, granularity: str, target: datetime, first_stmt, build) -> int:
+    until = _watermark(db, granularity)
+    if until is None:
+        first = db.scalar(first_stmt(None))
+        if first is None:
+            return 0
+        until = floor_bucket(first, granularity)
+        try:
+            db.add(RollupState(granularity=granularity, compacted_until=until))
+            db.commit()
+        except IntegrityError:
+            # Another process initialised it first
+            db.rollback()
+            until = _watermark(db, granularity)
+
+    step = BUCKET_SIZES[granularity]
+    compacted = 0
+    while until < target:
+        # Jump over empty stretches straight to the next bucket with data
+        first = db.scalar(first_stmt(until))
+        start = target if first is None else min(max(until, floor_bucket(first, granularity)), target)
+        end = min(start + step, target)
+        # Advancing the watermark first locks the state row; a compactor in
+        # another process that lost the race sees no row to update and stops.
+        claimed = db.execute(
+            update(RollupState)
+            .where(RollupState.granularity == granularity, RollupState.compacted_until == until)
+            .values(compacted_until=end)
+        ).rowcount
+        if not claimed:
+            db.rollback()
+            break
+        if start < end:
+            build(db, start, end)
+            compacted += 1
+        db.commit()
+        until = end
+    return compacted
+
+def _watermark(db: Session, granularity: str) -> Optional[datetime]:
+    until = db.scalar(select(RollupState.compacted_until).where(RollupState.granularity == granularity))
+    return as_utc(until) if until is not None else None
+
+def _first_activity_stmt(after: Optional[datetime]):
+    stmt = select(func.min(ActivityLog.timestamp))
+    return stmt.where(ActivityLog.timestamp >= after) if after is not None else stmt
+
+def _first_hour_rollup_stmt(after: Optional[datetime]):
+    stmt = select(func.min(Rollup.bucket_start)).where(Rollup.granularity == HOUR)
+    return stmt.where(Rollup.bucket_start >= after) if after is not None else stmt
+
+def _build_hour(db: Session, start: datetime, end: datetime):
+    rows = db.execute(
+        select(ActivityLog.user_id, ActivityLog.action, func.count(ActivityLog.id))
+        .where(ActivityLog.timestamp >= start, ActivityLog.timestamp < end)
+        .group_by(ActivityLog.user_id, ActivityLog.action)
+    ).all()
+    totals = Counter()
+    records = []
+    for user_id, action, count in rows:
+        action = action or ""
+        totals[action] += count
+        if user_id is not None:
+            records.append(_record(HOUR, user_id, start, action, count))
+    records.extend(_record(HOUR, ALL_USERS, start, action, count) for action, count in totals.items())
+    _replace_bucket(db, HOUR, start, end, records)
+
+def _build_day(db: Session, start: datetime, end: datetime):
+    # The hour rollups already include the ALL_USERS rows
+    rows = db.execute(
+        select(Rollup.user_id, Rollup.action, func.sum(Rollup.count))
+        .where(Rollup.granularity == HOUR, Rollup.bucket_start >= start, Rollup.bucket_start < end)
+        .group_by(Rollup.user_id, Rollup.action)
+    ).all()
+    _replace_bucket(db, DAY, start, end, [
+        _record(DAY, user_id, start, action, int(count)) for user_id, action, count in rows
+    ])
+
+def _replace_bucket(db: Session, granularity: str, start: datetime, end: datetime, records: List[Dict]):
+    db.execute(delete(Rollup).where(
+        Rollup.granularity == granularity, Rollup.bucket_start >= start, Rollup.bucket_start < end
+    ))
+    if records:
+        db.execute(insert(Rollup), records)
+
+def _record(granularity: str, user_id: int, bucket_start: datetime, action: str, count: int) -> Dict:
+    return {
+        "granularity": granularity,
+        "user_id": user_id,
+        "bucket_start": bucket_start,
+        "action": action,
+        "count": count,
+    }
+
+# Compacts every ACTIVITY_ROLLUP_INTERVAL seconds, first right after startup; started by app.main
+compactor = PeriodicTask("activity-rollup-compactor", compact, settings.activity_rollup_interval, initial_delay=0)
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import models, database, auth, activity
-from ..schemas import ActivityLog
-from typing import List, Optional
+from .. import models, database, auth, activity, pagination, export
+from ..responses import FastJSONResponse
+from ..schemas import ActivityLog, Principal
+from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta, UTC
-from pydantic import BaseModel
-from app.database import get_db
+from pydantic import BaseModel, Field
+from app.database import get_db, get_async_db
 
 router = APIRouter(prefix="/activity", tags=["activity"])
 
@@ -17,110 +19,164 @@ class ActivityLogRequest(BaseModel):
 @router.post("/log")
 def log_activity(
     activity_data: ActivityLogRequest,
+    request: Request,
+    wait: bool = Query(False, description="Write synchronously and return the stored activity"),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    current_user: Principal = Depends(auth.get_current_user)
 ):
     """Log a new activity"""
     # Verify the user is logging their own activity or is admin
-    if current_user.role != "admin" and current_user.id != activity_data.user_id:
+    if not activity.can_log_for(current_user, activity_data.user_id):
         raise HTTPException(status_code=403, detail="Can only log your own activities")
     
-    return activity.log_activity(
+    logged = activity.log_activity(
         db=db,
         user_id=activity_data.user_id,
         action=activity_data.action,
-        details=activity_data.details
+        details=activity_data.details,
+        wait=wait,
+        ip=request.client.host if request.client else None
+    )
+    if logged is None:
+        return {"status": "queued"}
+    return logged
+
+class ActivityLogBatchRequest(BaseModel):
+    # Items are validated one by one so a bad event does not reject the batch
+    events: List[Dict[str, Any]] = Field(..., min_length=1, max_length=activity.MAX_BATCH_EVENTS)
+
+@router.post("/log/batch")
+def log_activity_batch(
+    batch: ActivityLogBatchRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    """Log many activities in one request, with a status per event"""
+    return activity.log_activity_batch(
+        db, current_user, batch.events, ip=request.client.host if request.client else None
     )
 
 @router.get("/user/{user_id}", response_model=List[ActivityLog])
-def get_user_activities(
+async def get_user_activities(
     user_id: int,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user_async)
 ):
     """Get activities for a specific user"""
     # Verify the user is requesting their own activities or is admin
     if current_user.role != "admin" and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Can only view your own activities")
     
-    return activity.get_user_activities(db, user_id, limit)
+    activities = await activity.get_user_activities_async(db, user_id, limit, cursor)
+    pagination.set_next_cursor(response, activities, limit, pagination.activity_cursor)
+    return activities
 
 @router.get("/all", response_model=List[ActivityLog])
-def get_all_activities(
+async def get_all_activities(
+    response: Response,
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user_async)
 ):
     """Get all activities (admin only)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    return activity.get_all_activities(db, limit)
+    activities = await activity.get_all_activities_async(db, limit, cursor)
+    pagination.set_next_cursor(response, activities, limit, pagination.activity_cursor)
+    return activities
 
-@router.get("/suspicious")
-def get_suspicious_activities(
+@router.get("/suspicious", response_class=FastJSONResponse)
+async def get_suspicious_activities(
     limit: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user_async)
 ):
     """Get suspicious activities (admin only)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    return activity.get_suspicious_activities(db, limit)
+    return FastJSONResponse(await activity.get_suspicious_activities_async(db, limit))
 
 @router.get("/time-range")
 def get_activities_by_time_range(
     start_date: str,
     end_date: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    fmt: str = Query("json", alias="format", pattern=export.FORMAT_PATTERN),
+    gzip: bool = Query(False, description="gzip-compress the response"),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    """Get activities within a time range"""
+    """Get activities within a time range, newest first (streamed)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    try:
-        start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        return activity.get_activities_by_time_range(db, start, end)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format")
+    start = export.parse_datetime(start_date)
+    end = export.parse_datetime(end_date)
+    return export.activity_export_response(start, end, fmt, gzip, newest_first=True)
+
+@router.get("/export")
+def export_activities(
+    start_date: str,
+    end_date: str,
+    user_id: Optional[int] = None,
+    fmt: str = Query("ndjson", alias="format", pattern=export.FORMAT_PATTERN),
+    gzip: bool = Query(False, description="gzip-compress the response"),
+    current_user: Principal = Depends(auth.get_current_user)
+):
+    """Stream activities within a time range as JSON, NDJSON or CSV, oldest first"""
+    # Users can export their own activities, admins anyone's
+    if current_user.role != "admin":
+        if user_id is not None and user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Can only export your own activities")
+        user_id = current_user.id
+    
+    start = export.parse_datetime(start_date)
+    end = export.parse_datetime(end_date)
+    return export.activity_export_response(start, end, fmt, gzip, user_id, filename="activities")
 
-@router.get("/by-action")
-def get_activities_by_action(
+@router.get("/by-action", response_class=FastJSONResponse)
+async def get_activities_by_action(
     action: str,
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user_async)
 ):
     """Get activities filtered by action type"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    return activity.get_activities_by_action(db, action, limit)
+    activities = await activity.get_activities_by_action_async(db, action, limit, cursor)
+    response = FastJSONResponse(activities)
+    pagination.set_next_cursor(response, activities, limit, pagination.activity_dict_cursor)
+    return response
 
 @router.get("/recent")
 def get_recent_activities(
     hours: int = Query(24, ge=1, le=168),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    fmt: str = Query("json", alias="format", pattern=export.FORMAT_PATTERN),
+    gzip: bool = Query(False, description="gzip-compress the response"),
+    current_user: Principal = Depends(auth.get_current_user)
 ):
-    """Get recent activities"""
+    """Get recent activities, newest first (streamed)"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(hours=hours)
     
-    return activity.get_activities_by_time_range(db, start_date, end_date)
+    return export.activity_export_response(start_date, end_date, fmt, gzip, newest_first=True)
 
 @router.get("/summary")
-def get_activity_summary(
+async def get_activity_summary(
     days: int = Query(7, ge=1, le=365),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(auth.get_current_user_async)
 ):
     """Get activity summary statistics"""
     if current_user.role != "admin":
@@ -129,21 +185,12 @@ def get_activity_summary(
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    
-    # Group by action type
-    action_counts = {}
-    for act in activities:
-        action_counts[act.action] = action_counts.get(act.action, 0) + 1
-    
-    # Group by day
-    daily_counts = {}
-    for act in activities:
-        date_str = act.timestamp.date().isoformat()
-        daily_counts[date_str] = daily_counts.get(date_str, 0) + 1
+    # Group by action type and by day
+    action_counts = await activity.count_activities_by_action_async(db, start_date, end_date)
+    daily_counts = await activity.count_activities_by_day_async(db, start_date, end_date)
     
     return {
-        "total_activities": len(activities),
+        "total_activities": sum(action_counts.values()),
         "period_days": days,
         "action_breakdown": action_counts,
         "daily_breakdown": daily_counts
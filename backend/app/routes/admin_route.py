@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import models, database, auth, admin, activity
-from ..schemas import UserOut, ActivityLog
+from .. import models, database, auth, admin, activity, anomaly, pagination, export, rules, loop_lag, ws_ingest, live_analytics
+from ..schemas import UserOut, ActivityLog, Principal
 from typing import List, Optional
 from datetime import datetime, timedelta, UTC
-from app.database import get_db
+from app.database import get_db, get_async_db
+from ..hashing import hasher
+from ..staff import department_stats_cache
+from ..models import extract_domain
+from ..websocket import manager
+from ..responses import FastJSONResponse
 import re
 from pydantic import BaseModel
 
@@ -16,48 +22,56 @@ class StaffCreate(BaseModel):
     password: str
     department: str
 
-def extract_domain(email: str) -> str:
-    """Extract domain from email address."""
-    return email.split('@')[-1].lower()
+def get_current_admin(current_user: Principal = Depends(auth.get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
 
-def get_current_admin(current_user: models.User = Depends(auth.get_current_user)):
+def _organisation_domain(principal: Principal) -> str:
+    # Falls back to the email for rows not yet backfilled by migration 0002
+    return principal.organisation_domain or extract_domain(principal.email)
+
+async def get_current_admin_async(current_user: Principal = Depends(auth.get_current_user_async)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
 @router.get("/dashboard/stats")
-def get_dashboard_statistics(
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+async def get_dashboard_statistics(
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get admin dashboard statistics"""
-    return admin.get_system_statistics(db)
+    return await admin.get_system_statistics_async(db)
 
 @router.get("/users", response_model=List[UserOut])
 def get_all_users(
-    skip: int = Query(0, ge=0),
+    response: Response,
+    skip: int = Query(0, ge=0, description="Deprecated, use cursor"),
     limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """Get all users in the admin's organisation (by email domain) with pagination"""
-    admin_domain = extract_domain(current_admin.email)
-    all_users = admin.get_all_users(db, skip=skip, limit=limit)
-    filtered_users = [user for user in all_users if extract_domain(user.email) == admin_domain]
-    return filtered_users
+    users = admin.get_all_users(
+        db, skip=skip, limit=limit, cursor=cursor,
+        organisation_domain=_organisation_domain(current_admin)
+    )
+    pagination.set_next_cursor(response, users, limit, pagination.user_cursor)
+    return users
 
 @router.get("/users/{user_id}", response_model=UserOut)
 def get_user_by_id(
     user_id: int,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """Get specific user by ID (only if in admin's organisation)"""
     user = admin.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    admin_domain = extract_domain(current_admin.email)
-    if extract_domain(user.email) != admin_domain:
+    if user.organisation_domain != _organisation_domain(current_admin):
         raise HTTPException(status_code=403, detail="Access denied")
     return user
 
@@ -66,14 +80,13 @@ def update_user_status(
     user_id: int,
     is_active: bool,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """Activate or deactivate a user in admin organisation"""
     user = admin.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    admin_domain = extract_domain(current_admin.email)
-    if extract_domain(user.email) != admin_domain:
+    if user.organisation_domain != _organisation_domain(current_admin):
         raise HTTPException(status_code=403, detail="Access denied")
     return admin.update_user_status(db, user_id, is_active)
 
@@ -81,102 +94,158 @@ def update_user_status(
 def delete_user(
     user_id: int,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """Delete a user (soft delete)"""
+    user = admin.get_user_by_id(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if user.organisation_domain != _organisation_domain(current_admin):
+        raise HTTPException(status_code=403, detail="Access denied")
     return admin.delete_user(db, user_id)
 
-@router.get("/security/alerts")
-def get_security_alerts(
+@router.get("/security/alerts", response_class=FastJSONResponse)
+async def get_security_alerts(
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get security alerts and suspicious activities"""
-    return admin.get_security_alerts(db, limit)
+    return FastJSONResponse(await admin.get_security_alerts_async(db, limit))
+
+@router.get("/security/rules")
+def get_security_rules(current_admin: Principal = Depends(get_current_admin)):
+    """Classification rules currently applied to new activities (managed with `python -m app.rules`)"""
+    return {
+        "loaded_at": rules.registry.loaded_at,
+        "rules": [
+            {"action": action, "category": rule.category, "severity": rule.severity}
+            for action, rule in sorted(rules.registry.rules().items())
+        ],
+    }
 
 @router.get("/users/{user_id}/activity")
-def get_user_activity_summary(
+async def get_user_activity_summary(
     user_id: int,
     days: int = Query(7, ge=1, le=365),
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get activity summary for a specific user (only if in admin's organisation)"""
-    user = admin.get_user_by_id(db, user_id)
+    user = await admin.get_user_by_id_async(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    admin_domain = extract_domain(current_admin.email)
-    if extract_domain(user.email) != admin_domain:
+    if user.organisation_domain != _organisation_domain(current_admin):
         raise HTTPException(status_code=403, detail="Access denied")
-    return admin.get_user_activity_summary(db, user_id, days)
+    return await admin.get_user_activity_summary_async(db, user_id, days)
 
 @router.post("/staff/create")
 def create_staff_user(
     staff: StaffCreate,
     db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    current_admin: Principal = Depends(get_current_admin)
 ):
     """Create a new staff user (must match admin's email domain)"""
-    admin_domain = extract_domain(current_admin.email)
-    user_domain = extract_domain(staff.email)
-    if user_domain != admin_domain:
+    if extract_domain(staff.email) != _organisation_domain(current_admin):
         raise HTTPException(status_code=400, detail="Email domain must match admin's organisation domain")
     return admin.create_staff_user(db, staff.username, staff.email, staff.password, staff.department)
 
 @router.get("/analytics/activities")
-def get_activity_analytics(
+async def get_activity_analytics(
     days: int = Query(30, ge=1, le=365),
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get activity analytics for admin dashboard"""
-    return admin.get_activity_analytics(db, days)
+    return await admin.get_activity_analytics_async(db, days)
 
 @router.get("/activities", response_model=List[ActivityLog])
-def get_all_activities(
+async def get_all_activities(
+    response: Response,
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get all activity logs"""
-    return activity.get_all_activities(db, limit)
+    activities = await activity.get_all_activities_async(db, limit, cursor)
+    pagination.set_next_cursor(response, activities, limit, pagination.activity_cursor)
+    return activities
 
-@router.get("/activities/suspicious")
-def get_suspicious_activities(
+@router.get("/activities/suspicious", response_class=FastJSONResponse)
+async def get_suspicious_activities(
     limit: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get suspicious activities"""
-    return activity.get_suspicious_activities(db, limit)
+    return FastJSONResponse(await activity.get_suspicious_activities_async(db, limit))
 
 @router.get("/activities/time-range")
 def get_activities_by_time_range(
     start_date: str,
     end_date: str,
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+    fmt: str = Query("json", alias="format", pattern=export.FORMAT_PATTERN),
+    gzip: bool = Query(False, description="gzip-compress the response"),
+    current_admin: Principal = Depends(get_current_admin)
 ):
-    """Get activities within a time range"""
-    try:
-        start = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        end = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        return activity.get_activities_by_time_range(db, start, end)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format")
+    """Get activities within a time range, newest first (streamed)"""
+    start = export.parse_datetime(start_date)
+    end = export.parse_datetime(end_date)
+    return export.activity_export_response(start, end, fmt, gzip, newest_first=True)
+
+@router.get("/system/pool")
+def get_pool_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get database connection pool metrics"""
+    return database.get_pool_metrics()
+
+@router.get("/system/cache")
+def get_cache_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get hit/miss counters of the in-process caches"""
+    return {
+        "principals": auth.principal_cache.stats(),
+        "department_stats": department_stats_cache.stats(),
+    }
+
+@router.get("/system/hashing")
+def get_hashing_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get password hashing pool counters"""
+    return hasher.stats()
+
+@router.get("/system/websocket")
+def get_websocket_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get WebSocket connection, fan-out, ingest and live analytics counters"""
+    return {
+        **manager.connection_stats(),
+        "ingest": {**ws_ingest.pipeline.stats, "queued": ws_ingest.pipeline.queued()},
+        "analytics": {
+            **live_analytics.analytics.stats,
+            "tenants": live_analytics.analytics.tenant_count(),
+            "pending": live_analytics.analytics.pending(),
+        },
+    }
+
+@router.get("/system/event-loop")
+def get_event_loop_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get how late this worker's event loop runs scheduled callbacks"""
+    return loop_lag.monitor.snapshot()
+
+@router.get("/system/anomaly")
+def get_anomaly_metrics(current_admin: Principal = Depends(get_current_admin)):
+    """Get anomaly detector counters"""
+    return {**anomaly.detector.stats, "tracked_keys": anomaly.detector.tracked_keys()}
 
 @router.get("/system/status")
-def get_system_status(
-    db: Session = Depends(get_db),
-    current_admin: models.User = Depends(get_current_admin)
+async def get_system_status(
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: Principal = Depends(get_current_admin_async)
 ):
     """Get system status and health"""
-    stats = admin.get_system_statistics(db)
+    stats = await admin.get_system_statistics_async(db)
     return {
         "status": "healthy",
         "timestamp": datetime.now(UTC).isoformat(),
         "statistics": stats,
-        "active_connections": 0,  # This would be implemented with WebSocket tracking
+        "active_connections": manager.connection_count(),
         "system_uptime": "24 hours"  # This would be calculated from actual uptime
     } 
\ No newline at end of file
@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .. import models, database, auth, staff, activity
-from ..schemas import UserOut, ActivityLog
+from .. import models, database, auth, staff, activity, pagination
+from ..schemas import UserOut, ActivityLog, Principal, Colleagues, StaffProfile
+from ..responses import FastJSONResponse
 from typing import List, Optional
 from datetime import datetime, timedelta, UTC
-from app.database import get_db
+from app.database import get_db, get_async_db
 router = APIRouter(prefix="/staff", tags=["staff"])
 
-def get_current_staff(current_user: models.User = Depends(auth.get_current_user)):
+def get_current_staff(current_user: Principal = Depends(auth.get_current_user)):
     if current_user.role != "staff":
         raise HTTPException(status_code=403, detail="Staff access required")
     return current_user
 
-@router.get("/profile")
+async def get_current_staff_async(current_user: Principal = Depends(auth.get_current_user_async)):
+    if current_user.role != "staff":
+        raise HTTPException(status_code=403, detail="Staff access required")
+    return current_user
+
+@router.get("/profile", response_model=StaffProfile)
 def get_staff_profile(
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Get current staff member's profile"""
     staff_record = staff.get_staff_by_user_id(db, current_staff.id)
@@ -31,7 +38,7 @@ def get_staff_profile(
 def update_department(
     new_department: str,
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Update staff department"""
     return staff.update_staff_department(db, current_staff.id, new_department)
@@ -39,54 +46,53 @@ def update_department(
 @router.get("/department/stats")
 def get_department_statistics(
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Get statistics for staff's department"""
     staff_record = staff.get_staff_by_user_id(db, current_staff.id)
     if not staff_record:
         raise HTTPException(status_code=404, detail="Staff record not found")
     
-    dept_stats = staff.get_department_statistics(db)
     return {
         "department": staff_record.department,
-        "statistics": dept_stats.get(staff_record.department, {})
+        "statistics": staff.get_department_statistics_for(db, staff_record.department)
     }
 
 @router.get("/activity/summary")
-def get_staff_activity_summary(
+async def get_staff_activity_summary(
     days: int = Query(7, ge=1, le=365),
-    db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    db: AsyncSession = Depends(get_async_db),
+    current_staff: Principal = Depends(get_current_staff_async)
 ):
     """Get activity summary for current staff member"""
-    return staff.get_staff_activity_summary(db, current_staff.id, days)
+    return await staff.get_staff_activity_summary_async(db, current_staff.id, days)
 
-@router.get("/department/activities")
+@router.get("/department/activities", response_class=FastJSONResponse)
 def get_department_activities(
     days: int = Query(7, ge=1, le=365),
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Get activities from staff in the same department"""
     staff_record = staff.get_staff_by_user_id(db, current_staff.id)
     if not staff_record:
         raise HTTPException(status_code=404, detail="Staff record not found")
     
-    return staff.get_department_activities(db, staff_record.department, days)
+    return FastJSONResponse(staff.get_department_activities(db, staff_record.department, days))
 
 @router.get("/performance/metrics")
-def get_performance_metrics(
+async def get_performance_metrics(
     days: int = Query(30, ge=1, le=365),
-    db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    db: AsyncSession = Depends(get_async_db),
+    current_staff: Principal = Depends(get_current_staff_async)
 ):
     """Get performance metrics for current staff member"""
-    return staff.get_staff_performance_metrics(db, current_staff.id, days)
+    return await staff.get_staff_performance_metrics_async(db, current_staff.id, days)
 
-@router.get("/colleagues")
+@router.get("/colleagues", response_model=Colleagues)
 def get_department_colleagues(
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Get all staff members in the same department"""
     staff_record = staff.get_staff_by_user_id(db, current_staff.id)
@@ -100,29 +106,34 @@ def get_department_colleagues(
     }
 
 @router.get("/activities", response_model=List[ActivityLog])
-def get_staff_activities(
+async def get_staff_activities(
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
-    db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor value of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_staff: Principal = Depends(get_current_staff_async)
 ):
     """Get current staff member's activities"""
-    return activity.get_user_activities(db, current_staff.id, limit)
+    activities = await activity.get_user_activities_async(db, current_staff.id, limit, cursor)
+    pagination.set_next_cursor(response, activities, limit, pagination.activity_cursor)
+    return activities
 
-@router.get("/activities/recent")
+@router.get("/activities/recent", response_class=FastJSONResponse)
 def get_recent_activities(
     hours: int = Query(24, ge=1, le=168),
     db: Session = Depends(get_db),
-    current_staff: models.User = Depends(get_current_staff)
+    current_staff: Principal = Depends(get_current_staff)
 ):
     """Get recent activities for current staff member"""
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(hours=hours)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    staff_activities = [a for a in activities if a.user_id == current_staff.id]
+    staff_activities = activity.get_user_activities_by_time_range(
+        db, current_staff.id, start_date, end_date
+    )
     
-    return {
+    return FastJSONResponse({
         "staff_id": current_staff.id,
         "period_hours": hours,
         "activities": staff_activities
-    } 
\ No newline at end of file
+    }) 
\ No newline at end of file
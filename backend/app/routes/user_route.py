@@ -1,16 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..routes.admin_route import extract_domain
 from .. import models, database, auth, schemas
 from fastapi.security import OAuth2PasswordRequestForm
-from app.database import get_db
+from app.database import get_db, get_async_db
 
 router = APIRouter()
 
 @router.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await auth.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password", headers={"WWW-Authenticate": "Bearer"})
     access_token = auth.create_access_token(data={"sub": user.email})
@@ -27,18 +29,9 @@ def register_user(user: models.UserCreate, db: Session = Depends(get_db)):
     if db_user:
         raise HTTPException(status_code=400, detail="Username or email already registered")
     # --- Prevent duplicate admin organisation domains ---
-    if user.role == "admin":
-        new_admin_domain = extract_domain(user.email)
-        # Find any admin with the same domain
-        existing_admins = db.query(models.User).filter(
-            (models.User.role == "admin")
-        ).all()
-        for admin_user in existing_admins:
-            if extract_domain(admin_user.email) == new_admin_domain:
-                raise HTTPException(
-                    status_code=400,
-                    detail="An admin for this organisation domain already exists. contact yur admin to add you as a staff"
-                )
+    new_admin_domain = models.extract_domain(user.email)
+    if user.role == "admin" and _admin_domain_taken(db, new_admin_domain):
+        raise HTTPException(status_code=400, detail=DUPLICATE_ADMIN_DOMAIN)
     hashed_password = auth.get_password_hash(user.password)
     new_user = models.User(
         username=user.username,
@@ -47,14 +40,25 @@ def register_user(user: models.UserCreate, db: Session = Depends(get_db)):
         role=user.role
     )
     db.add(new_user)
-    db.commit()
+    if user.role == "admin":
+        db.flush()
+        db.add(models.Admin(
+            user_id=new_user.id,
+            privileges="full_access",
+            organisation_domain=new_admin_domain
+        ))
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent registration won the unique index on admins.organisation_domain
+        db.rollback()
+        raise HTTPException(status_code=400, detail=DUPLICATE_ADMIN_DOMAIN)
     db.refresh(new_user)
 
-    if user.role == "admin":
-        admin_exists = db.query(models.Admin).filter(models.Admin.user_id == new_user.id).first()
-        if not admin_exists:
-            new_admin = models.Admin(user_id=new_user.id, privileges="full_access")
-            db.add(new_admin)
-            db.commit()
+    return new_user
+
+DUPLICATE_ADMIN_DOMAIN = "An admin for this organisation domain already exists. contact yur admin to add you as a staff"
 
-    return new_user
\ No newline at end of file
+def _admin_domain_taken(db: Session, organisation_domain: str) -> bool:
+    stmt = select(models.Admin.id).where(models.Admin.organisation_domain == organisation_domain).limit(1)
+    return db.scalar(stmt) is not None
\ No newline at end of file
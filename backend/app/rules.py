@@ -0,0 +1,220 @@
+"""
+Activity classification rules.
+
+Every activity is classified when it is written: if its action matches a
+rule, the row is stored with suspicious = 1 and the rule's category and
+severity. Alert queries (/admin/security/alerts, /activity/suspicious,
+/admin/activities/suspicious, the dashboard counter) then read the
+(suspicious, timestamp) index instead of scanning for a list of actions, and
+the WebSocket security alerts use the same rules.
+
+The rules live in the activity_rules table, seeded with DEFAULT_RULES. Each
+worker keeps them in `registry` and reloads them every
+ACTIVITY_RULES_RELOAD_INTERVAL seconds, so rule changes take effect without
+a redeploy:
+
+    python -m app.rules list
+    python -m app.rules set unusual_export --category data --severity 2
+    python -m app.rules delete unusual_export
+    python -m app.rules reclassify --days 30
+
+Classification is fixed at write time. A rule change only applies to new
+events unless existing ones are re-tagged with `reclassify` (or `set
+--reclassify-days`), which also rebuilds the dashboard counters.
+"""
+import argparse
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import settings
+from .database import engine, SessionLocal
+from .periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+LOW = 1
+MEDIUM = 2
+HIGH = 3
+
+class Rule(NamedTuple):
+    category: str
+    severity: int
+
+DEFAULT_RULES: Dict[str, Rule] = {
+    "failed_login": Rule("authentication", LOW),
+    "multiple_failed_logins": Rule("authentication", HIGH),
+    "file_access_denied": Rule("access", LOW),
+    "suspicious_file_access": Rule("access", MEDIUM),
+    "unauthorized_access": Rule("access", HIGH),
+    "unauthorized_access_attempt": Rule("access", HIGH),
+    "admin_action_attempted": Rule("privilege", HIGH),
+    "suspicious_activity": Rule("other", MEDIUM),
+    # Derived by app.anomaly
+    "activity_rate_anomaly": Rule("behaviour", MEDIUM),
+}
+
+class RuleRegistry:
+    """
+    In-process copy of the enabled rules, keyed by action
+    """
+    def __init__(self, rules: Dict[str, Rule]):
+        self._rules = dict(rules)
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[datetime] = None
+
+    def rules(self) -> Dict[str, Rule]:
+        return self._rules
+
+    def classify(self, action: Optional[str]) -> Optional[Rule]:
+        return self._rules.get(action)
+
+    def is_suspicious(self, action: Optional[str]) -> bool:
+        return action in self._rules
+
+    def fields(self, action: Optional[str]) -> Dict:
+        """
+        Classification columns of an activity_logs row for `action`
+        """
+        rule = self._rules.get(action)
+        if rule is None:
+            return {"suspicious": False, "severity": None, "category": None}
+        return {"suspicious": True, "severity": rule.severity, "category": rule.category}
+
+    def load(self, db: Session):
+        rows = db.execute(select(
+            models.ActivityRule.action, models.ActivityRule.category, models.ActivityRule.severity
+        ).where(models.ActivityRule.enabled == True)).all()
+        # Swap the whole dict so readers never see a partial rule set
+        with self._lock:
+            self._rules = {action: Rule(category, severity) for action, category, severity in rows}
+            self.loaded_at = datetime.now(UTC)
+
+    def reload(self, session_factory=SessionLocal):
+        db = session_factory()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+registry = RuleRegistry(DEFAULT_RULES)
+
+def ensure_rules(session_factory=SessionLocal) -> bool:
+    """
+    Seed activity_rules with DEFAULT_RULES when it is empty, then load the
+    registry. Returns True when the defaults were inserted.
+    """
+    db = session_factory()
+    try:
+        seeded = False
+        if db.scalar(select(models.ActivityRule.action).limit(1)) is None:
+            db.add_all(
+                models.ActivityRule(action=action, category=rule.category, severity=rule.severity, enabled=True)
+                for action, rule in DEFAULT_RULES.items()
+            )
+            db.commit()
+            seeded = True
+        registry.load(db)
+        return seeded
+    finally:
+        db.close()
+
+def reclassify(
+    conn: Connection,
+    rules: Dict[str, Rule],
+    actions: Optional[Iterable[str]] = None,
+    since: Optional[datetime] = None
+) -> int:
+    """
+    Re-tag existing activity_logs rows with `rules`: rows of `actions` (all
+    actions when None) written at or after `since` (all time when None).
+    Each UPDATE reads the (action, timestamp) index. Returns the rows changed.
+    """
+    ActivityLog = models.ActivityLog
+    window = [ActivityLog.timestamp >= since] if since is not None else []
+    changed = 0
+    if actions is None:
+        # Clear everything flagged, then flag the current rules' actions
+        changed += conn.execute(
+            update(ActivityLog).where(ActivityLog.suspicious == True, *window)
+            .values(suspicious=False, severity=None, category=None)
+        ).rowcount
+        actions = rules.keys()
+    for action in actions:
+        rule = rules.get(action)
+        values = (
+            {"suspicious": True, "severity": rule.severity, "category": rule.category}
+            if rule is not None else {"suspicious": False, "severity": None, "category": None}
+        )
+        changed += conn.execute(
+            update(ActivityLog).where(ActivityLog.action == action, *window).values(**values)
+        ).rowcount
+    return changed
+
+# Reloads the rules every ACTIVITY_RULES_RELOAD_INTERVAL seconds; started by app.main
+reloader = PeriodicTask("activity-rule-reloader", registry.reload, settings.activity_rules_reload_interval)
+
+def _reclassify(actions: Optional[Iterable[str]], days: Optional[int]) -> int:
+    from . import counters
+
+    registry.reload()
+    since = datetime.now(UTC) - timedelta(days=days) if days else None
+    with engine.begin() as conn:
+        changed = reclassify(conn, registry.rules(), actions, since)
+    # The suspicious total is derived from the flags
+    counters.reconcile(SessionLocal)
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(description="Activity classification rules")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list")
+    set_parser = commands.add_parser("set", help="add or update a rule")
+    set_parser.add_argument("action")
+    set_parser.add_argument("--category", required=True)
+    set_parser.add_argument("--severity", type=int, choices=[LOW, MEDIUM, HIGH], required=True)
+    set_parser.add_argument("--disabled", action="store_true")
+    set_parser.add_argument("--reclassify-days", type=int, help="also re-tag this action's events of the last N days")
+    delete_parser = commands.add_parser("delete")
+    delete_parser.add_argument("action")
+    delete_parser.add_argument("--reclassify-days", type=int)
+    reclassify_parser = commands.add_parser("reclassify", help="re-tag existing events with the current rules")
+    reclassify_parser.add_argument("--days", type=int, help="only events of the last N days")
+    args = parser.parse_args()
+
+    if args.command in ("set", "delete"):
+        with SessionLocal() as db:
+            rule = db.get(models.ActivityRule, args.action)
+            if args.command == "delete":
+                if rule is not None:
+                    db.delete(rule)
+            else:
+                if rule is None:
+                    rule = models.ActivityRule(action=args.action)
+                    db.add(rule)
+                rule.category = args.category
+                rule.severity = args.severity
+                rule.enabled = not args.disabled
+                rule.updated_at = datetime.now(UTC)
+            db.commit()
+        if args.reclassify_days:
+            print(f"Reclassified {_reclassify([args.action], args.reclassify_days)} activities")
+    elif args.command == "reclassify":
+        print(f"Reclassified {_reclassify(None, args.days)} activities")
+
+    with SessionLocal() as db:
+        rules = db.scalars(select(models.ActivityRule).order_by(models.ActivityRule.action)).all()
+        print(json.dumps([
+            {"action": rule.action, "category": rule.category, "severity": rule.severity, "enabled": rule.enabled}
+            for rule in rules
+        ], indent=2))
+
+if __name__ == "__main__":
+    main()
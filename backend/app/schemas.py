@@ -1,19 +1,24 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional, List
 import datetime
 
 class ActivityLogBase(BaseModel):
-    action: str
-    details: Optional[str] = None
+    # Bounded like the String(255) columns, so an oversized event is
+    # rejected on its own instead of failing a shared multi-row INSERT
+    action: str = Field(min_length=1, max_length=255)
+    details: Optional[str] = Field(None, max_length=255)
 
 class ActivityLogCreate(ActivityLogBase):
     pass
 
+class ActivityLogEvent(ActivityLogBase):
+    """One event of a batch ingest request"""
+    user_id: int
+
 class ActivityLog(ActivityLogBase):
     id: int
     timestamp: datetime.datetime
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserBase(BaseModel):
     username: str
@@ -29,17 +34,26 @@ class UserOut(BaseModel):
     role: str
     is_active: bool
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class Principal(BaseModel):
+    """Authenticated user as returned (and cached) by auth.get_current_user"""
+    id: int
+    username: str
+    email: str
+    role: str
+    is_active: bool
+    organisation_domain: Optional[str] = None
+    created_at: Optional[datetime.datetime] = None
+
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 class User(UserBase):
     id: int
     is_active: bool
     role: str
     created_at: datetime.datetime
-    activity_logs: List[ActivityLog] = []
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class StaffBase(BaseModel):
     department: Optional[str] = None
@@ -50,8 +64,18 @@ class StaffCreate(StaffBase):
 class Staff(StaffBase):
     id: int
     user_id: int
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class Colleague(Staff):
+    user: Optional[UserOut] = None
+
+class Colleagues(BaseModel):
+    department: Optional[str] = None
+    colleagues: List[Colleague]
+
+class StaffProfile(BaseModel):
+    user: Principal
+    staff_info: Staff
 
 class AdminBase(BaseModel):
     privileges: Optional[str] = None
@@ -62,5 +86,4 @@ class AdminCreate(AdminBase):
 class Admin(AdminBase):
     id: int
     user_id: int
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -1,9 +1,24 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, contains_eager, joinedload
 from . import models, activity
+from .cache import TTLCache
+from .config import settings
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta, UTC
 from fastapi import HTTPException
 
+# Department head counts: None holds the map of all departments and
+# ("department", name) a single one. They change rarely but the staff
+# dashboard polls them.
+department_stats_cache = TTLCache(maxsize=1024, ttl=settings.department_stats_cache_ttl)
+
+def invalidate_department_stats():
+    """
+    Drop cached department statistics after staff or user status changes
+    """
+    department_stats_cache.clear()
+
 def get_staff_by_user_id(db: Session, user_id: int) -> Optional[models.Staff]:
     """
     Get staff record by user ID
@@ -14,13 +29,24 @@ def get_all_staff(db: Session, skip: int = 0, limit: int = 100) -> List[models.S
     """
     Get all staff members with their user information
     """
-    return db.query(models.Staff).join(models.User).offset(skip).limit(limit).all()
+    return (
+        db.query(models.Staff).join(models.Staff.user)
+        .options(contains_eager(models.Staff.user))
+        .offset(skip).limit(limit).all()
+    )
 
 def get_staff_by_department(db: Session, department: str) -> List[models.Staff]:
     """
-    Get all staff members in a specific department
+    Get all staff members in a specific department, with the public fields
+    of their user loaded in the same query
     """
-    return db.query(models.Staff).filter(models.Staff.department == department).all()
+    stmt = (
+        select(models.Staff)
+        .options(joinedload(models.Staff.user).load_only(*_COLLEAGUE_USER_COLUMNS))
+        .where(models.Staff.department == department)
+        .order_by(models.Staff.id)
+    )
+    return db.scalars(stmt).all()
 
 def update_staff_department(db: Session, user_id: int, new_department: str) -> models.Staff:
     """
@@ -34,38 +60,39 @@ def update_staff_department(db: Session, user_id: int, new_department: str) -> m
     staff.department = new_department
     db.commit()
     db.refresh(staff)
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="department_changed",
-        details=f"Department changed from {old_department} to {new_department}"
+        details=f"Department changed from {old_department} to {new_department}",
+        wait=False
     )
     
     return staff
 
 def get_department_statistics(db: Session) -> Dict:
     """
-    Get statistics by department
+    Get total and active staff counts for every department
     """
-    departments = db.query(models.Staff.department).distinct().all()
-    department_stats = {}
-    
-    for dept in departments:
-        dept_name = dept[0]
-        staff_count = db.query(models.Staff).filter(models.Staff.department == dept_name).count()
-        active_staff = db.query(models.Staff).join(models.User).filter(
-            models.Staff.department == dept_name,
-            models.User.is_active == True
-        ).count()
-        
-        department_stats[dept_name] = {
-            "total_staff": staff_count,
-            "active_staff": active_staff
-        }
-    
-    return department_stats
+    def load():
+        rows = db.execute(_department_stats_stmt()).all()
+        return {department: _department_stats_row(total, active) for department, total, active in rows}
+
+    return department_stats_cache.get_or_set(None, load)
+
+def get_department_statistics_for(db: Session, department: str) -> Dict:
+    """
+    Get total and active staff counts for a single department
+    """
+    def load():
+        stmt = _department_stats_stmt().where(models.Staff.department == department)
+        row = db.execute(stmt).first()
+        return _department_stats_row(row[1], row[2]) if row else _department_stats_row(0, 0)
+
+    return department_stats_cache.get_or_set(("department", department), load)
 
 def get_staff_activity_summary(db: Session, user_id: int, days: int = 7) -> Dict:
     """
@@ -79,44 +106,23 @@ def get_staff_activity_summary(db: Session, user_id: int, days: int = 7) -> Dict
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    staff_activities = [a for a in activities if a.user_id == user_id]
-    
     # Count activities by type
-    activity_counts = {}
-    for act in staff_activities:
-        activity_counts[act.action] = activity_counts.get(act.action, 0) + 1
+    activity_counts = activity.count_activities_by_action(db, start_date, end_date, user_id=user_id)
+    recent_activities = activity.get_user_activities_by_time_range(
+        db, user_id, start_date, end_date, limit=10
+    )
     
-    return {
-        "staff": {
-            "id": staff.id,
-            "user_id": staff.user_id,
-            "department": staff.department
-        },
-        "total_activities": len(staff_activities),
-        "activity_breakdown": activity_counts,
-        "recent_activities": staff_activities[:10]
-    }
+    return _staff_activity_summary(staff, activity_counts, recent_activities)
 
-def get_department_activities(db: Session, department: str, days: int = 7) -> List[models.ActivityLog]:
+def get_department_activities(db: Session, department: str, days: int = 7) -> List[Dict]:
     """
     Get all activities from staff in a specific department
     """
-    # Get all staff in the department
-    staff_members = get_staff_by_department(db, department)
-    staff_user_ids = [staff.user_id for staff in staff_members]
-    
-    if not staff_user_ids:
-        return []
-    
-    # Get activities for the last N days
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
-    
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    department_activities = [a for a in activities if a.user_id in staff_user_ids]
-    
-    return department_activities
+    # The department's users as a subquery, so this is a single statement
+    staff_user_ids = select(models.Staff.user_id).where(models.Staff.department == department)
+    return activity.get_users_activities_by_time_range(db, staff_user_ids, start_date, end_date)
 
 def create_staff_member(db: Session, username: str, email: str, password: str, department: str) -> models.Staff:
     """
@@ -158,7 +164,8 @@ def create_staff_member(db: Session, username: str, email: str, password: str, d
         db=db,
         user_id=user.id,
         action="staff_member_created",
-        details=f"Staff member created in department: {department}"
+        details=f"Staff member created in department: {department}",
+        wait=False
     )
     
     return staff_record
@@ -175,23 +182,60 @@ def get_staff_performance_metrics(db: Session, user_id: int, days: int = 30) ->
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    staff_activities = [a for a in activities if a.user_id == user_id]
+    # Calculate metrics in the database
+    buckets = activity.get_activity_buckets(db, start_date, end_date, user_id=user_id)
     
-    # Calculate metrics
-    total_activities = len(staff_activities)
-    successful_activities = len([a for a in staff_activities if "success" in a.action.lower() or "completed" in a.action.lower()])
-    failed_activities = len([a for a in staff_activities if "failed" in a.action.lower() or "error" in a.action.lower()])
+    # Group by day
+    daily_activities = activity.count_activities_by_day(db, start_date, end_date, user_id=user_id)
     
-    success_rate = (successful_activities / total_activities * 100) if total_activities > 0 else 0
+    return _staff_performance_metrics(staff, buckets, daily_activities, days)
+
+# Async variants, for use with an AsyncSession (see database.get_async_db)
+
+async def get_staff_by_user_id_async(db: AsyncSession, user_id: int) -> Optional[models.Staff]:
+    return (await db.scalars(select(models.Staff).where(models.Staff.user_id == user_id))).first()
+
+async def get_staff_activity_summary_async(db: AsyncSession, user_id: int, days: int = 7) -> Dict:
+    staff = await get_staff_by_user_id_async(db, user_id)
+    if not staff:
+        raise HTTPException(status_code=404, detail="Staff member not found")
     
-    # Group by day
-    daily_activities = {}
-    for act in staff_activities:
-        date_str = act.timestamp.date().isoformat()
-        if date_str not in daily_activities:
-            daily_activities[date_str] = 0
-        daily_activities[date_str] += 1
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(days=days)
+    activity_counts = await activity.count_activities_by_action_async(db, start_date, end_date, user_id=user_id)
+    recent_activities = await activity.get_user_activities_by_time_range_async(
+        db, user_id, start_date, end_date, limit=10
+    )
+    return _staff_activity_summary(staff, activity_counts, recent_activities)
+
+async def get_staff_performance_metrics_async(db: AsyncSession, user_id: int, days: int = 30) -> Dict:
+    staff = await get_staff_by_user_id_async(db, user_id)
+    if not staff:
+        raise HTTPException(status_code=404, detail="Staff member not found")
+    
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(days=days)
+    buckets = await activity.get_activity_buckets_async(db, start_date, end_date, user_id=user_id)
+    daily_activities = await activity.count_activities_by_day_async(db, start_date, end_date, user_id=user_id)
+    return _staff_performance_metrics(staff, buckets, daily_activities, days)
+
+def _staff_activity_summary(staff: models.Staff, activity_counts: Dict[str, int], recent_activities) -> Dict:
+    return {
+        "staff": {
+            "id": staff.id,
+            "user_id": staff.user_id,
+            "department": staff.department
+        },
+        "total_activities": sum(activity_counts.values()),
+        "activity_breakdown": activity_counts,
+        "recent_activities": recent_activities
+    }
+
+def _staff_performance_metrics(staff: models.Staff, buckets: Dict, daily_activities: Dict[str, int], days: int) -> Dict:
+    total_activities = buckets["total"]
+    successful_activities = buckets["successful"]
+    failed_activities = buckets["failed"]
+    success_rate = (successful_activities / total_activities * 100) if total_activities > 0 else 0
     
     return {
         "staff_id": staff.id,
@@ -203,3 +247,26 @@ def get_staff_performance_metrics(db: Session, user_id: int, days: int = 30) ->
         "daily_activities": daily_activities,
         "period_days": days
     }
+
+# Fields of a colleague's user shown by /staff/colleagues (see schemas.UserOut)
+_COLLEAGUE_USER_COLUMNS = (
+    models.User.id, models.User.username, models.User.email, models.User.role, models.User.is_active,
+)
+
+def _department_stats_stmt():
+    # One grouped pass over staff; the outer join keeps staff rows whose user is gone
+    return (
+        select(
+            models.Staff.department,
+            func.count(models.Staff.id),
+            func.sum(case((models.User.is_active == True, 1), else_=0)),
+        )
+        .outerjoin(models.User, models.User.id == models.Staff.user_id)
+        .group_by(models.Staff.department)
+    )
+
+def _department_stats_row(total, active) -> Dict:
+    return {
+        "total_staff": int(total or 0),
+        "active_staff": int(active or 0)
+    }
@@ -1,9 +1,12 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from . import models, activity
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta, UTC
 from fastapi import HTTPException
-from .auth import get_password_hash, verify_password
+from .auth import get_password_hash, verify_password, invalidate_principal
+from .staff import invalidate_department_stats
 
 def get_user_profile(db: Session, user_id: int) -> Optional[models.User]:
     """
@@ -41,13 +44,15 @@ def update_user_profile(db: Session, user_id: int, email: str = None, username:
     
     db.commit()
     db.refresh(user)
+    invalidate_principal(user_id)
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="profile_updated",
-        details="User profile information updated"
+        details="User profile information updated",
+        wait=False
     )
     
     return user
@@ -73,12 +78,13 @@ def change_user_password(db: Session, user_id: int, current_password: str, new_p
         db=db,
         user_id=user_id,
         action="password_changed",
-        details="User password changed"
+        details="User password changed",
+        wait=False
     )
     
     return True
 
-def get_user_activities(db: Session, user_id: int, limit: int = 50) -> List[models.ActivityLog]:
+def get_user_activities(db: Session, user_id: int, limit: int = 50) -> List[activity.ActivityRow]:
     """
     Get user's activity history
     """
@@ -96,45 +102,11 @@ def get_user_statistics(db: Session, user_id: int, days: int = 30) -> Dict:
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(days=days)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    user_activities = [a for a in activities if a.user_id == user_id]
+    # Calculate statistics in the database
+    buckets = activity.get_activity_buckets(db, start_date, end_date, user_id=user_id)
+    daily_activities = activity.count_activities_by_day(db, start_date, end_date, user_id=user_id)
     
-    # Calculate statistics
-    total_activities = len(user_activities)
-    login_activities = len([a for a in user_activities if "login" in a.action.lower()])
-    file_activities = len([a for a in user_activities if "file" in a.action.lower()])
-    system_activities = len([a for a in user_activities if "system" in a.action.lower()])
-    
-    # Group by day
-    daily_activities = {}
-    for act in user_activities:
-        date_str = act.timestamp.date().isoformat()
-        if date_str not in daily_activities:
-            daily_activities[date_str] = 0
-        daily_activities[date_str] += 1
-    
-    # Get most active day
-    most_active_day = max(daily_activities.items(), key=lambda x: x[1]) if daily_activities else None
-    
-    return {
-        "user": {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "role": user.role,
-            "is_active": user.is_active,
-            "created_at": user.created_at
-        },
-        "statistics": {
-            "total_activities": total_activities,
-            "login_activities": login_activities,
-            "file_activities": file_activities,
-            "system_activities": system_activities,
-            "most_active_day": most_active_day,
-            "period_days": days
-        },
-        "daily_activities": daily_activities
-    }
+    return _user_statistics(user, buckets, daily_activities, days)
 
 def deactivate_user_account(db: Session, user_id: int) -> bool:
     """
@@ -146,13 +118,16 @@ def deactivate_user_account(db: Session, user_id: int) -> bool:
     
     user.is_active = False
     db.commit()
+    invalidate_principal(user_id)
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="account_deactivated",
-        details="User account deactivated"
+        details="User account deactivated",
+        wait=False
     )
     
     return True
@@ -167,13 +142,16 @@ def reactivate_user_account(db: Session, user_id: int) -> bool:
     
     user.is_active = True
     db.commit()
+    invalidate_principal(user_id)
+    invalidate_department_stats()
     
     # Log the activity
     activity.log_activity(
         db=db,
         user_id=user_id,
         action="account_reactivated",
-        details="User account reactivated"
+        details="User account reactivated",
+        wait=False
     )
     
     return True
@@ -190,21 +168,9 @@ def get_user_session_info(db: Session, user_id: int) -> Dict:
     end_date = datetime.now(UTC)
     start_date = end_date - timedelta(hours=24)
     
-    activities = activity.get_activities_by_time_range(db, start_date, end_date)
-    recent_activities = [a for a in activities if a.user_id == user_id]
+    buckets = activity.get_activity_buckets(db, start_date, end_date, user_id=user_id)
     
-    # Get last login
-    login_activities = [a for a in recent_activities if "login" in a.action.lower()]
-    last_login = login_activities[-1].timestamp if login_activities else None
-    
-    return {
-        "user_id": user.id,
-        "username": user.username,
-        "is_active": user.is_active,
-        "last_login": last_login,
-        "recent_activities_count": len(recent_activities),
-        "session_duration": "24 hours"  # This could be calculated based on actual session data
-    }
+    return _session_info(user, buckets)
 
 def search_users(db: Session, query: str, limit: int = 20) -> List[models.User]:
     """
@@ -237,3 +203,68 @@ def get_users_created_in_period(db: Session, days: int = 30) -> List[models.User
         models.User.created_at >= start_date,
         models.User.created_at <= end_date
     ).all()
+
+# Async variants, for use with an AsyncSession (see database.get_async_db)
+
+async def get_user_profile_async(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+async def get_user_statistics_async(db: AsyncSession, user_id: int, days: int = 30) -> Dict:
+    user = await get_user_profile_async(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(days=days)
+    buckets = await activity.get_activity_buckets_async(db, start_date, end_date, user_id=user_id)
+    daily_activities = await activity.count_activities_by_day_async(db, start_date, end_date, user_id=user_id)
+    return _user_statistics(user, buckets, daily_activities, days)
+
+async def get_user_session_info_async(db: AsyncSession, user_id: int) -> Dict:
+    user = await get_user_profile_async(db, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    end_date = datetime.now(UTC)
+    start_date = end_date - timedelta(hours=24)
+    buckets = await activity.get_activity_buckets_async(db, start_date, end_date, user_id=user_id)
+    return _session_info(user, buckets)
+
+async def get_active_users_count_async(db: AsyncSession) -> int:
+    return (await db.execute(
+        select(func.count(models.User.id)).where(models.User.is_active == True)
+    )).scalar_one()
+
+def _user_statistics(user: models.User, buckets: Dict, daily_activities: Dict[str, int], days: int) -> Dict:
+    # Get most active day
+    most_active_day = max(daily_activities.items(), key=lambda x: x[1]) if daily_activities else None
+    
+    return {
+        "user": {
+            "id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "role": user.role,
+            "is_active": user.is_active,
+            "created_at": user.created_at
+        },
+        "statistics": {
+            "total_activities": buckets["total"],
+            "login_activities": buckets["login"],
+            "file_activities": buckets["file"],
+            "system_activities": buckets["system"],
+            "most_active_day": most_active_day,
+            "period_days": days
+        },
+        "daily_activities": daily_activities
+    }
+
+def _session_info(user: models.User, buckets: Dict) -> Dict:
+    return {
+        "user_id": user.id,
+        "username": user.username,
+        "is_active": user.is_active,
+        "last_login": buckets["last_login"],
+        "recent_activities_count": buckets["total"],
+        "session_duration": "24 hours"  # This could be calculated based on actual session data
+    }
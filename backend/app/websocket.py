@@ -1,124 +1,625 @@
-from fastapi import WebSocket, WebSocketDisconnect
-from typing import List, Dict
+"""
+WebSocket connections and broadcasting.
+
+Connections are authenticated: `/ws/{client_type}?token=<access token>` (or
+an `Authorization: Bearer` header), where client_type must match the
+user's role (admin, staff, users). Each socket belongs to its user's
+organisation domain (the tenant) and subscribes to topics its client type
+may receive, by default all of them:
+
+    alerts            security alerts                      admin
+    system_status     system status updates                admin
+    activity_update   activity feed                        admin, staff
+    analytics         live dashboard counts                admin, staff
+    notifications     system notifications                 everyone
+
+Subscribing to `analytics` sends the tenant's analytics_snapshot first,
+then analytics_delta frames (see app/live_analytics.py).
+
+Activity frames are written by the ingest pipeline (app/ws_ingest.py),
+never on the event loop, within a per-connection rate limit; each
+`activity_log` frame is answered with an `activity_log_ack`.
+
+Sockets are indexed by topic and tenant, so a broadcast only visits the
+subscribers of its topic in its tenant (or in every tenant for cluster-wide
+broadcasts) instead of every socket.
+
+Every connection gets a bounded outbound queue and a writer task that
+sends from it, so a broadcast only encodes the message once and enqueues
+it for each recipient; it never waits on a socket. A client that does not
+keep up fills its queue and is handled by WS_SLOW_CONSUMER_POLICY:
+`drop_oldest` (discard the oldest queued message), `drop_newest` (discard
+the new one) or `disconnect`. A send that takes longer than
+WS_SEND_TIMEOUT seconds also disconnects the client; one watchdog task
+checks for those rather than arming a timer around every send.
+
+Broadcasts go through the backplane (app/backplane.py) once the manager is
+started, so they also reach sockets held by other workers; each worker
+delivers what it receives to its own sockets. Messages carry an id and a
+worker drops ids it has already delivered, so a message published twice
+(a retried publish, or the same event raised by several workers under one
+`message_id`) reaches each socket once. Broadcasts for one tenant go to
+that organisation domain's channel.
+"""
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+import asyncio
 import json
+import logging
+import uuid
 from datetime import datetime, UTC
-from . import activity
-from sqlalchemy.orm import Session
+from . import activity, anomaly, auth, live_analytics, models, rules, schemas, ws_ingest
+from .backplane import Backplane, create_backplane
+from .config import settings
 from .database import SessionLocal
 
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+
+# Close code for clients disconnected for falling behind ("try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Close code for connections refused for a missing/invalid token or role
+POLICY_VIOLATION_CLOSE_CODE = 1008
+
+ALERTS = "alerts"
+SYSTEM_STATUS = "system_status"
+ACTIVITY_UPDATE = "activity_update"
+ANALYTICS = "analytics"
+NOTIFICATIONS = "notifications"
+
+# Topics each client type may subscribe to
+CLIENT_TYPE_TOPICS = {
+    "admin": frozenset({ALERTS, SYSTEM_STATUS, ACTIVITY_UPDATE, ANALYTICS, NOTIFICATIONS}),
+    "staff": frozenset({ACTIVITY_UPDATE, ANALYTICS, NOTIFICATIONS}),
+    "users": frozenset({NOTIFICATIONS}),
+}
+
+# The client type a user of each role connects as
+ROLE_CLIENT_TYPES = {"admin": "admin", "staff": "staff", "user": "users"}
+
+def encode_message(message: Union[str, dict]) -> str:
+    return message if isinstance(message, str) else json.dumps(message)
+
+class _Client:
+    __slots__ = ("websocket", "client_type", "tenant", "topics", "queue", "writer", "dropped", "send_started")
+
+    def __init__(self, websocket: WebSocket, client_type: str, tenant: Optional[str], queue_size: int):
+        self.websocket = websocket
+        self.client_type = client_type
+        self.tenant = tenant
+        self.topics: Set[str] = set()
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        # Loop time the current send started at, 0 when idle
+        self.send_started = 0.0
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {
-            "admin": [],
-            "staff": []
+    def __init__(
+        self,
+        queue_size: int = settings.ws_send_queue_size,
+        slow_consumer_policy: str = settings.ws_slow_consumer_policy,
+        send_timeout: float = settings.ws_send_timeout,
+        channel_prefix: str = settings.ws_backplane_channel_prefix,
+        dedup_size: int = settings.ws_backplane_dedup_size,
+    ):
+        if slow_consumer_policy not in (DROP_OLDEST, DROP_NEWEST, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy {slow_consumer_policy!r}")
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self.active_connections: Dict[str, Set[WebSocket]] = {
+            "admin": set(),
+            "staff": set()
+        }
+        self._clients: Dict[WebSocket, _Client] = {}
+        # topic -> tenant -> subscribed clients
+        self._subscribers: Dict[str, Dict[Optional[str], Set[_Client]]] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self._watchdog: Optional[asyncio.Task] = None
+        self.channel_prefix = channel_prefix
+        self.dedup_size = dedup_size
+        self.backplane: Optional[Backplane] = None
+        # Local sockets per tenant; the tenant channel is subscribed while > 0
+        self._tenants: Dict[str, int] = {}
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._subscriptions: Set[asyncio.Task] = set()
+        # topic -> callbacks(text, tenant) run for every message of the
+        # topic delivered to this worker
+        self._listeners: Dict[str, List[Callable[[str, Optional[str]], None]]] = {}
+        self.stats = {
+            "sent": 0, "dropped": 0, "slow_disconnects": 0, "send_errors": 0,
+            "published": 0, "received": 0, "duplicates": 0, "publish_errors": 0,
         }
 
-    async def connect(self, websocket: WebSocket, client_type: str):
+    async def start(self, backplane: Optional[Backplane] = None):
+        """
+        Route broadcasts through `backplane` (WS_BACKPLANE by default).
+        Until then they are only delivered to this process's sockets.
+        """
+        backplane = backplane if backplane is not None else create_backplane()
+        await backplane.start(self._receive)
+        await backplane.subscribe(self._channel(None))
+        for tenant in self._tenants:
+            await backplane.subscribe(self._channel(tenant))
+        self.backplane = backplane
+
+    async def stop(self):
+        backplane, self.backplane = self.backplane, None
+        if backplane is not None:
+            await backplane.stop()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        client_type: str,
+        tenant: Optional[str] = None,
+        topics: Optional[Iterable[str]] = None
+    ):
         await websocket.accept()
-        if client_type not in self.active_connections:
-            self.active_connections[client_type] = []
-        self.active_connections[client_type].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, client_type: str):
-        if client_type in self.active_connections:
-            if websocket in self.active_connections[client_type]:
-                self.active_connections[client_type].remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast_to_type(self, message: str, client_type: str):
-        if client_type in self.active_connections:
-            for connection in self.active_connections[client_type]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    # Remove dead connections
-                    self.active_connections[client_type].remove(connection)
-
-    async def broadcast_to_all(self, message: str):
-        for client_type in self.active_connections:
-            await self.broadcast_to_type(message, client_type)
+        self.register(websocket, client_type, tenant, topics)
+
+    def register(
+        self,
+        websocket: WebSocket,
+        client_type: str,
+        tenant: Optional[str] = None,
+        topics: Optional[Iterable[str]] = None
+    ):
+        """
+        Track an accepted socket of `tenant` (an organisation domain),
+        subscribe it to `topics` (all its client type may receive when
+        None) and start its writer task
+        """
+        client = _Client(websocket, client_type, tenant, self.queue_size)
+        client.writer = asyncio.create_task(self._write(client))
+        self._clients[websocket] = client
+        self.active_connections.setdefault(client_type, set()).add(websocket)
+        self.subscribe(websocket, CLIENT_TYPE_TOPICS.get(client_type, ()) if topics is None else topics)
+        if tenant is not None:
+            self._tenants[tenant] = self._tenants.get(tenant, 0) + 1
+            if self._tenants[tenant] == 1:
+                self._update_subscription("subscribe", tenant)
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch_sends())
+
+    def disconnect(self, websocket: WebSocket, client_type: Optional[str] = None):
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        self.active_connections.get(client.client_type, set()).discard(websocket)
+        self.unsubscribe(websocket, list(client.topics), client)
+        if client.tenant is not None:
+            self._tenants[client.tenant] -= 1
+            if not self._tenants[client.tenant]:
+                del self._tenants[client.tenant]
+                self._update_subscription("unsubscribe", client.tenant)
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> Set[str]:
+        """
+        Add topics to a socket's subscriptions, ignoring those its client
+        type may not receive. Returns the socket's topics.
+        """
+        client = self._clients.get(websocket)
+        if client is None:
+            return set()
+        allowed = CLIENT_TYPE_TOPICS.get(client.client_type, frozenset())
+        for topic in topics:
+            if topic in allowed and topic not in client.topics:
+                client.topics.add(topic)
+                self._subscribers.setdefault(topic, {}).setdefault(client.tenant, set()).add(client)
+        return client.topics
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str], client: Optional[_Client] = None) -> Set[str]:
+        client = client or self._clients.get(websocket)
+        if client is None:
+            return set()
+        for topic in topics:
+            if topic not in client.topics:
+                continue
+            client.topics.discard(topic)
+            by_tenant = self._subscribers[topic]
+            by_tenant[client.tenant].discard(client)
+            if not by_tenant[client.tenant]:
+                del by_tenant[client.tenant]
+        return client.topics
+
+    def subscriptions(self, websocket: WebSocket) -> Set[str]:
+        client = self._clients.get(websocket)
+        return set(client.topics) if client is not None else set()
+
+    def has_subscribers(self, topic: str, tenant: Optional[str]) -> bool:
+        """
+        Whether any local socket of `tenant` subscribes to `topic`
+        """
+        return bool(self._subscribers.get(topic, {}).get(tenant))
+
+    def add_listener(self, topic: str, callback: Callable[[str, Optional[str]], None]):
+        """
+        Call `callback(text, tenant)` for every message of `topic` this
+        worker delivers, whether or not a local socket subscribes
+        """
+        self._listeners.setdefault(topic, []).append(callback)
+
+    def connection_count(self) -> int:
+        return len(self._clients)
+
+    def connection_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "connections": {client_type: len(sockets) for client_type, sockets in self.active_connections.items()},
+            "queued": sum(client.queue.qsize() for client in self._clients.values()),
+            "queue_size": self.queue_size,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "backplane": type(self.backplane).__name__ if self.backplane is not None else None,
+            "tenants": len(self._tenants),
+            "subscriptions": {
+                topic: sum(len(clients) for clients in by_tenant.values())
+                for topic, by_tenant in self._subscribers.items()
+            },
+        }
+
+    async def send_personal_message(self, message: Union[str, dict], websocket: WebSocket):
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, encode_message(message))
+
+    async def broadcast(
+        self,
+        message: Union[str, dict],
+        topic: str,
+        tenant: Optional[str] = None,
+        client_type: Optional[str] = None,
+        message_id: Optional[str] = None
+    ):
+        """
+        Send to the sockets subscribed to `topic` in the cluster: those of
+        `tenant` (every tenant when None), optionally only of one client
+        type. Broadcasts sharing a `message_id` are delivered once.
+        """
+        await self._publish(encode_message(message), topic, tenant, client_type, message_id)
+
+    def _channel(self, tenant: Optional[str]) -> str:
+        return f"{self.channel_prefix}:tenant:{tenant}" if tenant is not None else f"{self.channel_prefix}:all"
+
+    async def _publish(
+        self,
+        text: str,
+        topic: str,
+        tenant: Optional[str],
+        client_type: Optional[str],
+        message_id: Optional[str]
+    ):
+        if self.backplane is None:
+            self._deliver(text, topic, tenant, client_type)
+            return
+        envelope = json.dumps({
+            "id": message_id or uuid.uuid4().hex,
+            "topic": topic,
+            "tenant": tenant,
+            "client_type": client_type,
+            "message": text,
+        })
+        try:
+            await self.backplane.publish(self._channel(tenant), envelope)
+            self.stats["published"] += 1
+        except Exception:
+            # Still reach this worker's sockets while the backplane is down
+            logger.warning("Backplane publish failed, delivering locally only", exc_info=True)
+            self.stats["publish_errors"] += 1
+            self._deliver(text, topic, tenant, client_type)
+
+    async def _receive(self, channel: str, data: str):
+        envelope = json.loads(data)
+        message_id = envelope["id"]
+        if message_id in self._seen:
+            self.stats["duplicates"] += 1
+            return
+        self._seen[message_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        self.stats["received"] += 1
+        self._deliver(envelope["message"], envelope["topic"], envelope["tenant"], envelope["client_type"])
+
+    def _deliver(self, text: str, topic: str, tenant: Optional[str], client_type: Optional[str]):
+        for listener in self._listeners.get(topic, ()):
+            try:
+                listener(text, tenant)
+            except Exception:
+                logger.exception("%s listener failed", topic)
+        by_tenant = self._subscribers.get(topic)
+        if not by_tenant:
+            return
+        groups = list(by_tenant.values()) if tenant is None else [by_tenant.get(tenant, ())]
+        for clients in groups:
+            # Copied: the disconnect policy may remove clients while enqueueing
+            for client in tuple(clients):
+                if client_type is None or client.client_type == client_type:
+                    self._enqueue(client, text)
+
+    def _update_subscription(self, action: str, tenant: str):
+        if self.backplane is None:
+            return
+        task = asyncio.create_task(getattr(self.backplane, action)(self._channel(tenant)))
+        self._subscriptions.add(task)
+        task.add_done_callback(self._subscriptions.discard)
+
+    def _enqueue(self, client: _Client, text: str):
+        try:
+            client.queue.put_nowait(text)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.slow_consumer_policy == DISCONNECT:
+            self._drop_slow_consumer(client)
+            return
+        if self.slow_consumer_policy == DROP_OLDEST:
+            client.queue.get_nowait()
+            client.queue.put_nowait(text)
+        client.dropped += 1
+        self.stats["dropped"] += 1
+
+    def _drop_slow_consumer(self, client: _Client):
+        self.stats["slow_disconnects"] += 1
+        self.disconnect(client.websocket)
+        task = asyncio.create_task(self._close(client.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _write(self, client: _Client):
+        queue = client.queue
+        websocket = client.websocket
+        loop = asyncio.get_running_loop()
+        while True:
+            text = await queue.get()
+            client.send_started = loop.time()
+            try:
+                await websocket.send_text(text)
+            except Exception:
+                # The socket is gone; the receive loop will see it too
+                self.stats["send_errors"] += 1
+                self.disconnect(websocket)
+                return
+            client.send_started = 0.0
+            self.stats["sent"] += 1
+
+    async def _watch_sends(self):
+        # Disconnects clients whose current send has been stuck for longer
+        # than send_timeout (which cancels their writer); exits when idle
+        loop = asyncio.get_running_loop()
+        while self._clients:
+            await asyncio.sleep(self.send_timeout / 2)
+            now = loop.time()
+            for client in list(self._clients.values()):
+                if client.send_started and now - client.send_started > self.send_timeout:
+                    self._drop_slow_consumer(client)
 
 manager = ConnectionManager()
 
+def tenant_of(principal: schemas.Principal) -> str:
+    # Falls back to the email for rows not yet backfilled by migration 0002
+    return principal.organisation_domain or models.extract_domain(principal.email)
+
 async def websocket_endpoint(websocket: WebSocket, client_type: str = "users"):
-    await manager.connect(websocket, client_type)
+    principal = await _authenticate(websocket)
+    if principal is None or not principal.is_active or ROLE_CLIENT_TYPES.get(principal.role) != client_type:
+        await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+        return
+    tenant = tenant_of(principal)
+    requested = websocket.query_params.get("topics")
+    topics = requested.split(",") if requested else CLIENT_TYPE_TOPICS.get(client_type, ())
+    # analytics is subscribed once its snapshot is queued, see _subscribe_analytics
+    await manager.connect(websocket, client_type, tenant, [topic for topic in topics if topic != ANALYTICS])
+    client_ip = websocket.client.host if websocket.client else None
+    limiter = ws_ingest.TokenBucket()
     try:
+        if ANALYTICS in topics:
+            await _subscribe_analytics(websocket, client_type, tenant)
+        await manager.send_personal_message(_subscriptions_frame(websocket), websocket)
         while True:
             data = await websocket.receive_text()
-            message = json.loads(data)
+            try:
+                message = json.loads(data)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                # Keep the connection (and its pending acks) on a bad frame
+                await manager.send_personal_message(_error_frame("Messages must be JSON objects"), websocket)
+                continue
             
             # Handle different message types
             if message.get("type") == "activity_log":
-                # Log activity to database
-                db = SessionLocal()
-                try:
-                    activity.log_activity(
-                        db=db,
-                        user_id=message.get("user_id"),
-                        action=message.get("action"),
-                        details=message.get("details")
-                    )
-                    
-                    # Broadcast to admins if it's a suspicious activity
-                    if message.get("action") in [
-                        "failed_login", "unauthorized_access", "suspicious_activity"
-                    ]:
-                        alert_message = {
-                            "type": "security_alert",
-                            "timestamp": datetime.now(UTC).isoformat(),
-                            "user_id": message.get("user_id"),
-                            "action": message.get("action"),
-                            "details": message.get("details")
-                        }
-                        await manager.broadcast_to_type(
-                            json.dumps(alert_message), "admin"
-                        )
-                        
-                finally:
-                    db.close()
+                # Queued for the ingest pipeline; acknowledged once written
+                rejected = _ingest_activity(websocket, principal, tenant, limiter, message, client_ip)
+                if rejected is not None:
+                    await manager.send_personal_message(_ack(message.get("id"), "rejected", rejected), websocket)
                     
+            elif message.get("type") == "activity_log_batch":
+                reply = {"type": "activity_log_batch_result", "id": message.get("id")}
+                events = message.get("events")
+                if not isinstance(events, list) or not 0 < len(events) <= activity.MAX_BATCH_EVENTS:
+                    reply["error"] = f"events must be a list of 1 to {activity.MAX_BATCH_EVENTS} events"
+                elif not limiter.take(len(events)):
+                    reply["error"] = RATE_LIMITED
+                elif not ws_ingest.pipeline.submit_batch(
+                    principal, events, client_ip, partial(_batch_written, websocket, reply)
+                ):
+                    reply["error"] = INGEST_BUSY
+                if "error" in reply:
+                    await manager.send_personal_message(json.dumps(reply), websocket)
+
+            elif message.get("type") in ("subscribe", "unsubscribe"):
+                topics = message.get("topics")
+                if not isinstance(topics, list):
+                    await manager.send_personal_message(_error_frame("topics must be a list"), websocket)
+                    continue
+                topics = [str(topic) for topic in topics]
+                if message["type"] == "subscribe" and ANALYTICS in topics:
+                    topics.remove(ANALYTICS)
+                    if ANALYTICS not in manager.subscriptions(websocket):
+                        await _subscribe_analytics(websocket, client_type, tenant)
+                getattr(manager, message["type"])(websocket, topics)
+                await manager.send_personal_message(_subscriptions_frame(websocket), websocket)
+
             elif message.get("type") == "system_status":
-                # Broadcast system status updates
-                await manager.broadcast_to_type(
-                    json.dumps(message), "admin"
-                )
+                # Status updates from an admin go to their own tenant's admins
+                if client_type != "admin":
+                    await manager.send_personal_message(_error_frame("Admin access required"), websocket)
+                    continue
+                await manager.broadcast(json.dumps(message), SYSTEM_STATUS, tenant)
                 
             elif message.get("type") == "notification":
-                # Send notifications to specific user types
+                # Admins notify their own tenant, optionally one client type
+                if client_type != "admin":
+                    await manager.send_personal_message(_error_frame("Admin access required"), websocket)
+                    continue
                 target_type = message.get("target", "all")
-                if target_type == "all":
-                    await manager.broadcast_to_all(json.dumps(message))
-                else:
-                    await manager.broadcast_to_type(json.dumps(message), target_type)
+                await manager.broadcast(
+                    json.dumps(message), NOTIFICATIONS, tenant,
+                    client_type=None if target_type == "all" else target_type
+                )
                     
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, client_type)
 
-async def send_activity_update(activity_data: dict):
+async def _authenticate(websocket: WebSocket) -> Optional[schemas.Principal]:
+    # Browsers cannot set headers on a WebSocket handshake, hence the query parameter
+    token = websocket.query_params.get("token")
+    if not token:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    if not token:
+        return None
+    return await run_in_threadpool(_principal, token)
+
+def _principal(token: str) -> Optional[schemas.Principal]:
+    db = SessionLocal()
+    try:
+        return auth.get_current_user(token, db)
+    except HTTPException:
+        return None
+    finally:
+        db.close()
+
+async def _subscribe_analytics(websocket: WebSocket, client_type: str, tenant: str):
+    # Nothing awaits between taking the snapshot and subscribing, so the
+    # socket gets every delta after the snapshot and none before it
+    if ANALYTICS not in CLIENT_TYPE_TOPICS.get(client_type, ()):
+        return
+    try:
+        snapshot = await live_analytics.analytics.snapshot(tenant)
+    except Exception:
+        logger.exception("Failed to count analytics of %s", tenant)
+        await manager.send_personal_message(_error_frame("Analytics unavailable"), websocket)
+        return
+    await manager.send_personal_message(snapshot, websocket)
+    manager.subscribe(websocket, [ANALYTICS])
+
+def _subscriptions_frame(websocket: WebSocket) -> str:
+    return json.dumps({"type": "subscriptions", "topics": sorted(manager.subscriptions(websocket))})
+
+def _error_frame(detail: str) -> str:
+    return json.dumps({"type": "error", "detail": detail})
+
+RATE_LIMITED = "Rate limit exceeded"
+INGEST_BUSY = "Server busy, retry later"
+
+def _ingest_activity(
+    websocket: WebSocket,
+    principal: schemas.Principal,
+    tenant: str,
+    limiter: ws_ingest.TokenBucket,
+    message: dict,
+    client_ip: Optional[str]
+) -> Optional[str]:
+    """
+    Queue an activity_log frame:
+    {"type": "activity_log", "id": <optional echo>, "action": "...", "details": "...", "user_id": <optional>}
+    Returns why it was rejected, or None once queued
+    """
+    try:
+        event = schemas.ActivityLogEvent.model_validate({
+            "user_id": message.get("user_id", principal.id),
+            "action": message.get("action"),
+            "details": message.get("details"),
+        })
+    except ValidationError as exc:
+        return activity.validation_detail(exc)
+    if not activity.can_log_for(principal, event.user_id):
+        return "Can only log your own activities"
+    if not limiter.take():
+        return RATE_LIMITED
+    row = {"user_id": event.user_id, "action": event.action, "details": event.details, "timestamp": datetime.now(UTC)}
+    on_done = partial(_activity_written, websocket, message.get("id"), row, tenant)
+    if not ws_ingest.pipeline.submit_event(row, principal.id, client_ip, on_done):
+        return INGEST_BUSY
+    return None
+
+async def _activity_written(websocket: WebSocket, message_id, row: dict, tenant: str, result: dict):
+    await manager.send_personal_message(_ack(message_id, result["status"], result.get("detail")), websocket)
+    # Alert the tenant's admins if it's a suspicious activity
+    rule = rules.registry.classify(row["action"])
+    if result["status"] == "accepted" and rule is not None:
+        alert_message = {
+            "type": "security_alert",
+            "timestamp": datetime.now(UTC).isoformat(),
+            "user_id": row["user_id"],
+            "action": row["action"],
+            "details": row["details"],
+            "category": rule.category,
+            "severity": rule.severity
+        }
+        await manager.broadcast(json.dumps(alert_message), ALERTS, tenant)
+
+async def _batch_written(websocket: WebSocket, reply: dict, result: dict):
+    await manager.send_personal_message(json.dumps({**reply, **result}), websocket)
+
+def _ack(message_id, status: str, detail: Optional[str] = None) -> str:
+    ack = {"type": "activity_log_ack", "id": message_id, "status": status}
+    if detail is not None:
+        ack["detail"] = detail
+    return json.dumps(ack)
+
+async def send_activity_update(activity_data: dict, tenant: Optional[str] = None):
     """
-    Send activity updates to all connected clients
+    Send activity updates to a tenant's (or every tenant's) activity feed subscribers
     """
     message = {
         "type": "activity_update",
         "timestamp": datetime.now(UTC).isoformat(),
         "data": activity_data
     }
-    await manager.broadcast_to_all(json.dumps(message))
+    await manager.broadcast(json.dumps(message), ACTIVITY_UPDATE, tenant)
 
-async def send_security_alert(alert_data: dict):
+async def send_security_alert(alert_data: dict, tenant: Optional[str] = None):
     """
-    Send security alerts to admin clients
+    Send security alerts to a tenant's (or every tenant's) admin clients
     """
     message = {
         "type": "security_alert",
         "timestamp": datetime.now(UTC).isoformat(),
         "data": alert_data
     }
-    await manager.broadcast_to_type(json.dumps(message), "admin")
+    await manager.broadcast(json.dumps(message), ALERTS, tenant)
 
-async def send_system_notification(notification: str, target_type: str = "all"):
+async def send_system_notification(notification: str, target_type: str = "all", tenant: Optional[str] = None):
     """
     Send system notifications
     """
@@ -127,7 +628,74 @@ async def send_system_notification(notification: str, target_type: str = "all"):
         "timestamp": datetime.now(UTC).isoformat(),
         "message": notification
     }
-    if target_type == "all":
-        await manager.broadcast_to_all(json.dumps(message))
+    await manager.broadcast(
+        json.dumps(message), NOTIFICATIONS, tenant,
+        client_type=None if target_type == "all" else target_type
+    )
+
+def publish_analytics():
+    """
+    Broadcast the live analytics deltas to each tenant's `analytics`
+    subscribers, and apply the deltas every worker publishes to this
+    worker's buckets
+    """
+    analytics = live_analytics.analytics
+    async def publish(tenant: str, frame: str):
+        await manager.broadcast(frame, ANALYTICS, tenant)
+    analytics.publish = publish
+    analytics.watched = partial(manager.has_subscribers, ANALYTICS)
+    manager.add_listener(ANALYTICS, analytics.apply)
+
+def publish_anomalies(loop: asyncio.AbstractEventLoop):
+    """
+    Route alerts of the anomaly detector, which is fed from request
+    threads and the event loop alike, to admin sockets and the activity log
+    """
+    def on_alert(alert: dict):
+        asyncio.run_coroutine_threadsafe(_dispatch_anomaly(alert), loop)
+    anomaly.detector.on_alert = on_alert
+
+async def _dispatch_anomaly(alert: dict):
+    rule = rules.registry.classify(alert["kind"])
+    # Only the admins of the user's tenant are alerted; an alert with no
+    # known user is only recorded
+    tenant = await run_in_threadpool(_user_tenant, alert["user_id"])
+    if tenant is not None:
+        await send_security_alert({
+            **alert,
+            "category": rule.category if rule else None,
+            "severity": rule.severity if rule else None,
+        }, tenant)
+    try:
+        await run_in_threadpool(_record_anomaly, alert)
+    except Exception:
+        logger.exception("Failed to record %s alert", alert["kind"])
+
+def _user_tenant(user_id: Optional[int]) -> Optional[str]:
+    if user_id is None:
+        return None
+    db = SessionLocal()
+    try:
+        user = db.get(models.User, user_id)
+        return None if user is None else user.organisation_domain or models.extract_domain(user.email)
+    finally:
+        db.close()
+
+def _record_anomaly(alert: dict):
+    # Written as a derived activity (not through log_activity, so it is not
+    # fed back to the detector)
+    if alert["kind"] == anomaly.MULTIPLE_FAILED_LOGINS:
+        details = f"{alert['count']} failed logins within {alert['window_seconds']:g}s"
     else:
-        await manager.broadcast_to_type(json.dumps(message), target_type)
+        details = f"{alert['count']} events in {alert['window_seconds']:g}s (baseline {alert['baseline']}, z={alert['zscore']})"
+    details += f" from {alert['scope']} {alert['key']}"
+    db = SessionLocal()
+    try:
+        activity.insert_activities(db, [{
+            "user_id": alert["user_id"],
+            "action": alert["kind"],
+            "details": details[:255],
+            "timestamp": datetime.now(UTC),
+        }])
+    finally:
+        db.close()
@@ -0,0 +1,224 @@
+"""
+Ingest pipeline for WebSocket activity frames.
+
+A socket's receive loop only validates an `activity_log` or
+`activity_log_batch` frame, applies the connection's rate limit and queues
+the frame here; it never touches the database. WS_INGEST_WORKERS tasks
+take frames off the queue and run the writes in a thread pool of their
+own, so a commit never blocks the event loop, nor the threads sync HTTP
+routes run in. Single events queued by any connection are coalesced into
+one multi-row INSERT of up to WS_INGEST_BATCH_SIZE rows; batch frames are
+written with activity.log_activity_batch. Once a frame is written its
+callback runs on the event loop, which is where the sender is acknowledged.
+
+When the queue is full a frame is rejected at once (the sender is told to
+retry) rather than queued without bound.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from . import activity, anomaly, schemas
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[Dict], Awaitable[None]]
+
+class TokenBucket:
+    """
+    Rate limit of one connection: `rate` events per second on average and
+    up to `burst` at once. A rate of 0 disables the limit.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float = settings.ws_ingest_rate, burst: int = settings.ws_ingest_burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, count: int = 1) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+class _Event(NamedTuple):
+    row: Dict
+    principal_id: int
+    ip: Optional[str]
+    on_done: Callback
+
+class _Batch(NamedTuple):
+    principal: schemas.Principal
+    events: List[Any]
+    ip: Optional[str]
+    on_done: Callback
+
+class IngestPipeline:
+    def __init__(
+        self,
+        workers: int = settings.ws_ingest_workers,
+        queue_size: int = settings.ws_ingest_queue_size,
+        batch_size: int = settings.ws_ingest_batch_size,
+        session_factory=SessionLocal,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats_lock = threading.Lock()
+        self.stats = {"events": 0, "batches": 0, "inserts": 0, "busy": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """
+        Start the worker tasks; call from the event loop
+        """
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="ws-ingest")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Write the queued frames, then stop
+        """
+        if not self.running:
+            return
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit_event(self, row: Dict, principal_id: int, ip: Optional[str], on_done: Callback) -> bool:
+        """
+        Queue one activity row (user_id, action, details, timestamp) logged
+        by `principal_id`. Returns False when the queue is full.
+        """
+        return self._put(_Event(row, principal_id, ip, on_done))
+
+    def submit_batch(self, principal: schemas.Principal, events: List[Any], ip: Optional[str], on_done: Callback) -> bool:
+        """
+        Queue a batch frame's events, to be validated and written by
+        log_activity_batch. Returns False when the queue is full.
+        """
+        return self._put(_Batch(principal, events, ip, on_done))
+
+    def _put(self, job) -> bool:
+        if not self.running:
+            self.start()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["busy"] += 1
+            return False
+        return True
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            jobs = [await queue.get()]
+            rows = _size(jobs[0])
+            while rows < self.batch_size and not queue.empty():
+                jobs.append(queue.get_nowait())
+                rows += _size(jobs[-1])
+            try:
+                results = await loop.run_in_executor(self._executor, self._write, jobs)
+            except Exception:
+                logger.exception("WebSocket ingest failed")
+                results = [_failure(job) for job in jobs]
+            for job, result in zip(jobs, results):
+                try:
+                    await job.on_done(result)
+                except Exception:
+                    logger.exception("WebSocket ingest callback failed")
+                queue.task_done()
+
+    def _write(self, jobs: List) -> List[Dict]:
+        # Runs in the executor
+        results: List[Optional[Dict]] = [None] * len(jobs)
+        db = self.session_factory()
+        try:
+            events = [(index, job) for index, job in enumerate(jobs) if isinstance(job, _Event)]
+            if events:
+                try:
+                    self._write_events(db, events, results)
+                except Exception:
+                    logger.exception("Failed to write %d WebSocket activity events", len(events))
+                    db.rollback()
+                    self._count("failed", len(events))
+                    for index, job in events:
+                        results[index] = _failure(job)
+            for index, job in enumerate(jobs):
+                if isinstance(job, _Batch):
+                    try:
+                        results[index] = activity.log_activity_batch(db, job.principal, job.events, ip=job.ip)
+                        self._count("batches")
+                    except Exception:
+                        logger.exception("Failed to write a WebSocket activity batch")
+                        db.rollback()
+                        self._count("failed")
+                        results[index] = _failure(job)
+            return results
+        finally:
+            db.close()
+
+    def _write_events(self, db, events: List, results: List):
+        # Admins may log for other users; unknown ids are rejected here
+        # rather than failing the whole INSERT on a foreign key
+        known = activity.existing_user_ids(
+            db, {job.row["user_id"] for _, job in events if job.row["user_id"] != job.principal_id}
+        )
+        accepted = []
+        for index, job in events:
+            if job.row["user_id"] == job.principal_id or job.row["user_id"] in known:
+                accepted.append(job)
+                results[index] = {"status": "accepted"}
+            else:
+                results[index] = {"status": "rejected", "detail": "User not found"}
+        if not accepted:
+            return
+        activity.insert_activities(db, [job.row for job in accepted])
+        for job in accepted:
+            anomaly.detector.observe(job.row["user_id"], job.row["action"], job.ip)
+        self._count("events", len(accepted))
+        self._count("inserts")
+
+    def _count(self, key: str, amount: int = 1):
+        # Written from the executor threads
+        with self._stats_lock:
+            self.stats[key] += amount
+
+def _size(job) -> int:
+    return len(job.events) if isinstance(job, _Batch) else 1
+
+def _failure(job) -> Dict:
+    if isinstance(job, _Batch):
+        return {"error": "Failed to write activities"}
+    return {"status": "error", "detail": "Failed to write activity"}
+
+# Started by app.main; stopped (after writing what is queued) on shutdown
+pipeline = IngestPipeline()
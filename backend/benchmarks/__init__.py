@@ -0,0 +1,3 @@
+"""
+Benchmark scripts. See benchmarks/common.py for usage.
+"""
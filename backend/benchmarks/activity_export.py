@@ -0,0 +1,92 @@
+"""
+Exporting a large activity window: loading it through the ORM and
+serializing the list (the old /activity/time-range) against the streaming
+export (app/export.py). Reports time to first byte and total time, then
+peak Python memory (tracemalloc, in a second run since tracing slows
+allocation down) for each.
+
+    python -m benchmarks.activity_export --rows 1000000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta, UTC
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import export, models
+from app.database import Base
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs
+
+def load_all(session_factory, start, end):
+    with session_factory() as db:
+        rows = db.query(models.ActivityLog).filter(
+            models.ActivityLog.timestamp >= start, models.ActivityLog.timestamp <= end
+        ).order_by(models.ActivityLog.timestamp.desc()).all()
+        # Nothing can be sent before the whole list is encoded
+        yield json.dumps(jsonable_encoder(
+            [{column: getattr(row, column) for column in export.COLUMNS} for row in rows]
+        )).encode()
+
+def stream(engine, start, end, fmt, gzip):
+    chunks = export.encode(export.iter_activity_rows(start, end, newest_first=True, engine=engine), fmt)
+    return export.gzip_chunks(chunks) if gzip else chunks
+
+def measure(make_chunks) -> dict:
+    started = time.perf_counter()
+    first_byte = None
+    size = 0
+    for chunk in make_chunks():
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    for chunk in make_chunks():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_byte_ms": round((first_byte or total) * 1000, 1),
+        "total_ms": round(total * 1000, 1),
+        "peak_mb": round(peak / 2**20, 1),
+        "bytes": size,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--reuse", action="store_true", help="skip seeding if rows already exist")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count(models.ActivityLog.id))).scalar()
+        if not (args.reuse and existing):
+            conn.execute(delete(models.ActivityLog))
+            user_ids = seed_users(conn, args.users)
+            print(f"Seeding {args.rows} activity rows...")
+            seed_activity_logs(conn, user_ids, args.rows, days=30)
+
+    end = datetime.now(UTC)
+    start = end - timedelta(days=30)
+    print(json.dumps({
+        "url": engine.url.render_as_string(hide_password=True),
+        "rows": args.rows,
+        "orm_list_json": measure(lambda: load_all(session_factory, start, end)),
+        "stream_json": measure(lambda: stream(engine, start, end, "json", False)),
+        "stream_ndjson": measure(lambda: stream(engine, start, end, "ndjson", False)),
+        "stream_csv": measure(lambda: stream(engine, start, end, "csv", False)),
+        "stream_ndjson_gzip": measure(lambda: stream(engine, start, end, "ndjson", True)),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
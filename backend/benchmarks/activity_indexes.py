@@ -0,0 +1,97 @@
+"""
+Benchmark the activity_logs indexes added by migrations 0001 and 0004.
+
+Seeds a table without the composite indexes, records query plans and
+latency for the hot queries in app/activity.py, applies the migrations and
+measures again.
+
+    python -m benchmarks.activity_indexes --rows 3000000
+    python -m benchmarks.activity_indexes --url mysql+pymysql://root:@localhost:3306/dt_bench
+"""
+import argparse
+import json
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import func, select, delete
+
+from app import models, activity, rules
+from app.database import Base
+from app.migrations import run_migrations, drop_index, schema_migrations
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs, time_call, explain
+
+ActivityLog = models.ActivityLog
+
+def hot_queries(user_id: int):
+    now = datetime.now(UTC)
+    week_ago = now - timedelta(days=7)
+    return {
+        "user_activities": select(ActivityLog).where(ActivityLog.user_id == user_id)
+            .order_by(ActivityLog.timestamp.desc()).limit(100),
+        "all_activities": select(ActivityLog).order_by(ActivityLog.timestamp.desc()).limit(100),
+        "by_action": select(ActivityLog).where(ActivityLog.action == "file_access_denied")
+            .order_by(ActivityLog.timestamp.desc()).limit(100),
+        # Classified at write time and read from (suspicious, timestamp)...
+        "suspicious": activity._suspicious_activities_stmt(50),
+        # ...instead of the former scan over a list of actions
+        "suspicious_by_action": select(ActivityLog).where(ActivityLog.action.in_(list(rules.DEFAULT_RULES)))
+            .order_by(ActivityLog.timestamp.desc()).limit(50),
+        "user_week_by_action": select(ActivityLog.action, func.count(ActivityLog.id))
+            .where(ActivityLog.user_id == user_id, ActivityLog.timestamp >= week_ago,
+                   ActivityLog.timestamp <= now)
+            .group_by(ActivityLog.action),
+        "last_day_count": select(func.count(ActivityLog.id))
+            .where(ActivityLog.timestamp >= now - timedelta(days=1), ActivityLog.timestamp <= now),
+    }
+
+def measure(engine, user_id: int, repeat: int):
+    results = {}
+    with engine.connect() as conn:
+        for name, statement in hot_queries(user_id).items():
+            results[name] = {
+                "plan": explain(conn, statement),
+                **time_call(lambda: conn.execute(statement).all(), repeat),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="skip seeding if rows already exist")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in ActivityLog.__table__.indexes:
+            if index.name.startswith("ix_activity_logs_") and index.name != "ix_activity_logs_id":
+                drop_index(conn, "activity_logs", index.name)
+        conn.execute(delete(schema_migrations))
+
+        existing = conn.execute(select(func.count(ActivityLog.id))).scalar()
+        if not (args.reuse and existing):
+            conn.execute(delete(ActivityLog))
+            user_ids = seed_users(conn, args.users)
+            print(f"Seeding {args.rows} activity rows...")
+            seed_activity_logs(conn, user_ids, args.rows)
+        user_id = conn.execute(select(ActivityLog.user_id).limit(1)).scalar()
+
+    before = measure(engine, user_id, args.repeat)
+    run_migrations(engine)
+    after = measure(engine, user_id, args.repeat)
+
+    report = {
+        name: {
+            "before": before[name],
+            "after": after[name],
+            "speedup": round(before[name]["median_ms"] / max(after[name]["median_ms"], 1e-6), 1),
+        }
+        for name in before
+    }
+    print(json.dumps({"url": engine.url.render_as_string(hide_password=True),
+                      "rows": args.rows, "queries": report}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare activity ingest throughput of the synchronous log_activity path
+against the buffered writer and batch ingest (log_activity_batch, as
+behind POST /activity/log/batch). Before timing, checks that an event
+longer than the String(255) columns is rejected on its own while the rest
+of its batch is written.
+
+    python -m benchmarks.activity_ingest --events 20000
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import activity, activity_writer, models, schemas
+from app.database import Base
+from .common import DEFAULT_URL, make_engine, seed_users
+
+def run_sync(session_factory, user_ids, events: int) -> float:
+    db = session_factory()
+    try:
+        started = time.perf_counter()
+        for i in range(events):
+            activity.log_activity(db, user_ids[i % len(user_ids)], "file_download", "bench")
+        return time.perf_counter() - started
+    finally:
+        db.close()
+
+def run_buffered(session_factory, user_ids, events: int) -> float:
+    writer = activity_writer.ActivityLogWriter(session_factory=session_factory)
+    writer.start()
+    started = time.perf_counter()
+    for i in range(events):
+        writer.submit(user_ids[i % len(user_ids)], "file_download", "bench")
+    writer.stop()
+    elapsed = time.perf_counter() - started
+    assert writer.stats["written"] == events, writer.stats
+    return elapsed
+
+def run_batch(session_factory, user_ids, events: int, batch_size: int) -> float:
+    principal = schemas.Principal(id=user_ids[0], username="bench", email="bench@example.com", role="admin", is_active=True)
+    db = session_factory()
+    try:
+        started = time.perf_counter()
+        for offset in range(0, events, batch_size):
+            batch = [
+                {"user_id": user_ids[i % len(user_ids)], "action": "file_download", "details": "bench"}
+                for i in range(offset, min(offset + batch_size, events))
+            ]
+            result = activity.log_activity_batch(db, principal, batch)
+            assert result["rejected"] == 0, result
+        return time.perf_counter() - started
+    finally:
+        db.close()
+
+def check_oversized_item(session_factory, user_ids):
+    principal = schemas.Principal(id=user_ids[0], username="bench", email="bench@example.com", role="admin", is_active=True)
+    batch = [
+        {"user_id": user_ids[0], "action": "oversize_check", "details": "before"},
+        {"user_id": user_ids[0], "action": "x" * 300},
+        {"user_id": user_ids[0], "action": "oversize_check", "details": "after"},
+    ]
+    count_stmt = select(func.count(models.ActivityLog.id)).where(models.ActivityLog.action == "oversize_check")
+    db = session_factory()
+    try:
+        before = db.scalar(count_stmt)
+        result = activity.log_activity_batch(db, principal, batch)
+        written = db.scalar(count_stmt) - before
+    finally:
+        db.close()
+    assert [item["status"] for item in result["results"]] == ["accepted", "rejected", "accepted"], result
+    assert written == 2, written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        user_ids = seed_users(conn, 100)
+
+    check_oversized_item(session_factory, user_ids)
+    sync_seconds = run_sync(session_factory, user_ids, args.events)
+    buffered_seconds = run_buffered(session_factory, user_ids, args.events)
+    batch_seconds = run_batch(session_factory, user_ids, args.events, args.batch_size)
+    print(json.dumps({
+        "events": args.events,
+        "sync_events_per_sec": round(args.events / sync_seconds),
+        "buffered_events_per_sec": round(args.events / buffered_seconds),
+        "batch_events_per_sec": round(args.events / batch_seconds),
+        "speedup": round(sync_seconds / buffered_seconds, 1),
+        "batch_speedup": round(sync_seconds / batch_seconds, 1),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
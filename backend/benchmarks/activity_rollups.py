@@ -0,0 +1,94 @@
+"""
+Year-long activity analytics (per-day and per-action counts, as served by
+/admin/analytics/activities) from raw activity_logs against the hourly and
+daily rollups.
+
+    python -m benchmarks.activity_rollups --rows 3000000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import models, rollups
+from app.database import Base
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs, time_call
+
+def analytics(db, start, end, watermarks):
+    by_day = db.execute(rollups.counts_by_day_stmt(start, end, watermarks)).all()
+    by_action = db.execute(rollups.counts_by_action_stmt(start, end, watermarks)).all()
+    return sorted(map(tuple, by_day)), sorted(map(tuple, by_action))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="skip seeding if rows already exist")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count(models.ActivityLog.id))).scalar()
+        if not (args.reuse and existing):
+            conn.execute(delete(models.ActivityLog))
+            conn.execute(delete(models.ActivityRollup))
+            conn.execute(delete(models.ActivityRollupState))
+            user_ids = seed_users(conn, args.users)
+            print(f"Seeding {args.rows} activity rows...")
+            seed_activity_logs(conn, user_ids, args.rows, days=365)
+
+    started = time.perf_counter()
+    compacted = rollups.compact(session_factory)
+    compaction_seconds = time.perf_counter() - started
+
+    end = datetime.now(UTC)
+    start = end - timedelta(days=365)
+    with session_factory() as db:
+        watermarks = rollups.get_watermarks(db)
+        assert analytics(db, start, end, {}) == analytics(db, start, end, watermarks)
+        pieces = rollups.plan_window(start, end, watermarks)
+        rollup_rows = {
+            source: db.scalar(
+                select(func.count()).select_from(models.ActivityRollup).where(
+                    models.ActivityRollup.granularity == source,
+                    models.ActivityRollup.user_id == rollups.ALL_USERS,
+                    models.ActivityRollup.bucket_start >= lo,
+                    models.ActivityRollup.bucket_start < hi,
+                )
+            )
+            for source, lo, hi, _ in pieces if source != rollups.RAW
+        }
+        raw_rows = sum(
+            db.scalar(
+                select(func.count(models.ActivityLog.id)).where(
+                    models.ActivityLog.timestamp >= lo,
+                    models.ActivityLog.timestamp <= hi if inclusive else models.ActivityLog.timestamp < hi,
+                )
+            )
+            for source, lo, hi, inclusive in pieces if source == rollups.RAW
+        )
+        report = {
+            "raw_activity_logs": time_call(lambda: analytics(db, start, end, {}), args.repeat),
+            "rollups": time_call(lambda: analytics(db, start, end, watermarks), args.repeat),
+        }
+
+    report["speedup"] = round(
+        report["raw_activity_logs"]["median_ms"] / max(report["rollups"]["median_ms"], 1e-6), 1
+    )
+    print(json.dumps({
+        "url": engine.url.render_as_string(hide_password=True),
+        "rows": args.rows,
+        "compaction": {"buckets": compacted, "seconds": round(compaction_seconds, 2)},
+        "rows_read_with_rollups": {"rollup_rows": rollup_rows, "raw_rows": raw_rows},
+        "year_analytics": report,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
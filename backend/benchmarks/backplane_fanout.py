@@ -0,0 +1,125 @@
+"""
+Cluster-wide WebSocket broadcasts through the backplane (app/backplane.py).
+
+Runs --workers ConnectionManagers in one process, each with its own
+backplane connection, as separate uvicorn workers would. Their sockets
+(in-process stand-ins) are spread over --tenants organisation domains.
+Worker 0 then broadcasts to all admins, to one tenant, and the same
+message_id twice. The script checks that every expected socket in every
+worker received each message exactly once and that no other socket did,
+and reports the publish-to-delivery latency.
+
+The redis backplane runs against the stand-in server of
+benchmarks.pubsub_server unless --url points at a real Redis.
+
+    python -m benchmarks.backplane_fanout --backplane redis --workers 4 --connections 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from app.backplane import InMemoryBackplane, RedisBackplane
+from app.websocket import ConnectionManager
+from .pubsub_server import start_server
+from .websocket_fanout import Countdown, FakeWebSocket, percentiles
+
+async def make_cluster(args, url):
+    hub = {}
+    workers = []
+    for _ in range(args.workers):
+        manager = ConnectionManager(queue_size=256, slow_consumer_policy="drop_oldest", send_timeout=30)
+        await manager.start(InMemoryBackplane(hub) if args.backplane == "memory" else RedisBackplane(url))
+        workers.append(manager)
+    return workers
+
+async def run(args, url):
+    workers = await make_cluster(args, url)
+    countdown = Countdown()
+    sockets = []
+    for i in range(args.connections):
+        websocket = FakeWebSocket(0, countdown)
+        websocket.tenant = f"tenant{i % args.tenants}.example"
+        sockets.append(websocket)
+        await workers[i % args.workers].connect(websocket, "admin", websocket.tenant)
+    # Let the tenant subscriptions reach the server
+    await asyncio.sleep(0.2)
+
+    async def broadcast(expected, **kwargs):
+        for websocket in sockets:
+            websocket.received_at.clear()
+        countdown.reset(len(expected))
+        started = time.perf_counter()
+        await workers[0].broadcast(json.dumps({"type": "security_alert"}), "alerts", **kwargs)
+        await asyncio.wait_for(countdown.done.wait(), 10)
+        # Anything that would arrive late or twice
+        await asyncio.sleep(0.05)
+        exact = all(len(websocket.received_at) == (websocket in expected) for websocket in sockets)
+        return exact, [(websocket.received_at[0] - started) * 1000 for websocket in expected]
+
+    everyone = set(sockets)
+    tenant = sockets[0].tenant
+    tenant_sockets = {websocket for websocket in sockets if websocket.tenant == tenant}
+
+    results = {"all": [], "tenant": []}
+    exact = True
+    for _ in range(args.messages):
+        ok, latencies = await broadcast(everyone)
+        exact &= ok
+        results["all"].extend(latencies)
+        ok, latencies = await broadcast(tenant_sockets, tenant=tenant)
+        exact &= ok
+        results["tenant"].extend(latencies)
+
+    # The same event published by two workers
+    for websocket in sockets:
+        websocket.received_at.clear()
+    countdown.reset(len(sockets))
+    for manager in workers[:2]:
+        await manager.broadcast(json.dumps({"type": "security_alert"}), "alerts", message_id="alert-1")
+    await asyncio.wait_for(countdown.done.wait(), 10)
+    await asyncio.sleep(0.05)
+    deduplicated = all(len(websocket.received_at) == 1 for websocket in sockets)
+
+    for manager in workers:
+        for websocket in sockets:
+            manager.disconnect(websocket)
+        await manager.stop()
+    return {
+        "delivered_exactly_once": exact,
+        "duplicate_suppressed": deduplicated,
+        "cluster_broadcast": percentiles(results["all"]),
+        "tenant_broadcast": percentiles(results["tenant"]),
+        "duplicates_dropped": sum(manager.stats["duplicates"] for manager in workers),
+    }
+
+async def run_with_server(args):
+    if args.backplane == "memory" or args.url:
+        return await run(args, args.url)
+    pubsub, server = await start_server()
+    host, port = server.sockets[0].getsockname()[:2]
+    try:
+        return await run(args, f"redis://{host}:{port}")
+    finally:
+        server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backplane", choices=["memory", "redis"], default="redis")
+    parser.add_argument("--url", help="Redis URL; default starts the local stand-in")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=1000, help="sockets across all workers")
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        "backplane": args.backplane,
+        "workers": args.workers,
+        "connections": args.connections,
+        "tenants": args.tenants,
+        **asyncio.run(run_with_server(args)),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Shared helpers for the benchmark scripts: engine setup, bulk seeding and
+timing. Run the scripts from the backend directory, e.g.
+
+    python -m benchmarks.activity_indexes --url sqlite:////tmp/bench.db
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, UTC
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import models, rules
+
+DEFAULT_URL = "sqlite:////tmp/digital_twin_bench.db"
+
+# Relative frequency of each action in generated traffic
+ACTION_WEIGHTS = {
+    "login": 30,
+    "logout": 25,
+    "file_upload": 10,
+    "file_download": 12,
+    "system_check": 8,
+    "profile_updated": 3,
+    "task_completed": 6,
+    "failed_login": 3,
+    "file_access_denied": 1,
+    "unauthorized_access_attempt": 1,
+    "suspicious_file_access": 1,
+}
+
+def make_engine(url: str) -> Engine:
+    """
+    Create an engine for benchmarking (no SQL echo)
+    """
+    return create_engine(url, echo=False)
+
+def seed_users(conn: Connection, count: int, domain: str = "bench.example.com") -> List[int]:
+    """
+    Insert `count` plain users and return their ids
+    """
+    start_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar() + 1
+    rows = [
+        {
+            "id": start_id + i,
+            "username": f"bench_user_{start_id + i}",
+            "email": f"bench_user_{start_id + i}@{domain}",
+            "hashed_password": "x",
+            "is_active": True,
+            "role": "user",
+            "created_at": datetime.now(UTC),
+            "organisation_domain": domain,
+        }
+        for i in range(count)
+    ]
+    for chunk in _chunks(rows, 10_000):
+        conn.execute(models.User.__table__.insert(), chunk)
+    return [row["id"] for row in rows]
+
+def seed_activity_logs(
+    conn: Connection,
+    user_ids: List[int],
+    count: int,
+    days: int = 90,
+    seed: int = 42,
+    chunk_size: int = 50_000,
+) -> None:
+    """
+    Insert `count` activity rows spread over the last `days` days. User
+    activity is skewed so a minority of users produce most events.
+    """
+    rng = random.Random(seed)
+    actions = list(ACTION_WEIGHTS)
+    weights = list(ACTION_WEIGHTS.values())
+    now = datetime.now(UTC)
+    span_seconds = days * 86400
+    table = models.ActivityLog.__table__
+
+    inserted = 0
+    while inserted < count:
+        size = min(chunk_size, count - inserted)
+        picked_actions = rng.choices(actions, weights=weights, k=size)
+        rows = [
+            {
+                "user_id": user_ids[min(int(rng.paretovariate(1.2)) - 1, len(user_ids) - 1)
+                                    if rng.random() < 0.5 else rng.randrange(len(user_ids))],
+                "action": picked_actions[i],
+                "timestamp": now - timedelta(seconds=rng.randrange(span_seconds)),
+                "details": None,
+                **rules.registry.fields(picked_actions[i]),
+            }
+            for i in range(size)
+        ]
+        conn.execute(table.insert(), rows)
+        inserted += size
+
+def time_call(fn: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    """
+    Run `fn` `repeat` times and return min/median latency in milliseconds
+    """
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"min_ms": round(min(samples), 3), "median_ms": round(statistics.median(samples), 3)}
+
+def explain(conn: Connection, statement) -> List[str]:
+    """
+    Return the query plan for a SQLAlchemy statement as text lines
+    """
+    sql = str(statement.compile(conn, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return [row[-1] for row in rows]
+    rows = conn.execute(text(f"EXPLAIN {sql}")).mappings().all()
+    return [
+        f"table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+        f"rows={row.get('rows')} extra={row.get('Extra')}"
+        for row in rows
+    ]
+
+def _chunks(items: list, size: int):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
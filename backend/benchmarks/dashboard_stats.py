@@ -0,0 +1,85 @@
+"""
+Dashboard statistics latency as the tables grow: counting from the source
+tables (the previous get_system_statistics) against reading the
+precomputed dashboard counters.
+
+The tables are grown in steps; after each step the counters are rebuilt
+with counters.reconcile (the seeding bypasses the ORM hooks) and both paths
+are timed.
+
+    python -m benchmarks.dashboard_stats --steps 100000,1000000,3000000
+"""
+import argparse
+import json
+from datetime import datetime, time, UTC
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import activity, admin, counters, models
+from app.database import Base
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs, time_call
+
+def source_table_statistics(db):
+    """
+    Dashboard numbers computed from the source tables, as before the counters
+    """
+    total, active, admins, staff = db.execute(counters._user_counts_stmt()).one()
+    recent = activity.get_all_activities(db, limit=10)
+    suspicious = activity.get_suspicious_activities(db, limit=5)
+    today = datetime.now(UTC).date()
+    today_activities = activity.count_activities(
+        db, datetime.combine(today, time.min, tzinfo=UTC), datetime.combine(today, time.max, tzinfo=UTC)
+    )
+    return {
+        "total_users": total,
+        "active_users": int(active or 0),
+        "admin_users": int(admins or 0),
+        "staff_users": int(staff or 0),
+        "recent_activities": len(recent),
+        "suspicious_activities": len(suspicious),
+        "today_activities": today_activities,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--steps", default="100000,1000000,3000000",
+                        help="comma-separated activity_logs sizes to measure at")
+    parser.add_argument("--users-per-step", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        conn.execute(delete(models.ActivityLog))
+        conn.execute(delete(models.Staff))
+        conn.execute(delete(models.Admin))
+        conn.execute(delete(models.User))
+
+    results = []
+    seeded = 0
+    for step in (int(size) for size in args.steps.split(",")):
+        with engine.begin() as conn:
+            user_ids = seed_users(conn, args.users_per_step)
+            print(f"Seeding {step - seeded} activity rows...")
+            seed_activity_logs(conn, user_ids, step - seeded, days=30, seed=step)
+            users = conn.execute(select(func.count(models.User.id))).scalar()
+        seeded = step
+        counters.reconcile(session_factory)
+
+        with session_factory() as db:
+            assert source_table_statistics(db) == admin.get_system_statistics(db)
+            results.append({
+                "activity_rows": step,
+                "users": users,
+                "source_tables": time_call(lambda: source_table_statistics(db), args.repeat),
+                "counters": time_call(lambda: admin.get_system_statistics(db), args.repeat),
+            })
+
+    print(json.dumps({"url": engine.url.render_as_string(hide_password=True), "steps": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Rows per second through the activity list endpoints' read path, before and
+after the lean serialization path (app/responses.py, activity.ActivityRow).
+
+- page: a /activity/all page (response_model List[ActivityLog]). FastAPI
+  validates the result with a TypeAdapter (from_attributes) and dumps it
+  with pydantic; before, the result was ORM entities, now it is
+  ActivityRow objects from a column-projected query.
+- dicts: the listings without a response_model (/activity/suspicious,
+  /staff/department/activities, ...). Before, ORM entities went through
+  jsonable_encoder and json.dumps; now plain dicts of the columns are
+  rendered by responses.dumps (orjson, and stdlib json without it).
+
+Each is timed serializing only (rows already loaded) and end to end
+(query included). Also reports what gzip (as RESPONSE_GZIP_MIN_SIZE
+enables it) saves on a page.
+
+    python -m benchmarks.list_serialization --rows 1000
+"""
+import argparse
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, UTC
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app import activity, models, responses, schemas
+from app.database import Base
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs
+
+# What FastAPI builds for response_model=List[ActivityLog]
+PAGE = TypeAdapter(List[schemas.ActivityLog])
+
+def page_before(db, limit):
+    return db.scalars(
+        select(models.ActivityLog).order_by(*activity.NEWEST_FIRST).limit(limit)
+    ).all()
+
+def dicts_before(db, user_id, start, end, limit):
+    return db.scalars(
+        select(models.ActivityLog).where(
+            models.ActivityLog.user_id == user_id,
+            models.ActivityLog.timestamp >= start,
+            models.ActivityLog.timestamp <= end,
+        ).order_by(models.ActivityLog.timestamp.desc()).limit(limit)
+    ).all()
+
+def serialize_page(rows) -> bytes:
+    return PAGE.dump_json(PAGE.validate_python(rows, from_attributes=True))
+
+def serialize_encoder(rows) -> bytes:
+    # FastAPI without a response_model, rendered by JSONResponse
+    return json.dumps(jsonable_encoder(rows), ensure_ascii=False, separators=(",", ":")).encode()
+
+def stdlib_dumps(rows) -> bytes:
+    orjson, responses.orjson = responses.orjson, None
+    try:
+        return responses.dumps(rows)
+    finally:
+        responses.orjson = orjson
+
+def rate(fn, rows: int, repeat: int) -> dict:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    best = min(samples)
+    return {"ms": round(best * 1000, 3), "rows_per_sec": round(rows / best)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--rows", type=int, default=1000, help="rows per response")
+    parser.add_argument("--table-rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        user_ids = seed_users(conn, 10)
+        seed_activity_logs(conn, user_ids, args.table_rows, days=7)
+    end = datetime.now(UTC)
+    start = end - timedelta(days=7)
+    user_id = user_ids[0]
+    with session_factory() as db:
+        matching = db.scalar(select(func.count()).where(models.ActivityLog.user_id == user_id))
+    limit = min(args.rows, matching)
+
+    def load_and_serialize(load, serialize):
+        with session_factory() as db:
+            return serialize(load(db))
+
+    def timed(load, serialize, count):
+        # Serializing what `load` returned, then loading and serializing
+        with session_factory() as db:
+            loaded = load(db)
+        return {
+            "serialize": rate(lambda: serialize(loaded), count, args.repeat),
+            "end_to_end": rate(lambda: load_and_serialize(load, serialize), count, args.repeat),
+        }
+
+    page = {
+        "before": timed(lambda db: page_before(db, args.rows), serialize_page, args.rows),
+        "after": timed(
+            lambda db: activity.get_all_activities(db, args.rows), serialize_page, args.rows
+        ),
+    }
+    dicts = {
+        "before": timed(
+            lambda db: dicts_before(db, user_id, start, end, limit), serialize_encoder, limit
+        ),
+        "after": timed(
+            lambda db: activity.get_user_activities_by_time_range(db, user_id, start, end, limit),
+            responses.dumps, limit,
+        ),
+        "after_stdlib_json": timed(
+            lambda db: activity.get_user_activities_by_time_range(db, user_id, start, end, limit),
+            stdlib_dumps, limit,
+        ),
+    }
+
+    with session_factory() as db:
+        body = serialize_page(activity.get_all_activities(db, args.rows))
+    started = time.perf_counter()
+    compressed = gzip.compress(body, 6)
+    gzip_ms = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({
+        "rows": args.rows,
+        "orjson": responses.orjson is not None,
+        "page": page,
+        "dicts": {"rows": limit, **dicts},
+        "gzip_page": {
+            "bytes": len(body),
+            "gzip_bytes": len(compressed),
+            "gzip_ms": round(gzip_ms, 3),
+        },
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Database load of open dashboards: refetching /admin/dashboard/stats,
+/admin/analytics/activities and /staff/activity/summary every 30 seconds
+against the live analytics channel (app/live_analytics.py).
+
+Polling: one refresh (the three endpoints' service calls) is timed and its
+statements counted, then scaled to --dashboards dashboards refreshing every
+--poll-interval seconds. Live: --dashboards sockets (in-process stand-ins)
+of one tenant subscribe to `analytics`; the first subscription counts the
+tenant's buckets, the rest are served from memory. --events activities are
+then written with insert_activities in batches of --batch, and the script
+reports the statements run while deltas flow (the writes themselves
+excluded), the commit-to-delivery latency of each delta at every socket,
+and whether the live buckets still match a recount.
+
+    python -m benchmarks.live_analytics --rows 1000000 --dashboards 500
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app import activity, admin
+from app.database import Base
+from app.live_analytics import analytics
+from app.websocket import ANALYTICS, ConnectionManager
+from .common import DEFAULT_URL, make_engine, seed_users, seed_activity_logs
+from .websocket_fanout import Countdown, FakeWebSocket, percentiles
+
+TENANT = "bench.example.com"
+
+class StatementCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._executed)
+
+    def _executed(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def refresh(session_factory, user_id: int):
+    # What one dashboard refresh asked of the database
+    db = session_factory()
+    try:
+        admin.get_system_statistics(db)
+        admin.get_activity_analytics(db, 30)
+        end = datetime.now(UTC)
+        activity.count_activities_by_action(db, end - timedelta(days=7), end, user_id=user_id)
+        activity.get_user_activities_by_time_range(db, user_id, end - timedelta(days=7), end, limit=10)
+    finally:
+        db.close()
+
+def polling(session_factory, statements: StatementCounter, user_id: int, dashboards: int, interval: float):
+    refresh(session_factory, user_id)
+    samples = []
+    before = statements.count
+    for _ in range(5):
+        started = time.perf_counter()
+        refresh(session_factory, user_id)
+        samples.append((time.perf_counter() - started) * 1000)
+    per_refresh = (statements.count - before) / 5
+    refresh_ms = sorted(samples)[2]
+    return {
+        "refresh_ms": round(refresh_ms, 2),
+        "statements_per_refresh": per_refresh,
+        "statements_per_minute": round(dashboards * per_refresh * 60 / interval),
+        "db_seconds_per_minute": round(dashboards * refresh_ms / 1000 * 60 / interval, 2),
+    }
+
+async def live(session_factory, statements: StatementCounter, user_ids, dashboards: int, events: int, batch: int):
+    manager = ConnectionManager(queue_size=1024)
+    # The module's instance is the one the session hooks feed
+    analytics.session_factory = session_factory
+    analytics.flush_interval = 0.05
+    analytics.resync_interval = 0
+
+    async def publish(tenant, frame):
+        await manager.broadcast(frame, ANALYTICS, tenant)
+    analytics.publish = publish
+    manager.add_listener(ANALYTICS, analytics.apply)
+    analytics.start()
+
+    countdown = Countdown()
+    sockets = []
+    before = statements.count
+    started = time.perf_counter()
+    for _ in range(dashboards):
+        websocket = FakeWebSocket(0, countdown)
+        manager.register(websocket, "admin", TENANT, [])
+        snapshot = await analytics.snapshot(TENANT)
+        manager.subscribe(websocket, [ANALYTICS])
+        await manager.send_personal_message(snapshot, websocket)
+        sockets.append(websocket)
+    countdown.reset(dashboards)
+    await asyncio.wait_for(countdown.done.wait(), 30)
+    connect_ms = (time.perf_counter() - started) * 1000
+    connect_statements = statements.count - before
+
+    latencies = []
+    steady = 0
+    for offset in range(0, events, batch):
+        rows = [
+            {"user_id": user_ids[(offset + i) % len(user_ids)], "action": "failed_login",
+             "details": None, "timestamp": datetime.now(UTC)}
+            for i in range(min(batch, events - offset))
+        ]
+        for websocket in sockets:
+            websocket.received_at.clear()
+        countdown.reset(dashboards)
+        db = session_factory()
+        try:
+            before = statements.count
+            activity.insert_activities(db, rows)
+            writes = statements.count - before
+        finally:
+            db.close()
+        committed = time.perf_counter()
+        before = statements.count
+        await asyncio.wait_for(countdown.done.wait(), 30)
+        # Anything beyond the write: tenant lookups of unseen users
+        steady += statements.count - before
+        latencies.extend((websocket.received_at[0] - committed) * 1000 for websocket in sockets)
+
+    await analytics.stop()
+    snapshot = json.loads(await analytics.snapshot(TENANT))
+    recount = analytics._load(TENANT)
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    return {
+        "connect_all_ms": round(connect_ms, 2),
+        "statements_to_connect_all": connect_statements,
+        "write_statements_per_batch": writes,
+        "statements_while_streaming": steady,
+        "delta_delivery": percentiles(latencies),
+        "deltas_published": analytics.stats["deltas"],
+        "matches_recount": snapshot["buckets"] == {k: dict(v) for k, v in recount.counts.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dashboards", type=int, default=500)
+    parser.add_argument("--poll-interval", type=float, default=30.0)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=100, help="activities per insert_activities call")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        user_ids = seed_users(conn, 1000, domain=TENANT)
+        seed_activity_logs(conn, user_ids, args.rows, days=30)
+    statements = StatementCounter(engine)
+
+    print(json.dumps({
+        "rows": args.rows,
+        "dashboards": args.dashboards,
+        "polling": polling(session_factory, statements, user_ids[0], args.dashboards, args.poll_interval),
+        "live": asyncio.run(live(session_factory, statements, user_ids, args.dashboards, args.events, args.batch)),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+End-to-end load scenarios against the FastAPI app over real HTTP and
+WebSocket connections, on a database seeded by benchmarks.seed.
+
+Scenarios (--scenarios, all by default), each run for --duration seconds:
+
+- login_storm: --login-clients clients POST /token back to back with
+  seeded accounts (bcrypt bound; 503s are logins the hashing pool shed);
+- dashboard_polling: --dashboards admin and staff dashboards refreshing
+  all their widgets at once every --poll-interval seconds;
+- analytics_windows: --clients admins asking for summaries and analytics
+  over 1 to 90 day windows, and streaming 1 hour and 1 day exports;
+- ingest_burst: --ingest-clients users posting /activity/log/batch with
+  --batch events back to back (one in four posts single /activity/log);
+- websocket_fanout: --sockets staff dashboards of the largest tenant
+  connect to /ws/staff, then the tenant's admin sends --messages
+  notifications; reports connect latency and the send-to-receive latency
+  at every socket.
+
+Unless --server points at a running one, the app is started with uvicorn
+(--workers processes) on a free local port against --url. The driver
+reads accounts from --url and signs tokens with the app's SECRET_KEY, so a
+--server must use the same database and key.
+
+Output is JSON (stdout, or --output): per scenario and endpoint the
+request count, status codes, throughput and p50/p95/p99/max latency.
+--baseline with a previous output adds the change of p95 and throughput
+per endpoint, to compare branches:
+
+    python -m benchmarks.seed --users 1000000 --activities 5000000
+    git checkout main && python -m benchmarks.load --output main.json
+    git checkout my-branch && python -m benchmarks.load --baseline main.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Optional
+
+import httpx
+from websockets.asyncio.client import connect as ws_connect
+
+# Modules importing the app (common, websocket_fanout) are imported once
+# main() has pointed DATABASE_URL at --url
+from .seed import DEFAULT_URL, PASSWORD, tenant_domain
+
+SCENARIOS = ("login_storm", "dashboard_polling", "analytics_windows", "ingest_burst", "websocket_fanout")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Widgets each dashboard refreshes (admin.js and the staff dashboard)
+ADMIN_DASHBOARD = (
+    "/admin/dashboard/stats",
+    "/admin/analytics/activities?days=30",
+    "/admin/security/alerts",
+    "/admin/activities?limit=100",
+)
+STAFF_DASHBOARD = (
+    "/staff/activity/summary",
+    "/staff/performance/metrics",
+    "/staff/department/stats",
+    "/staff/activities/recent",
+)
+WINDOW_DAYS = (1, 7, 30, 90)
+
+class Recorder:
+    """
+    Latency samples and status codes per endpoint of one scenario
+    """
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.started = time.perf_counter()
+
+    def add(self, endpoint: str, status, elapsed_ms: float):
+        self.latencies[endpoint].append(elapsed_ms)
+        self.statuses[endpoint][status] += 1
+
+    async def request(self, client: httpx.AsyncClient, method: str, path: str, endpoint: Optional[str] = None, **kwargs):
+        """
+        Send a request and record it under `endpoint` (by default the
+        method and path). Returns the response, or None on a transport error.
+        """
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as exc:
+            response, status = None, type(exc).__name__
+        self.add(endpoint or f"{method} {path}", status, (time.perf_counter() - started) * 1000)
+        return response
+
+    def report(self, **extra) -> Dict:
+        from .websocket_fanout import percentiles
+
+        elapsed = time.perf_counter() - self.started
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400),
+                "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                **percentiles(samples),
+            }
+        requests = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "duration_s": round(elapsed, 2),
+            "requests": requests,
+            "throughput_rps": round(requests / elapsed, 2),
+            "endpoints": endpoints,
+            **extra,
+        }
+
+class Accounts:
+    """
+    Seeded accounts read from the database, with tokens signed locally
+    """
+    def __init__(self, engine, sample: int, fanout_sockets: int):
+        from sqlalchemy import func, select
+        from app import auth, models
+
+        User = models.User
+        seeded = User.username.like("load\\_%", escape="\\")
+
+        def pick(role: str, *where, limit: int = sample):
+            # Every n-th account, so the sample spans the tenants
+            with engine.connect() as conn:
+                total = conn.scalar(select(func.count()).where(seeded, User.role == role, User.is_active == True, *where))
+                step = max(1, (total or 0) // max(limit, 1))
+                return conn.execute(
+                    select(User.id, User.email, User.organisation_domain)
+                    .where(seeded, User.role == role, User.is_active == True, User.id % step == 0, *where)
+                    .order_by(User.id).limit(limit)
+                ).all()
+
+        self.admins = pick("admin")
+        self.staff = pick("staff")
+        self.users = pick("user")
+        if not (self.admins and self.staff and self.users):
+            raise SystemExit("No seeded accounts found; run python -m benchmarks.seed against the same --url")
+        # The largest tenant, whose staff dashboards the fan-out connects
+        self.fanout_tenant = tenant_domain(0)
+        self.fanout_admin = pick("admin", User.organisation_domain == self.fanout_tenant, limit=1)[0]
+        self.fanout_staff = pick("staff", User.organisation_domain == self.fanout_tenant, limit=fanout_sockets)
+        self.users_by_tenant: Dict[str, List] = defaultdict(list)
+        for user in self.users:
+            self.users_by_tenant[user.organisation_domain].append(user)
+        self._tokens: Dict[str, str] = {}
+        self._create_token = auth.create_access_token
+
+    def token(self, account) -> str:
+        if account.email not in self._tokens:
+            self._tokens[account.email] = self._create_token({"sub": account.email}, timedelta(hours=12))
+        return self._tokens[account.email]
+
+    def headers(self, account) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token(account)}"}
+
+async def login_storm(base_url: str, accounts: Accounts, args) -> Dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    async def client_loop(client):
+        while time.perf_counter() < deadline:
+            account = random.choice(accounts.users)
+            await recorder.request(client, "POST", "/token", data={"username": account.email, "password": args.password})
+
+    async with _client(base_url, args) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(args.login_clients)))
+    return recorder.report()
+
+async def dashboard_polling(base_url: str, accounts: Accounts, args) -> Dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    async def dashboard(client, account, paths):
+        # Dashboards opened at different moments refresh out of phase
+        await asyncio.sleep(random.random() * args.poll_interval)
+        headers = accounts.headers(account)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.gather(*(recorder.request(client, "GET", path, headers=headers) for path in paths))
+            await asyncio.sleep(max(0.0, args.poll_interval - (time.perf_counter() - started)))
+
+    dashboards = []
+    for index in range(args.dashboards):
+        if index % 2 == 0:
+            dashboards.append((accounts.admins[index // 2 % len(accounts.admins)], ADMIN_DASHBOARD))
+        else:
+            dashboards.append((accounts.staff[index // 2 % len(accounts.staff)], STAFF_DASHBOARD))
+    async with _client(base_url, args) as client:
+        await asyncio.gather(*(dashboard(client, account, paths) for account, paths in dashboards))
+    return recorder.report(dashboards=args.dashboards, poll_interval_s=args.poll_interval)
+
+async def analytics_windows(base_url: str, accounts: Accounts, args) -> Dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def requests_for(admin):
+        now = datetime.now(UTC)
+        requests = []
+        for days in WINDOW_DAYS:
+            requests.append((f"/activity/summary?days={days}", None))
+            requests.append((f"/admin/analytics/activities?days={days}", None))
+        users = accounts.users_by_tenant.get(admin.organisation_domain)
+        if users:
+            user = random.choice(users)
+            requests.append((f"/admin/users/{user.id}/activity?days=30", "GET /admin/users/{id}/activity?days=30"))
+        for label, span in (("1h", timedelta(hours=1)), ("1d", timedelta(days=1))):
+            window = f"start_date={(now - span).isoformat()}&end_date={now.isoformat()}".replace("+", "%2B")
+            requests.append((f"/activity/time-range?{window}", f"GET /activity/time-range ({label})"))
+            requests.append((f"/activity/export?format=ndjson&{window}", f"GET /activity/export ndjson ({label})"))
+        return requests
+
+    async def client_loop(client, admin):
+        headers = accounts.headers(admin)
+        while time.perf_counter() < deadline:
+            path, endpoint = random.choice(requests_for(admin))
+            await recorder.request(client, "GET", path, endpoint, headers=headers)
+
+    async with _client(base_url, args) as client:
+        await asyncio.gather(*(
+            client_loop(client, accounts.admins[index % len(accounts.admins)]) for index in range(args.clients)
+        ))
+    return recorder.report()
+
+async def ingest_burst(base_url: str, accounts: Accounts, args) -> Dict:
+    from .common import ACTION_WEIGHTS
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    actions = list(ACTION_WEIGHTS)
+    weights = list(ACTION_WEIGHTS.values())
+    accepted = [0]
+
+    async def client_loop(client, account, single: bool):
+        headers = accounts.headers(account)
+        while time.perf_counter() < deadline:
+            picked = random.choices(actions, weights=weights, k=1 if single else args.batch)
+            if single:
+                response = await recorder.request(
+                    client, "POST", "/activity/log", headers=headers,
+                    json={"user_id": account.id, "action": picked[0], "details": "load test"},
+                )
+                accepted[0] += response is not None and response.status_code == 200
+            else:
+                response = await recorder.request(
+                    client, "POST", "/activity/log/batch", f"POST /activity/log/batch ({args.batch} events)",
+                    headers=headers,
+                    json={"events": [{"user_id": account.id, "action": action, "details": "load test"} for action in picked]},
+                )
+                if response is not None and response.status_code == 200:
+                    accepted[0] += response.json()["accepted"]
+
+    async with _client(base_url, args) as client:
+        await asyncio.gather(*(
+            client_loop(client, accounts.users[index % len(accounts.users)], single=index % 4 == 0)
+            for index in range(args.ingest_clients)
+        ))
+    report = recorder.report()
+    report["events_accepted"] = accepted[0]
+    report["events_per_sec"] = round(accepted[0] / report["duration_s"], 1)
+    return report
+
+async def websocket_fanout(base_url: str, accounts: Accounts, args) -> Dict:
+    recorder = Recorder()
+    ws_url = base_url.replace("http", "ws", 1)
+    staff = accounts.fanout_staff
+    if not staff:
+        raise SystemExit(f"No staff in {accounts.fanout_tenant} to connect")
+    sent: Dict[int, float] = {}
+    received = [0]
+    all_received = asyncio.Event()
+    expected = args.sockets * args.messages
+    connecting = asyncio.Semaphore(100)
+
+    async def open_socket(client_type: str, account, endpoint: str):
+        async with connecting:
+            started = time.perf_counter()
+            websocket = await ws_connect(
+                f"{ws_url}/ws/{client_type}?topics=notifications&token={accounts.token(account)}", max_queue=None
+            )
+            # The server confirms the subscriptions once the socket is registered
+            json.loads(await websocket.recv())
+            recorder.add(endpoint, 101, (time.perf_counter() - started) * 1000)
+            return websocket
+
+    async def receive(websocket):
+        async for raw in websocket:
+            message = json.loads(raw)
+            if message.get("type") == "notification" and "load_id" in message:
+                recorder.add("WS notification fan-out", 200, (time.perf_counter() - sent[message["load_id"]]) * 1000)
+                received[0] += 1
+                if received[0] == expected:
+                    all_received.set()
+
+    sockets = await asyncio.gather(*(
+        open_socket("staff", staff[index % len(staff)], "WS connect /ws/staff") for index in range(args.sockets)
+    ))
+    admin = await open_socket("admin", accounts.fanout_admin, "WS connect /ws/admin")
+    receivers = [asyncio.create_task(receive(websocket)) for websocket in sockets]
+    started = time.perf_counter()
+    for load_id in range(args.messages):
+        sent[load_id] = time.perf_counter()
+        await admin.send(json.dumps({"type": "notification", "target": "staff", "message": "load test", "load_id": load_id}))
+        await asyncio.sleep(args.message_interval)
+    try:
+        await asyncio.wait_for(all_received.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*(websocket.close() for websocket in [*sockets, admin]), return_exceptions=True)
+    return recorder.report(
+        tenant=accounts.fanout_tenant,
+        sockets=args.sockets,
+        deliveries_expected=expected,
+        deliveries=received[0],
+        deliveries_per_sec=round(received[0] / elapsed, 1),
+    )
+
+def _client(base_url: str, args) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url, timeout=args.timeout, limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    )
+
+def start_server(url: str, workers: int) -> (subprocess.Popen, str):
+    """
+    Start the app with uvicorn on a free port; returns the process and base URL
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, "DATABASE_URL": url},
+        # Keep stdout for the report
+        stdout=sys.stderr,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while True:
+        if process.poll() is not None:
+            raise SystemExit(f"The server exited with status {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            process.kill()
+            raise SystemExit("The server did not start within 120s")
+        time.sleep(0.5)
+
+def stop_server(process: subprocess.Popen):
+    # SIGTERM lets uvicorn run the app's shutdown (flushing queued writes)
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def compare(report: Dict, baseline: Dict) -> Dict:
+    """
+    p95 latency and throughput per endpoint against a previous report
+    """
+    changes = {}
+    for scenario, result in report["scenarios"].items():
+        before_endpoints = baseline.get("scenarios", {}).get(scenario, {}).get("endpoints", {})
+        for endpoint, stats in result["endpoints"].items():
+            before = before_endpoints.get(endpoint)
+            if before is None:
+                continue
+            changes.setdefault(scenario, {})[endpoint] = {
+                "p95_ms": [before["p95_ms"], stats["p95_ms"]],
+                "p95_change_pct": _change(before["p95_ms"], stats["p95_ms"]),
+                "throughput_rps": [before["throughput_rps"], stats["throughput_rps"]],
+                "throughput_change_pct": _change(before["throughput_rps"], stats["throughput_rps"]),
+            }
+    return changes
+
+def _change(before: float, after: float) -> Optional[float]:
+    return round((after - before) / before * 100, 1) if before else None
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL, help="database seeded by benchmarks.seed")
+    parser.add_argument("--server", help="base URL of a running server (default: start one)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds per request")
+    parser.add_argument("--password", default=PASSWORD, help="password of the seeded accounts")
+    parser.add_argument("--accounts", type=int, default=1000, help="seeded accounts sampled per role")
+    parser.add_argument("--login-clients", type=int, default=50)
+    parser.add_argument("--dashboards", type=int, default=200)
+    parser.add_argument("--poll-interval", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=10, help="analytics_windows clients")
+    parser.add_argument("--ingest-clients", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=200, help="events per /activity/log/batch request")
+    parser.add_argument("--sockets", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--message-interval", type=float, default=0.1)
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    parser.add_argument("--baseline", help="a previous report to compare with")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # The app's engines are created from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = args.url
+    from app import database
+
+    accounts = Accounts(database.engine, args.accounts, args.sockets)
+    process, base_url = (None, args.server.rstrip("/")) if args.server else start_server(args.url, args.workers)
+    report = {
+        "meta": {
+            "started_at": datetime.now(UTC).isoformat(),
+            "git_revision": _git_revision(),
+            "database": database.engine.url.render_as_string(hide_password=True),
+            "dialect": database.engine.dialect.name,
+            "server": args.server or f"uvicorn, {args.workers} worker(s)",
+            "python": sys.version.split()[0],
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "password")},
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            report["scenarios"][name] = asyncio.run(globals()[name](base_url, accounts, args))
+    finally:
+        if process is not None:
+            stop_server(process)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["comparison"] = compare(report, json.load(baseline))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Local stand-in for a Redis pub/sub server: the RESP commands the WebSocket
+backplane uses (SUBSCRIBE, UNSUBSCRIBE, PUBLISH, PING, AUTH), with Redis's
+replies. Lets WS_BACKPLANE=redis be exercised without a Redis install:
+
+    python -m benchmarks.pubsub_server --port 6399
+    WS_BACKPLANE=redis WS_BACKPLANE_URL=redis://localhost:6399 uvicorn app.main:app --workers 4
+"""
+import argparse
+import asyncio
+from typing import Dict, Set
+
+from app.backplane import _read_reply
+
+def _integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+def _push(*items) -> bytes:
+    # Subscription replies mix bulk strings and an integer
+    parts = [b"*%d\r\n" % len(items)]
+    for item in items:
+        parts.append(_integer(item) if isinstance(item, int) else b"$%d\r\n%s\r\n" % (len(item), item))
+    return b"".join(parts)
+
+class PubSubServer:
+    def __init__(self):
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = {}
+        self.published = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[bytes] = set()
+        try:
+            while True:
+                command = await _read_reply(reader)
+                name = command[0].upper()
+                if name == b"PUBLISH":
+                    channel, data = command[1], command[2]
+                    receivers = list(self.channels.get(channel, ()))
+                    message = _push(b"message", channel, data)
+                    for receiver in receivers:
+                        receiver.write(message)
+                    self.published += 1
+                    writer.write(_integer(len(receivers)))
+                elif name in (b"SUBSCRIBE", b"UNSUBSCRIBE"):
+                    for channel in command[1:]:
+                        if name == b"SUBSCRIBE":
+                            subscribed.add(channel)
+                            self.channels.setdefault(channel, set()).add(writer)
+                        else:
+                            subscribed.discard(channel)
+                            self.channels.get(channel, set()).discard(writer)
+                        writer.write(_push(name.lower(), channel, len(subscribed)))
+                elif name in (b"PING", b"AUTH"):
+                    writer.write(b"+PONG\r\n" if name == b"PING" else b"+OK\r\n")
+                else:
+                    writer.write(b"-ERR unknown command '%s'\r\n" % name)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+async def start_server(host: str = "127.0.0.1", port: int = 0):
+    """
+    Start a stand-in server; returns (PubSubServer, asyncio.Server). Port 0
+    picks a free port, see server.sockets[0].getsockname().
+    """
+    pubsub = PubSubServer()
+    server = await asyncio.start_server(pubsub.handle, host, port)
+    return pubsub, server
+
+async def serve(host: str, port: int):
+    _, server = await start_server(host, port)
+    print(f"Pub/sub stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+if __name__ == "__main__":
+    main()
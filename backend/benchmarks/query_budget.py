@@ -0,0 +1,130 @@
+"""
+SQL statement budget per endpoint, to catch N+1 queries before they reach
+production latency.
+
+Builds a fresh SQLite database with the default users (init_db), calls
+every listed GET endpoint through the FastAPI app and counts the
+statements each request runs (sync and async engine). Then it adds ten
+times more staff colleagues and activity rows and calls them again. It
+fails (exit status 1) when an endpoint runs more statements than its
+budget, or more statements than before the growth: a count that grows
+with the number of rows is an N+1.
+
+Counts are taken after one warm-up call per endpoint, so they are those
+of steady state (the authenticated principal and the rollup watermarks
+are cached).
+
+    python -m benchmarks.query_budget
+"""
+import argparse
+import json
+import os
+import sys
+
+DEFAULT_URL = "sqlite:////tmp/digital_twin_query_budget.db"
+
+# (client, path, maximum statements); client is admin, staff or user
+BUDGETS = [
+    ("admin", "/admin/dashboard/stats", 1),
+    ("admin", "/admin/users", 1),
+    ("admin", "/admin/users/3", 1),
+    ("admin", "/admin/users/3/activity", 3),
+    ("admin", "/admin/analytics/activities", 2),
+    ("admin", "/admin/activities", 1),
+    ("admin", "/admin/activities/suspicious", 1),
+    ("admin", "/admin/activities/time-range?start_date=2000-01-01&end_date=2100-01-01", 1),
+    ("admin", "/admin/security/alerts", 1),
+    ("admin", "/activity/all", 1),
+    ("admin", "/activity/user/3", 1),
+    ("admin", "/activity/suspicious", 1),
+    ("admin", "/activity/by-action?action=login", 1),
+    ("admin", "/activity/recent", 1),
+    ("admin", "/activity/summary", 2),
+    ("staff", "/staff/profile", 1),
+    ("staff", "/staff/colleagues", 2),
+    ("staff", "/staff/department/stats", 1),
+    ("staff", "/staff/department/activities", 2),
+    ("staff", "/staff/activity/summary", 3),
+    ("staff", "/staff/performance/metrics", 4),
+    ("staff", "/staff/activities", 1),
+    ("staff", "/staff/activities/recent", 1),
+    ("user", "/activity/user/3", 1),
+]
+
+CREDENTIALS = {
+    "admin": ("admin@digitaltwin.com", "admin123"),
+    "staff": ("staff1@digitaltwin.com", "staff123"),
+    "user": ("user1@digitaltwin.com", "user123"),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL, help="a SQLite URL; the file is recreated")
+    parser.add_argument("--colleagues", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    # The app's engines are created from DATABASE_URL at import
+    path = args.url.split("sqlite:///", 1)[-1]
+    if os.path.exists(path):
+        os.remove(path)
+    os.environ["DATABASE_URL"] = args.url
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from app import database, init_db, models
+    from app.main import app
+    from .common import seed_users, seed_activity_logs
+
+    def grow(colleagues: int, rows: int):
+        with database.engine.begin() as conn:
+            user_ids = seed_users(conn, colleagues, domain="digitaltwin.com")
+            conn.execute(models.Staff.__table__.insert(), [
+                {"user_id": user_id, "department": "IT"} for user_id in user_ids
+            ])
+            # The default user and staff member get a share of the rows too
+            seed_activity_logs(conn, [2, 3] + user_ids, rows, days=7)
+
+    init_db.init()
+    grow(args.colleagues, args.rows)
+
+    statements = [0]
+    def count(*_):
+        statements[0] += 1
+    event.listen(database.engine, "before_cursor_execute", count)
+    event.listen(database.get_async_engine().sync_engine, "before_cursor_execute", count)
+
+    # Not entered as a context manager: the background workers stay off
+    client = TestClient(app)
+    headers = {}
+    for name, (email, password) in CREDENTIALS.items():
+        response = client.post("/token", data={"username": email, "password": password})
+        headers[name] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def measure():
+        counts = {}
+        for name, path, _ in BUDGETS:
+            client.get(path, headers=headers[name])
+            statements[0] = 0
+            response = client.get(path, headers=headers[name])
+            if response.status_code != 200:
+                raise SystemExit(f"{name} {path}: {response.status_code} {response.text}")
+            counts[(name, path)] = statements[0]
+        return counts
+
+    before = measure()
+    grow(args.colleagues * 9, args.rows * 9)
+    after = measure()
+
+    report, failures = [], []
+    for name, path, budget in BUDGETS:
+        key = (name, path)
+        report.append({"client": name, "path": path, "budget": budget, "statements": before[key], "after_growth": after[key]})
+        if max(before[key], after[key]) > budget:
+            failures.append(f"{name} {path}: {max(before[key], after[key])} statements, budget {budget}")
+        elif after[key] > before[key]:
+            failures.append(f"{name} {path}: {before[key]} statements, {after[key]} with 10x the rows")
+    print(json.dumps({"endpoints": report, "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Bulk seeder for load tests (benchmarks/load.py): what init_db.init does
+(tables, migrations, rules, counters and the three default users), then
+--users accounts over --tenants organisations and --activities activity
+rows, with the skew of a real deployment:
+
+- organisation sizes follow a Zipf law: a few large tenants, a long tail;
+- each organisation has one admin (admins are unique per domain), about
+  --staff-share staff members over weighted departments and plain users
+  for the rest; 3% of accounts are inactive and sign-ups grow towards today;
+- a minority of users produce most activity (Pareto), timestamps follow
+  office hours and weekdays over the last --days days and actions follow
+  common.ACTION_WEIGHTS, classified by the activity rules.
+
+Every seeded account's password is --password, hashed once with the app's
+PASSWORD_HASH_ROUNDS (run the server with the same setting, or each login
+rehashes). Rows are written with multi-row INSERTs in chunks, bypassing
+the ORM hooks, so the dashboard counters are rebuilt and the rollups
+compacted at the end, as the server would otherwise do under load.
+
+--mysql-container starts (or reuses) a local MySQL 8 container with
+docker and seeds it instead of --url.
+
+    python -m benchmarks.seed --url sqlite:////tmp/digital_twin_perf.db --users 1000000 --activities 5000000
+    python -m benchmarks.seed --mysql-container dt-perf-mysql --users 1000000 --activities 5000000
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta, UTC
+
+DEFAULT_URL = "sqlite:////tmp/digital_twin_perf.db"
+PASSWORD = "loadtest123"
+MYSQL_IMAGE = "mysql:8.0"
+MYSQL_PORT = 3307
+
+DEPARTMENT_WEIGHTS = {
+    "IT": 25,
+    "Sales": 20,
+    "Support": 20,
+    "Operations": 15,
+    "Finance": 10,
+    "HR": 5,
+    "Legal": 5,
+}
+# Relative activity per hour of day (UTC) and per weekday (Monday first)
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 14, 16, 16, 15, 12, 15, 16, 15, 13, 10, 7, 5, 4, 3, 2, 1]
+WEEKDAY_WEIGHTS = [10, 10, 10, 10, 9, 3, 2]
+
+CHUNK_SIZE = 20_000
+
+def tenant_domain(index: int) -> str:
+    return f"org{index}.example.com"
+
+def tenant_sizes(users: int, tenants: int, exponent: float = 1.1):
+    """
+    Split `users` over `tenants` organisations by a Zipf law, at least one
+    user (the admin) each
+    """
+    tenants = max(1, min(tenants, users))
+    weights = [1 / (rank ** exponent) for rank in range(1, tenants + 1)]
+    total = sum(weights)
+    sizes = [max(1, int(users * weight / total)) for weight in weights]
+    # Rounding leftovers go to the largest tenant
+    sizes[0] += users - sum(sizes)
+    return sizes
+
+def seed_users(engine, tenants: int, users: int, staff_share: float, hashed_password: str, rng: random.Random):
+    """
+    Insert users, their staff and admin records, a transaction per chunk.
+    Returns the new user ids.
+    """
+    from sqlalchemy import text
+    from app import models
+
+    with engine.connect() as conn:
+        start_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM users")).scalar() + 1
+    now = datetime.now(UTC)
+    departments = list(DEPARTMENT_WEIGHTS)
+    department_weights = list(DEPARTMENT_WEIGHTS.values())
+    users_rows, staff_rows, admin_rows = [], [], []
+    user_id = start_id
+
+    def flush(final: bool = False):
+        if len(users_rows) < CHUNK_SIZE and not (final and users_rows):
+            return
+        with engine.begin() as conn:
+            conn.execute(models.User.__table__.insert(), users_rows)
+            if staff_rows:
+                conn.execute(models.Staff.__table__.insert(), staff_rows)
+            if admin_rows:
+                conn.execute(models.Admin.__table__.insert(), admin_rows)
+        users_rows.clear()
+        staff_rows.clear()
+        admin_rows.clear()
+
+    for tenant, size in enumerate(tenant_sizes(users, tenants)):
+        domain = tenant_domain(tenant)
+        staff_count = round((size - 1) * staff_share)
+        for position in range(size):
+            role = "admin" if position == 0 else "staff" if position <= staff_count else "user"
+            users_rows.append({
+                "id": user_id,
+                "username": f"load_{user_id}",
+                "email": f"load_{user_id}@{domain}",
+                "hashed_password": hashed_password,
+                "is_active": role != "user" or rng.random() >= 0.03,
+                "role": role,
+                # Sign-ups over two years, more of them recently
+                "created_at": now - timedelta(days=730 * rng.random() ** 2),
+                "organisation_domain": domain,
+            })
+            if role == "staff":
+                staff_rows.append({
+                    "user_id": user_id,
+                    "department": rng.choices(departments, weights=department_weights)[0],
+                })
+            elif role == "admin":
+                admin_rows.append({"user_id": user_id, "privileges": "full_access", "organisation_domain": domain})
+            user_id += 1
+            flush()
+    flush(final=True)
+    return list(range(start_id, user_id))
+
+def seed_activities(engine, user_ids, count: int, days: int, rng: random.Random):
+    """
+    Insert `count` activity rows of `user_ids` over the last `days` days, a
+    transaction per chunk
+    """
+    from app import models, rules
+    from .common import ACTION_WEIGHTS
+
+    actions = list(ACTION_WEIGHTS)
+    action_weights = list(ACTION_WEIGHTS.values())
+    fields = {action: rules.registry.fields(action) for action in actions}
+    # Pareto activity per user: cumulative weights for rng.choices
+    cum_user_weights = list(itertools.accumulate(rng.paretovariate(1.5) for _ in user_ids))
+    now = datetime.now(UTC)
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_starts = [today - timedelta(days=offset) for offset in range(days)]
+    day_weights = [WEEKDAY_WEIGHTS[day.weekday()] for day in day_starts]
+    table = models.ActivityLog.__table__
+
+    inserted = 0
+    while inserted < count:
+        size = min(CHUNK_SIZE, count - inserted)
+        picked_users = rng.choices(user_ids, cum_weights=cum_user_weights, k=size)
+        picked_actions = rng.choices(actions, weights=action_weights, k=size)
+        picked_days = rng.choices(day_starts, weights=day_weights, k=size)
+        picked_hours = rng.choices(range(24), weights=HOUR_WEIGHTS, k=size)
+        rows = []
+        for user_id, action, day, hour in zip(picked_users, picked_actions, picked_days, picked_hours):
+            timestamp = day + timedelta(hours=hour, seconds=rng.random() * 3600)
+            if timestamp > now:
+                # Later today: the same time yesterday
+                timestamp -= timedelta(days=1)
+            rows.append({
+                "user_id": user_id,
+                "action": action,
+                "timestamp": timestamp,
+                "details": f"document_{rng.randrange(10_000)}.pdf" if action.startswith("file") else None,
+                **fields[action],
+            })
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        inserted += size
+
+def start_mysql_container(name: str, port: int = MYSQL_PORT, timeout: float = 120.0) -> str:
+    """
+    Start a MySQL 8 container called `name` (or reuse it) and return its URL
+    once it accepts connections
+    """
+    from sqlalchemy import create_engine, text
+
+    running = subprocess.run(
+        ["docker", "ps", "-aq", "--filter", f"name=^{name}$"], capture_output=True, text=True, check=True
+    ).stdout.strip()
+    if running:
+        subprocess.run(["docker", "start", name], capture_output=True, check=True)
+    else:
+        subprocess.run([
+            "docker", "run", "-d", "--name", name,
+            "-e", "MYSQL_ALLOW_EMPTY_PASSWORD=yes", "-e", "MYSQL_DATABASE=digital_twin",
+            "-p", f"127.0.0.1:{port}:3306", MYSQL_IMAGE,
+        ], capture_output=True, check=True)
+    url = f"mysql+pymysql://root:@127.0.0.1:{port}/digital_twin"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with create_engine(url).connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return url
+        except Exception:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"MySQL in container {name} did not come up within {timeout:.0f}s")
+            time.sleep(2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--mysql-container", metavar="NAME", help="seed a local MySQL container instead of --url")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--tenants", type=int, default=200)
+    parser.add_argument("--staff-share", type=float, default=0.08)
+    parser.add_argument("--activities", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    url = start_mysql_container(args.mysql_container) if args.mysql_container else args.url
+    # The app's engines are created from DATABASE_URL at import
+    os.environ["DATABASE_URL"] = url
+    from sqlalchemy import event, select
+    from app import auth, counters, database, init_db, models, rollups
+
+    if database.engine.dialect.name == "sqlite":
+        @event.listens_for(database.engine, "connect")
+        def _fast_sqlite(dbapi_connection, _):
+            # Seeding only: a crash loses the database, not just the last commit
+            dbapi_connection.execute("PRAGMA synchronous=OFF")
+
+    timings = {}
+    started = time.perf_counter()
+    init_db.init()
+    with database.engine.connect() as conn:
+        if conn.execute(select(models.User.id).where(models.User.username.like("load\\_%", escape="\\")).limit(1)).first():
+            raise SystemExit("The database is already seeded; seed a fresh one")
+    rng = random.Random(args.seed)
+    hashed_password = auth.get_password_hash(args.password)
+    user_ids = seed_users(database.engine, args.tenants, args.users, args.staff_share, hashed_password, rng)
+    timings["users_s"] = round(time.perf_counter() - started, 1)
+
+    step = time.perf_counter()
+    seed_activities(database.engine, user_ids, args.activities, args.days, rng)
+    timings["activities_s"] = round(time.perf_counter() - step, 1)
+
+    step = time.perf_counter()
+    counters.reconcile()
+    compacted = rollups.compact()
+    timings["counters_and_rollups_s"] = round(time.perf_counter() - step, 1)
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "url": database.engine.url.render_as_string(hide_password=True),
+        "users": len(user_ids),
+        "tenants": min(args.tenants, args.users),
+        "activities": args.activities,
+        "password": args.password,
+        "rollup_buckets": compacted,
+        "seconds": timings,
+        "rows_per_sec": round((len(user_ids) + args.activities) / elapsed),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Broadcast latency to many connected dashboards: the former serial
+`await send_text` loop against ConnectionManager's per-connection queues
+and writer tasks. Sockets are in-process stand-ins whose send yields to
+the event loop; a few of them are slow (--slow-delay per send), as a
+dashboard on a poor network would be.
+
+Reports how long the broadcast call holds the caller, and the delivery
+latency (broadcast start to send completed) for fast and slow clients.
+Also compares the cost of a broadcast to one of --tenants tenants through
+the (topic, tenant) subscription index with a scan of every socket and
+with an untargeted broadcast to every admin, as alerts used to be sent.
+
+    python -m benchmarks.websocket_fanout --connections 5000 --slow 10 --tenants 100
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.websocket import ConnectionManager
+
+class Countdown:
+    def __init__(self):
+        self.remaining = 0
+        self.done = asyncio.Event()
+
+    def reset(self, count: int):
+        self.remaining = count
+        self.done.clear()
+
+    def tick(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set()
+
+class FakeWebSocket:
+    def __init__(self, delay: float, countdown: Countdown):
+        self.delay = delay
+        self.countdown = countdown
+        self.received_at = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        # A real send yields at least once to the event loop
+        await asyncio.sleep(self.delay)
+        self.received_at.append(time.perf_counter())
+        self.countdown.tick()
+
+    async def close(self, code: int = 1000):
+        pass
+
+def percentiles(samples_ms):
+    samples_ms = sorted(samples_ms)
+    def pick(q):
+        return round(samples_ms[min(int(q * len(samples_ms)), len(samples_ms) - 1)], 2)
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(samples_ms[-1], 2)}
+
+async def serial_broadcast(sockets, message: str):
+    # What broadcast_to_type used to do
+    for websocket in sockets:
+        await websocket.send_text(message)
+
+async def run(mode: str, connections: int, slow: int, slow_delay: float, messages: int):
+    countdown = Countdown()
+    sockets = [FakeWebSocket(slow_delay if i < slow else 0, countdown) for i in range(connections)]
+    manager = ConnectionManager(queue_size=256, slow_consumer_policy="drop_oldest", send_timeout=30)
+    for websocket in sockets:
+        await manager.connect(websocket, "admin")
+    message = json.dumps({"type": "security_alert", "data": {"user_id": 1, "action": "failed_login"}})
+
+    call_ms, fast_ms, slow_ms = [], [], []
+    for _ in range(messages):
+        for websocket in sockets:
+            websocket.received_at.clear()
+        countdown.reset(len(sockets))
+        started = time.perf_counter()
+        if mode == "serial":
+            await serial_broadcast(sockets, message)
+        else:
+            await manager.broadcast(message, "alerts")
+        call_ms.append((time.perf_counter() - started) * 1000)
+        await countdown.done.wait()
+        for i, websocket in enumerate(sockets):
+            (slow_ms if i < slow else fast_ms).append((websocket.received_at[0] - started) * 1000)
+
+    for websocket in sockets:
+        manager.disconnect(websocket)
+    return {
+        "broadcast_call_ms": round(statistics.median(call_ms), 2),
+        "fast_clients": percentiles(fast_ms),
+        "slow_clients": percentiles(slow_ms) if slow_ms else None,
+    }
+
+async def tenant_broadcast(connections: int, tenants: int, messages: int):
+    countdown = Countdown()
+    manager = ConnectionManager(queue_size=messages + 1, slow_consumer_policy="drop_oldest", send_timeout=30)
+    for i in range(connections):
+        await manager.connect(FakeWebSocket(0, countdown), "admin", f"tenant{i % tenants}.example")
+    message = json.dumps({"type": "security_alert", "data": {"user_id": 1, "action": "failed_login"}})
+    tenant = "tenant0.example"
+
+    def scan():
+        # Sockets grouped only by client type: every socket is visited
+        for client in list(manager._clients.values()):
+            if client.tenant == tenant:
+                manager._enqueue(client, message)
+
+    indexed_ms, scan_ms, everyone_ms = [], [], []
+    for _ in range(messages):
+        started = time.perf_counter()
+        await manager.broadcast(message, "alerts", tenant)
+        indexed_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        scan()
+        scan_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        await manager.broadcast(message, "alerts")
+        everyone_ms.append((time.perf_counter() - started) * 1000)
+        # Let the writers drain
+        await asyncio.sleep(0)
+
+    for websocket in list(manager._clients):
+        manager.disconnect(websocket)
+    return {
+        "tenants": tenants,
+        "recipients": -(-connections // tenants),
+        "indexed_call_ms": round(statistics.median(indexed_ms), 3),
+        "scan_call_ms": round(statistics.median(scan_ms), 3),
+        "all_tenants_call_ms": round(statistics.median(everyone_ms), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=10, help="number of slow clients")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="seconds per send for slow clients")
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--tenants", type=int, default=100)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        "connections": args.connections,
+        "slow_clients": args.slow,
+        "slow_delay_ms": args.slow_delay * 1000,
+        "serial": asyncio.run(run("serial", args.connections, args.slow, args.slow_delay, args.messages)),
+        "queued": asyncio.run(run("queued", args.connections, args.slow, args.slow_delay, args.messages)),
+        "tenant_broadcast": asyncio.run(tenant_broadcast(args.connections, args.tenants, 50)),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Event loop lag while WebSocket clients stream activity_log frames: the
+former receive loop, which wrote each event with the synchronous
+log_activity on the event loop, against the ingest pipeline
+(app/ws_ingest.py), which queues frames and writes them in its own threads
+with multi-row INSERTs.
+
+--connections client coroutines each send --events frames, as fast as the
+loop lets them or at --rate frames per second in total. A LoopLagMonitor sampling every 5 ms measures how late the
+loop runs, which is how long every other socket and async request of the
+worker would be held up. Also reports events/s and, for the pipeline, the
+frame-to-acknowledgement latency. SQLite serializes writers, so use
+--workers 1 against it; more workers only contend for its lock.
+
+    python -m benchmarks.websocket_ingest --connections 50 --events 200 --workers 1
+    python -m benchmarks.websocket_ingest --connections 50 --events 100 --rate 2000 --workers 1
+"""
+import argparse
+import asyncio
+import gc
+import json
+import time
+from datetime import datetime, UTC
+from functools import partial
+
+from sqlalchemy.orm import sessionmaker
+
+from app import activity
+from app.config import settings
+from app.database import Base
+from app.loop_lag import LoopLagMonitor
+from app.ws_ingest import IngestPipeline
+from .common import DEFAULT_URL, make_engine, seed_users
+from .websocket_fanout import percentiles
+
+async def inline_client(session_factory, user_id: int, events: int, pause: float):
+    # What websocket_endpoint did for every activity_log frame
+    for _ in range(events):
+        db = session_factory()
+        try:
+            activity.log_activity(db=db, user_id=user_id, action="file_download", details="bench", wait=False)
+        finally:
+            db.close()
+        await asyncio.sleep(pause)
+
+async def pipeline_client(pipeline: IngestPipeline, user_id: int, events: int, pause: float, ack_ms: list, pending: list):
+    async def on_done(sent: float, result: dict):
+        ack_ms.append((time.perf_counter() - sent) * 1000)
+        pending[0] -= 1
+        if not pending[0]:
+            pending[1].set()
+
+    for _ in range(events):
+        row = {"user_id": user_id, "action": "file_download", "details": "bench", "timestamp": datetime.now(UTC)}
+        callback = partial(on_done, time.perf_counter())
+        while not pipeline.submit_event(row, user_id, None, callback):
+            # Busy: a real client would retry after the rejection
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(pause)
+
+async def run(mode: str, session_factory, user_ids, connections: int, events: int, rate: float = 0, workers: int = 1):
+    # Each client sends every `pause` seconds so that all of them together send `rate` frames/s
+    pause = connections / rate if rate else 0
+    monitor = LoopLagMonitor(interval=0.005, window=1_000_000)
+    monitor.start()
+    ack_ms = []
+    started = time.perf_counter()
+    if mode == "inline":
+        await asyncio.gather(*(
+            inline_client(session_factory, user_ids[i % len(user_ids)], events, pause) for i in range(connections)
+        ))
+    else:
+        pipeline = IngestPipeline(workers=workers, session_factory=session_factory)
+        pipeline.start()
+        pending = [connections * events, asyncio.Event()]
+        await asyncio.gather(*(
+            pipeline_client(pipeline, user_ids[i % len(user_ids)], events, pause, ack_ms, pending)
+            for i in range(connections)
+        ))
+        await pending[1].wait()
+        await pipeline.stop()
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    lag = monitor.snapshot()
+    return {
+        "events_per_sec": round(connections * events / elapsed),
+        "loop_lag_p50_ms": lag["p50_ms"],
+        "loop_lag_p99_ms": lag["p99_ms"],
+        "loop_lag_max_ms": lag["max_ms"],
+        "ack": percentiles(ack_ms) if ack_ms else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--events", type=int, default=200, help="frames per connection")
+    parser.add_argument("--rate", type=float, default=0, help="frames per second across all connections (0: unpaced)")
+    parser.add_argument("--workers", type=int, default=settings.ws_ingest_workers, help="ingest pipeline workers")
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        user_ids = seed_users(conn, 100)
+    # As app.main does after startup
+    gc.collect()
+    gc.freeze()
+
+    print(json.dumps({
+        "connections": args.connections,
+        "events": args.connections * args.events,
+        "rate": args.rate or None,
+        "inline": asyncio.run(run("inline", session_factory, user_ids, args.connections, args.events, args.rate)),
+        "pipeline": asyncio.run(run(
+            "pipeline", session_factory, user_ids, args.connections, args.events, args.rate, args.workers
+        )),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
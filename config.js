@@ -107,7 +107,7 @@ const API = {
     getUrl: (endpoint) => `${CONFIG.API_BASE_URL}${endpoint}`,
     
     // Get WebSocket URL
-    getWsUrl: (clientType) => `${CONFIG.WS_BASE_URL}/ws/${clientType}`,
+    getWsUrl: (clientType) => `${CONFIG.WS_BASE_URL}/ws/${clientType}?token=${encodeURIComponent(API.getToken() || '')}`,
     
     // Get stored token
     getToken: () => localStorage.getItem(CONFIG.TOKEN_KEY),